@@ -1,27 +1,39 @@
 import os
-import requests
 from dotenv import load_dotenv
-import googlemaps
+import numpy as np
 from datetime import datetime
-from IPython.display import Image, display
+
+from cache import TTLCache
+from clients import ProcessLocal
+from maps_transport import session_from_env
+from route_fetch import fetch_modes, route_executor
+from factors import FactorRegistry, source_from_env
+from route_optimizer import DEFAULT_TIME_BUDGET, optimize_route
 
 # Load environment variables
 load_dotenv()
 
 # Replace with your Google API Key
 API_KEY = os.getenv("API_KEY")
-if not API_KEY:
-    raise ValueError("API_KEY not found in .env file!")
 
-gmaps = googlemaps.Client(key=API_KEY)
+def connect_maps():
+    """googlemaps.Client for this process, built on first use."""
+    if not API_KEY:
+        raise ValueError("API_KEY not found in .env file!")
+    import googlemaps
+
+    return googlemaps.Client(key=API_KEY, requests_session=maps_session.instance())
+
+maps_session = ProcessLocal(session_from_env)
+gmaps = ProcessLocal(connect_maps)
+
+# Emission factors (grams CO₂ per km), shared with the backend through
+# FACTORS_SOURCE (see factors.py); this script has no database, so
+# FACTORS_SOURCE=mongo falls back to the built-in set
+factor_registry = FactorRegistry(source_from_env())
 
-# Emission factors (grams CO₂ per km)
-EMISSION_FACTORS = {
-    "driving": 180,   # Average car emissions
-    "transit": 80,    # Bus emissions
-    "walking": 0,     # Walking has no emissions
-    "bicycling":  0   # Bicycling has no emissions
-}
+# Distance Matrix pairs reused across optimizations in one session
+matrix_cache = TTLCache("matrix", maxsize=10000, ttl=3600)
 
 def geocode_address(address):
     """Geocode an address to validate and get its latitude and longitude."""
@@ -35,52 +47,39 @@ def geocode_address(address):
         print(f"Error geocoding address '{address}': {e}")
         return None
 
-def get_route_optimization(origins, destinations):
-    """Optimize routes for multiple locations (Route Optimization API)."""
+def get_route_optimization(origins, destinations, mode="driving", objective="time",
+                           time_budget=DEFAULT_TIME_BUDGET):
+    """Optimize the order of stops for a multi-stop trip.
+
+    The trip starts at `origins[0]`, ends at `destinations[-1]` and visits
+    `destinations[1:-1]` (the waypoints it always took) in the best order
+    for `objective` ("time", "distance" or "co2"). Returns the plan from
+    `route_optimizer.optimize_route`, or None if it couldn't be computed.
+    """
+    stops = list(destinations[1:-1])
     try:
-        # Request optimized route
-        optimization_result = gmaps.directions(
-            origin=origins[0],
-            destination=destinations[-1],
-            waypoints=destinations[1:-1],
-            mode="driving",
-            optimize_waypoints=True  # Optimize the order of waypoints
+        plan = optimize_route(
+            gmaps.distance_matrix,
+            origins[0],
+            destinations[-1],
+            stops,
+            mode=mode,
+            objective=objective,
+            emission_factors=factor_registry.current().emission,
+            cache=matrix_cache,
+            time_budget=time_budget
         )
-        
-        if optimization_result:
-            optimized_route = optimization_result[0]["legs"][0]
-            distance = optimized_route["distance"]["text"]  # e.g., "12.3 km"
-            duration = optimized_route["duration"]["text"]  # e.g., "35 mins"
-            print(f"Optimized Distance: {distance}")
-            print(f"Optimized Duration: {duration}")
-        else:
-            print("No optimized route found.")
-    
     except Exception as e:
-        print(f"Error fetching optimized route: {e}")
+        print(f"Error optimizing route: {e}")
+        return None
+    if plan.get("error"):
+        print(f"Error optimizing route: {plan['error']}")
+        return None
+    return plan
 
 def fetch_route_data(origin, destination, modes):
-    """Fetch route data for multiple transportation modes."""
-    routes = {}
-    for mode in modes:
-        try:
-            directions = gmaps.directions(
-                origin=origin,
-                destination=destination,
-                mode=mode
-            )
-            if directions:
-                route = directions[0]["legs"][0]
-                distance_km = route["distance"]["value"] / 1000  # Convert to km
-                duration_min = route["duration"]["value"] / 60  # Convert to minutes
-                routes[mode] = {
-                    "distance_km": distance_km,
-                    "duration_min": duration_min
-                }
-            else:
-                print(f"No route found for mode '{mode}'.")
-        except Exception as e:
-            print(f"Error fetching data for mode '{mode}': {e}")
+    """Fetch route data for multiple transportation modes concurrently."""
+    routes, _ = fetch_modes(gmaps.directions, origin, destination, modes)
     return routes
 
 def get_traffic_route_data(origin, destination):
@@ -110,32 +109,34 @@ def get_traffic_route_data(origin, destination):
         print(f"Error fetching traffic data: {e}")
 
 def calculate_carbon_footprint(routes):
-    """Calculate carbon footprints for each mode."""
-    footprints = {}
-    for mode, data in routes.items():
-        distance = data["distance_km"]
-        emissions = EMISSION_FACTORS.get(mode, 0)
-        footprints[mode] = distance * emissions  # Total CO₂ in grams
-    return footprints
+    """Carbon footprints (grams of CO₂) for each mode of a RouteSet, step by step
+    with the per-vehicle factors, as the API scores them."""
+    vehicle_table = factor_registry.current().tables().vehicle
+    footprints = routes.alternative_footprints(vehicle_table)[routes.primary]
+    return dict(zip(routes.modes, footprints.tolist()))
 
 def suggest_eco_friendly_route(footprints, routes, max_duration=None):
     """Suggest the most eco-friendly route within time constraints."""
-    # Filter routes based on time constraints
-    filtered_routes = {
-        mode: data for mode, data in routes.items()
-        if max_duration is None or data["duration_min"] <= max_duration
-    }
+    row = routes.eco_row(np.array([footprints[mode] for mode in routes.modes]), max_duration)
 
-    if not filtered_routes:
+    if row < 0:
         print("No routes meet the time constraint.")
         return None, None
 
     # Find the most eco-friendly route
-    filtered_footprints = {
-        mode: footprints[mode] for mode in filtered_routes.keys()
-    }
-    eco_friendly_mode = min(filtered_footprints, key=filtered_footprints.get)
-    return eco_friendly_mode, filtered_routes[eco_friendly_mode]
+    return routes.modes[row], routes.options[row]
+
+def show_image(content, path="route_map.png"):
+    """Show a PNG inline under IPython, or save it to `path` elsewhere."""
+    try:
+        # Only notebooks need IPython; importing it costs more than the rest of this script
+        from IPython.display import Image, display
+    except ImportError:
+        with open(path, "wb") as f:
+            f.write(content)
+        print(f"Map saved to {path}")
+        return
+    display(Image(content))
 
 # Function to display the map
 def display_map_route(origin, destination, waypoints=[]):
@@ -163,11 +164,11 @@ def display_map_route(origin, destination, waypoints=[]):
      # Optional: print the URL for debugging
 
     # Fetch the static map
-    response = requests.get(static_map_url)
+    response = maps_session.get(static_map_url)
 
     if response.status_code == 200:
         # Display the map
-        display(Image(response.content))
+        show_image(response.content)
     else:
         print("Error fetching map.")
 
@@ -182,25 +183,28 @@ def display_map_route(origin, destination, waypoints=[]):
 
     static_map_url += f"&key={API_KEY}"
     print(static_map_url)
-    response = requests.get(static_map_url)
+    response = maps_session.get(static_map_url)
 
     if response.status_code == 200:
       
-        display(Image(response.content))
+        show_image(response.content)
     else:
         print("Error fetching map.")
 
 # Main program
 if __name__ == "__main__":
+    if not API_KEY:
+        raise SystemExit("API_KEY not found in .env file!")
     print("Welcome to the Eco-Friendly Route Finder!")
     
     # Collect user inputs
     origin = input("Enter your starting point: ").strip()
     destination = input("Enter your destination: ").strip()
     
-    # Validate addresses
-    origin = geocode_address(origin)
+    # Validate both addresses at the same time
+    origin_future = route_executor.submit(geocode_address, origin)
     destination = geocode_address(destination)
+    origin = origin_future.result()
 
     if not origin or not destination:
         print("Error: Unable to resolve one or both addresses. Please try again.")
@@ -233,17 +237,17 @@ if __name__ == "__main__":
     if eco_route:
         print("\nMost Eco-Friendly Route:")
         print(f"Mode: {eco_friendly_mode.capitalize()}")
-        print(f"Distance: {eco_route['distance_km']:.2f} km")
-        print(f"Duration: {eco_route['duration_min']:.2f} minutes")
+        print(f"Distance: {eco_route.distance_km:.2f} km")
+        print(f"Duration: {eco_route.duration_min:.2f} minutes")
         print(f"Carbon Footprint: {footprints[eco_friendly_mode] / 1000:.2f} kg CO₂")
     else:
         print("No routes found meeting your time constraint.")
 
     print("\nAll Routes:")
-    for mode, route in routes.items():
+    for mode, route in zip(routes.modes, routes):
         print(f"\nMode: {mode.capitalize()}")
-        print(f"  Distance: {route['distance_km']:.2f} km")
-        print(f"  Duration: {route['duration_min']:.2f} minutes")
+        print(f"  Distance: {route.distance_km:.2f} km")
+        print(f"  Duration: {route.duration_min:.2f} minutes")
         print(f"  Carbon Footprint: {footprints[mode] / 1000:.2f} kg CO₂")
 
     display_map_route(origin, destination)
@@ -0,0 +1,680 @@
+"""ASGI entry point that serves the backend on a single event loop.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+The hot routes (`/calculate_route_points`, `/get_leaderboard`,
+`/get_user_points`, `/signup`, `/login`, `/updatepassword`) run natively
+async: Google Maps calls go through httpx and Mongo through Motor, so one
+process keeps many requests in flight while they wait on the network. Every
+other route (and CORS preflight) falls through to the Flask app in
+`newapp.py` on a thread pool. JSON contracts are the same as the Flask
+routes; scoring, caches and the leaderboard are shared with `newapp`.
+`/users/<name>/trips` is also native, so the NDJSON export streams from a
+Motor cursor instead of being buffered by the fall-through, and so is the
+`/events` push stream, which would otherwise hold a thread per client.
+Native routes send the same `Server-Timing` breakdown as Flask's (see
+metrics.py); work they hand to threads is wrapped in `metrics.propagate`.
+"""
+import asyncio
+import functools
+import io
+import json
+import os
+import re
+import time
+from urllib.parse import parse_qs, urlencode
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+
+import metrics
+import newapp
+from cache import MISSING, TieredCache, make_key, normalize_address
+from events import EVENTS_KEEPALIVE_SECONDS, StreamState, keepalive_frame, retry_frame
+from local_routing import FallbackDirections, is_local
+from maps_http import MAPS_BASE_URL, AsyncMapsClient
+from route_fetch import LOCAL_DIRECTIONS_CACHE_TTL, MODE_TIMEOUT_SECONDS
+from route_model import RouteOption, RouteSet, dumps
+from trips import EXPORT_BATCH_SIZE, TRIPS_COLLECTION, export_query, to_json_line, trip_document
+from user_points import USER_TOTALS_PROJECTION, award_filter, award_update
+
+# Created on startup, inside the serving event loop
+maps = None
+users_collection = None
+trips_collection = None
+
+TRIPS_EXPORT_PATH = re.compile(r"^/users/([^/]+)/trips$")
+
+
+class Request:
+    """The parts of an ASGI HTTP request the handlers need."""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = {
+            name: values[-1]
+            for name, values in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()
+        }
+        self.headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in scope.get("headers", [])
+        }
+
+    @property
+    def json(self):
+        try:
+            return json.loads(self.body or b"null")
+        except ValueError:
+            return None
+
+    def url_root(self):
+        scheme = self.scope.get("scheme", "http")
+        host = self.headers.get("host")
+        if not host:
+            server = self.scope.get("server") or ("localhost", 80)
+            host = f"{server[0]}:{server[1]}"
+        return f"{scheme}://{host}"
+
+
+def json_response(payload, status=200, headers=None):
+    return status, payload, headers or {}
+
+
+def shared(cache):
+    """Whether `cache` has a shared (Mongo) tier, which pymongo reads and writes blocking."""
+    return isinstance(cache, TieredCache)
+
+
+async def cache_get(cache, key):
+    """`cache.get(key)`; a miss in the local tier reads the shared one on a thread."""
+    if not shared(cache):
+        return cache.get(key)
+    value = cache.local.get(key)
+    if value is MISSING:
+        value = await asyncio.get_running_loop().run_in_executor(None, metrics.propagate(cache.get_shared), key)
+    return value
+
+
+def cache_set(cache, key, value, ttl=None):
+    """`cache.set(...)`; the shared tier is written behind, on a thread."""
+    if not shared(cache):
+        return cache.set(key, value, ttl)
+    cache.local.set(key, value, ttl)
+    asyncio.get_running_loop().run_in_executor(None, cache.set_shared, key, value, ttl)
+
+
+async def current_factors():
+    """newapp.factor_registry.current(), on a thread when it may wait for its source."""
+    if newapp.factor_registry.due():
+        return await asyncio.get_running_loop().run_in_executor(
+            None, metrics.propagate(newapp.factor_registry.current)
+        )
+    return newapp.factor_registry.current()
+
+
+async def geocode_address(address):
+    """Async twin of newapp.geocode_address, sharing its cache."""
+    key = make_key("geocode", normalize_address(address))
+    cached = await cache_get(newapp.geocode_cache, key)
+    if cached is not MISSING:
+        return cached
+    return await newapp.geocode_flight.do_async(key, fetch_geocode, address, key)
+
+
+async def fetch_geocode(address, key):
+    try:
+        with metrics.timed("geocode"):
+            geocode_result = await maps.geocode(address)
+        if not geocode_result:
+            cache_set(newapp.geocode_cache, key, None, ttl=newapp.GEOCODE_NEGATIVE_TTL)
+            return None
+        formatted_address = geocode_result[0]["formatted_address"]
+    except Exception as e:
+        print(f"Error geocoding address '{address}': {e}")
+        return None
+    cache_set(newapp.geocode_cache, key, formatted_address)
+    cache_set(newapp.geocode_cache, make_key("geocode", normalize_address(formatted_address)), formatted_address)
+    location = geocode_result[0].get("geometry", {}).get("location")
+    if location:
+        cache_set(newapp.geocode_cache, make_key("location", formatted_address), [location["lat"], location["lng"]])
+    return formatted_address
+
+
+async def local_directions(origin, destination, mode):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, metrics.propagate(
+        functools.partial(newapp.routing.instance()[1], origin=origin, destination=destination, mode=mode)
+    ))
+
+
+async def timed_directions(origin, destination, mode):
+    """Directions per newapp.ROUTING_BACKEND; the local router runs on a thread."""
+    directions, local = newapp.routing.instance()
+    fallback = directions if isinstance(directions, FallbackDirections) else None
+    if newapp.ROUTING_BACKEND == "local" and local is not None:
+        return await local_directions(origin, destination, mode)
+    if fallback is not None and fallback.use_fallback():
+        return await local_directions(origin, destination, mode)
+    start = time.monotonic()
+    try:
+        with metrics.timed("directions", mode=mode):
+            result = await maps.directions(origin, destination, mode=mode, alternatives=True)
+    except Exception as e:
+        if fallback is None:
+            raise
+        fallback.report(time.monotonic() - start, failed=True)
+        print(f"Primary directions failed ({e}); using local routing for {fallback.cooldown:g}s.")
+        return await local_directions(origin, destination, mode)
+    if fallback is not None:
+        fallback.report(time.monotonic() - start)
+    return result
+
+
+async def cached_leg(origin, destination, mode):
+    """A cached or nearby route for one mode, or MISSING."""
+    leg = await cache_get(newapp.directions_cache, make_key("directions", origin, destination, mode))
+    if leg is MISSING and newapp.nearby_routes is not None:
+        if shared(newapp.geocode_cache):
+            # Locating the endpoints may read the shared geocode tier
+            leg = await asyncio.get_running_loop().run_in_executor(
+                None, metrics.propagate(newapp.nearby_routes.lookup), origin, destination, mode
+            )
+        else:
+            leg = newapp.nearby_routes.lookup(origin, destination, mode)
+        leg = leg or MISSING
+    return leg
+
+
+async def fetch_route_data(origin, destination, modes, timeout=MODE_TIMEOUT_SECONDS):
+    """Async twin of newapp.fetch_route_data: all modes concurrently, each with a timeout."""
+    routes = {}
+    no_route = set()
+    pending = []
+    modes = list(dict.fromkeys(modes))
+    cached = await asyncio.gather(*(cached_leg(origin, destination, mode) for mode in modes))
+    for mode, leg in zip(modes, cached):
+        if leg is not MISSING:
+            routes[mode] = leg
+        else:
+            pending.append(mode)
+
+    results = await asyncio.gather(
+        *(
+            asyncio.wait_for(
+                newapp.directions_flight.do_async(
+                    newapp.directions_key(origin, destination, mode), timed_directions,
+                    origin, destination, mode
+                ),
+                timeout
+            )
+            for mode in pending
+        ),
+        return_exceptions=True
+    )
+    for mode, directions in zip(pending, results):
+        if isinstance(directions, asyncio.TimeoutError):
+            print(f"Timed out fetching data for mode '{mode}' after {timeout:g}s.")
+        elif isinstance(directions, BaseException):
+            print(f"Error fetching data for mode '{mode}': {directions!r}")
+        elif directions:
+            local = is_local(directions)
+            routes[mode] = RouteOption.from_directions(directions, mode)
+            cache_set(newapp.directions_cache, make_key("directions", origin, destination, mode), routes[mode],
+                      ttl=LOCAL_DIRECTIONS_CACHE_TTL if local else None)
+            nearby = newapp.nearby_routes if not local else None
+            if nearby is not None and shared(newapp.geocode_cache):
+                asyncio.get_running_loop().run_in_executor(None, nearby.add, origin, destination, mode, routes[mode])
+            elif nearby is not None:
+                nearby.add(origin, destination, mode, routes[mode])
+        else:
+            print(f"No route found for mode '{mode}'.")
+            no_route.add(mode)
+    return RouteSet(routes[mode] for mode in modes if mode in routes), no_route
+
+
+async def calculate_route_points(request):
+    data = request.json or {}
+    username = data.get('username')
+    modes = data.get('modes', [])
+    factors = await current_factors()
+    region = factors.region_of(data.get('region'))
+
+    # Geocode both addresses at the same time
+    origin, destination = await asyncio.gather(
+        geocode_address(data.get('origin')),
+        geocode_address(data.get('destination'))
+    )
+    if not origin or not destination:
+        return json_response({"error": "Invalid addresses"}, 400)
+
+    # Validate modes
+    invalid_modes = [mode for mode in modes if mode not in factors.points]
+    if invalid_modes:
+        return json_response({"error": f"Invalid modes: {invalid_modes}"}, 400)
+
+    routes, no_route = await fetch_route_data(origin, destination, modes)
+    if not routes:
+        return json_response({"error": "No routes found"}, 404)
+
+    route_details, total_points, eco_friendly_route, pareto_routes = newapp.score_routes(routes, factors, region)
+
+    # Award points and trip counters in one atomic round trip
+    trip_id = data.get('trip_id')
+    mode_points = {detail["mode"]: detail["points_earned"] for detail in route_details}
+    user = await users_collection.find_one_and_update(
+        award_filter(username, trip_id),
+        award_update(mode_points, trip_id),
+        projection=USER_TOTALS_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    duplicate = False
+    if user is None and trip_id is not None:
+        user = await users_collection.find_one({"username": username}, USER_TOTALS_PROJECTION)
+        duplicate = user is not None
+    if user is None:
+        return json_response({"error": "User not found"}, 404)
+    current_points = user.get('sustainability_points', total_points)
+    await asyncio.to_thread(newapp.leaderboard.record, username, current_points)
+    # Queued for the job workers (see jobs.py); a SQLite write, so off the loop
+    loop = asyncio.get_running_loop()
+    jobs = {
+        "trip_history": None,
+        "map_image": await loop.run_in_executor(None, newapp.prefetch_map, origin, destination, username)
+    }
+    if not duplicate:
+        newapp.publish_points(username, current_points, total_points, trip_id)
+        jobs["trip_history"] = await loop.run_in_executor(None, newapp.record_trips, [trip_document(
+            username, origin, destination, route_details,
+            eco_friendly_route["mode"] if eco_friendly_route else None,
+            factors.tables(region).driving, trip_id, factors=factors.version, region=region
+        )], username)
+
+    key, map_params = newapp.map_image_params(origin, destination)
+    return json_response({
+        "message": "Trip already recorded" if duplicate else "Points calculated and updated",
+        "duplicate_trip": duplicate,
+        "route_details": route_details,
+        "total_points_earned": 0 if duplicate else total_points,
+        "total_points": current_points,
+        "eco_friendly_route": eco_friendly_route,
+        "pareto_routes": pareto_routes,
+        "factors": {"version": factors.version, "region": region},
+        "map_key": key,
+        "map_image_url": f"{request.url_root()}/map_image?" + urlencode(map_params),
+        "jobs": jobs
+    })
+
+
+async def get_leaderboard(request):
+    loop = asyncio.get_running_loop()
+    try:
+        username = request.args.get('username')
+        if username:
+            result = await loop.run_in_executor(None, metrics.propagate(newapp.leaderboard.rank_of), username)
+            if result is None:
+                return json_response({"error": "User not found"}, 404)
+            rank, points = result
+            return json_response({
+                "username": username,
+                "rank": rank,
+                "sustainability_points": points
+            })
+
+        try:
+            offset = max(int(request.args.get('offset', 0)), 0)
+            limit = int(request.args.get('limit', 10))
+        except ValueError:
+            offset, limit = 0, 10
+        limit = min(max(limit, 1), newapp.MAX_LEADERBOARD_PAGE)
+        entries, version, etag = await loop.run_in_executor(
+            None, metrics.propagate(newapp.leaderboard.page), offset, limit
+        )
+
+        headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+        if f'"{etag}"' in request.headers.get('if-none-match', ''):
+            return 304, None, headers
+        return json_response({
+            "leaderboard": entries,
+            "version": version,
+            "offset": offset,
+            "limit": limit
+        }, 200, headers)
+
+    except Exception as e:
+        print(f"Error retrieving leaderboard: {e}")
+        return json_response({
+            "error": "Unable to retrieve leaderboard",
+            "details": str(e),
+            "leaderboard": []
+        }, 500)
+
+
+async def signup(request):
+    data = request.json or {}
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return json_response({"error": "Username and password are required"}, 400)
+
+    if await users_collection.find_one({"username": username}):
+        return json_response({"error": "User already exists"}, 409)
+
+    await users_collection.insert_one({
+        "username": username,
+        "password": password,
+        "sustainability_points": 0,
+        "transit_trips": 0,
+        "walking_trips": 0,
+        "driving_trips": 0,
+        "bicycling_trips": 0
+    })
+    await asyncio.to_thread(newapp.leaderboard.record, username, 0)
+    return json_response({"message": "Signup successful"}, 201)
+
+
+async def login(request):
+    data = request.json or {}
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return json_response({"error": "Username and password are required"}, 400)
+
+    user = await users_collection.find_one({"username": username, "password": password})
+    if user:
+        return json_response({
+            "message": "Login successful",
+            "username": username,
+            "sustainability_points": user.get('sustainability_points', 0)
+        })
+    return json_response({"error": "Invalid username or password"}, 401)
+
+
+async def get_user_points(request):
+    username = request.args.get('username')
+    if not username:
+        return json_response({"error": "Username is required"}, 400)
+
+    user = await users_collection.find_one({"username": username})
+    if not user:
+        return json_response({"error": "User not found"}, 404)
+    return json_response({
+        "username": username,
+        "sustainability_points": user.get('sustainability_points', 0),
+        "walking_trips": user.get('walking_trips', 0),
+        "driving_trips": user.get('driving_trips', 0),
+        "transit_trips": user.get('transit_trips', 0),
+        "bicycling_trips": user.get('bicycling_trips', 0)
+    })
+
+
+async def update_password(request):
+    data = request.json or {}
+    username = data.get('username')
+    old_password = data.get('old_password')
+    new_password = data.get('new_password')
+    if not username or not old_password or not new_password:
+        return json_response({"error": "Username, old password and new password are required"}, 400)
+
+    result = await users_collection.update_one(
+        {"username": username, "password": old_password},
+        {"$set": {"password": new_password}}
+    )
+    if not result.matched_count:
+        return json_response({"error": "Invalid old password"}, 401)
+    return json_response({"message": "Password updated successfully"})
+
+
+async def export_trips(scope, send, username):
+    """Stream a user's trips as NDJSON, one chunk per cursor batch."""
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    try:
+        since = newapp.parse_timestamp(query.get("since", [None])[0])
+        until = newapp.parse_timestamp(query.get("until", [None])[0])
+    except ValueError:
+        body = dumps({"error": "since and until must be ISO 8601 timestamps"})
+        return await send_response(send, 400, [
+            ("Access-Control-Allow-Origin", "*"), ("Content-Type", "application/json")
+        ], body)
+
+    cursor = trips_collection.find(export_query(username, since, until)) \
+        .sort("ts", 1).batch_size(EXPORT_BATCH_SIZE)
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"access-control-allow-origin", b"*"), (b"content-type", b"application/x-ndjson")]
+    })
+    try:
+        while True:
+            batch = await cursor.to_list(EXPORT_BATCH_SIZE)
+            if not batch:
+                break
+            chunk = "".join(to_json_line(trip) for trip in batch).encode("utf-8")
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        await cursor.close()
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def event_stream(scope, receive, send):
+    """Native twin of newapp.event_stream: one task per client, no threads."""
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    try:
+        limit = int(query.get("limit", [10])[-1])
+    except ValueError:
+        limit = 10
+    state = StreamState(query.get("username", [None])[-1], min(max(limit, 1), newapp.MAX_LEADERBOARD_PAGE))
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, newapp.change_feed.instance)
+
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def send_frame(frame):
+        await send({"type": "http.response.body", "body": frame.encode("utf-8"), "more_body": True})
+
+    async def snapshot():
+        await send_frame(await loop.run_in_executor(None, state.snapshot, newapp.leaderboard))
+
+    async def stream():
+        await send_frame(retry_frame())
+        await snapshot()
+        while True:
+            if not await subscription.wait_async(EVENTS_KEEPALIVE_SECONDS):
+                await send_frame(keepalive_frame())
+                continue
+            events, overflowed = subscription.drain()
+            frames = None if overflowed else state.frames(events)
+            if frames is None:
+                await snapshot()
+            elif frames:
+                await send_frame("".join(frames))
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"access-control-allow-origin", b"*"),
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no")
+        ]
+    })
+    # Subscribe before the snapshot, so nothing between the two is missed
+    subscription = newapp.event_bus.subscribe(state.topics(), loop=loop)
+    tasks = [asyncio.ensure_future(stream()), asyncio.ensure_future(wait_for_disconnect())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                print(f"Error in event stream: {task.exception()}")
+    finally:
+        newapp.event_bus.unsubscribe(subscription)
+        for task in tasks:
+            task.cancel()
+
+
+ROUTES = {
+    ("POST", "/calculate_route_points"): calculate_route_points,
+    ("GET", "/get_leaderboard"): get_leaderboard,
+    ("POST", "/signup"): signup,
+    ("POST", "/login"): login,
+    ("GET", "/get_user_points"): get_user_points,
+    ("POST", "/updatepassword"): update_password,
+}
+
+
+async def startup():
+    global maps, users_collection, trips_collection
+    maps = AsyncMapsClient(
+        newapp.API_KEY,
+        base_url=os.getenv("MAPS_BASE_URL", MAPS_BASE_URL),
+        # One Maps quota per process, shared with the Flask fall-through
+        rate_limiter=newapp.maps_session.rate_limiter
+    )
+    mongo = AsyncIOMotorClient(
+        newapp.MONGO_URI,
+        maxPoolSize=int(os.getenv("MONGO_MAX_POOL", 100)),
+        event_listeners=[metrics.MongoCommandTimer()]
+    )
+    users_collection = mongo[newapp.MONGO_DB][newapp.USERS_COLLECTION]
+    trips_collection = mongo[newapp.MONGO_DB][TRIPS_COLLECTION]
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, newapp.bootstrap)
+    except Exception as e:
+        print(f"Error loading leaderboard: {e}")
+
+
+async def shutdown():
+    if maps is not None:
+        await maps.aclose()
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def wsgi_environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "CONTENT_LENGTH": str(len(body))
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_flask(environ):
+    """Run one request through the Flask app; returns (status, headers, body)."""
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured["status"] = int(status.split(" ", 1)[0])
+        captured["headers"] = headers
+
+    result = newapp.app.wsgi_app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return captured["status"], captured["headers"], body
+
+
+async def send_response(send, status, headers, body):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await startup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    body = await read_body(receive)
+    if scope["method"] == "GET" and scope["path"] == "/events":
+        return await event_stream(scope, receive, send)
+    export = TRIPS_EXPORT_PATH.match(scope["path"]) if scope["method"] == "GET" else None
+    if export:
+        return await export_trips(scope, send, export.group(1))
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is None:
+        loop = asyncio.get_running_loop()
+        status, headers, payload = await loop.run_in_executor(
+            None, call_flask, wsgi_environ(scope, body)
+        )
+        return await send_response(send, status, headers, payload)
+
+    request = Request(scope, body)
+    start = time.perf_counter()
+    timing = metrics.start_breakdown()
+    try:
+        status, payload, extra_headers = await handler(request)
+    except Exception as e:
+        print(f"Error handling {scope['method']} {scope['path']}: {e}")
+        status, payload, extra_headers = 500, {"error": "Internal server error"}, {}
+    finally:
+        breakdown = metrics.current_breakdown()
+        metrics.end_breakdown(timing)
+    elapsed = time.perf_counter() - start
+    metrics.http_duration.observe(elapsed, route=scope["path"], method=scope["method"], status=status)
+    if status >= 500:
+        metrics.http_errors.inc(route=scope["path"], method=scope["method"])
+
+    headers = [("Access-Control-Allow-Origin", "*")] + list(extra_headers.items())
+    if metrics.timing_requested(request.headers.get(metrics.TIMING_REQUEST_HEADER.lower())):
+        headers.append(("Server-Timing", metrics.server_timing(breakdown, elapsed)))
+    if payload is None:
+        return await send_response(send, status, headers, b"")
+    headers.append(("Content-Type", "application/json"))
+    return await send_response(send, status, headers, dumps(payload))
@@ -0,0 +1,89 @@
+"""Benchmark sequential vs concurrent per-mode directions fetching.
+
+Uses a stub directions client that sleeps for an injected delay per mode,
+so no Google Maps key or network access is needed.
+
+    python benchmarks/bench_fetch_route_data.py --delay 0.2 --runs 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from route_fetch import fetch_modes  # noqa: E402
+from route_model import RouteOption  # noqa: E402
+
+MODES = ["driving", "transit", "walking", "bicycling"]
+
+
+class StubDirectionsClient:
+    """Mimics `googlemaps.Client.directions` with a fixed delay per mode."""
+
+    def __init__(self, delays, failing_modes=()):
+        self.delays = delays
+        self.failing_modes = set(failing_modes)
+
+    def directions(self, origin, destination, mode="driving", **kwargs):
+        time.sleep(self.delays.get(mode, 0))
+        if mode in self.failing_modes:
+            raise RuntimeError(f"stubbed failure for {mode}")
+        return [{"legs": [{
+            "distance": {"value": 12500},
+            "duration": {"value": 1800}
+        }]}]
+
+
+def fetch_sequential(client, origin, destination, modes):
+    """The original one-mode-at-a-time loop, kept as the baseline."""
+    routes = {}
+    for mode in modes:
+        try:
+            directions = client.directions(origin=origin, destination=destination, mode=mode)
+            if directions:
+                routes[mode] = RouteOption.from_directions(directions, mode)
+        except Exception:
+            pass
+    return routes
+
+
+def time_runs(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds per directions call")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=5.0, help="per-mode timeout")
+    args = parser.parse_args()
+
+    client = StubDirectionsClient({mode: args.delay for mode in MODES})
+
+    sequential = time_runs(
+        lambda: fetch_sequential(client, "A", "B", MODES), args.runs)
+    concurrent = time_runs(
+        lambda: fetch_modes(client.directions, "A", "B", MODES, timeout=args.timeout), args.runs)
+
+    print(f"modes={len(MODES)} delay={args.delay * 1000:.0f}ms runs={args.runs}")
+    print(f"sequential: median {statistics.median(sequential) * 1000:8.1f} ms")
+    print(f"concurrent: median {statistics.median(concurrent) * 1000:8.1f} ms")
+    print(f"speedup:    {statistics.median(sequential) / statistics.median(concurrent):8.2f}x")
+
+    # A slow mode must only cost its own timeout, not block the others
+    slow = StubDirectionsClient({**{mode: args.delay for mode in MODES}, "transit": args.delay * 10})
+    start = time.perf_counter()
+    routes, _ = fetch_modes(slow.directions, "A", "B", MODES, timeout=args.delay * 3)
+    elapsed = time.perf_counter() - start
+    print(f"slow transit: {sorted(routes.modes)} in {elapsed * 1000:.1f} ms (timeout {args.delay * 3000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Check that every hot Users query is served by an index.
+
+Seeds a local MongoDB (a throwaway database, 1M users by default), runs
+schema.ensure_indexes and then, for each hot route's query, prints the
+winning plan's stages and the median latency. Exits non-zero if any plan
+contains a COLLSCAN or an in-memory SORT.
+
+    python benchmarks/bench_indexes.py --uri mongodb://localhost:27017 --users 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+from pymongo import MongoClient, ReturnDocument
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from schema import ensure_indexes  # noqa: E402
+from user_points import USER_TOTALS_PROJECTION, award_filter, award_update  # noqa: E402
+
+BAD_STAGES = {"COLLSCAN", "SORT"}
+
+
+def seed(collection, n_users, batch_size=10000):
+    rng = random.Random(0)
+    collection.drop()
+    for start in range(0, n_users, batch_size):
+        collection.insert_many([
+            {
+                "username": f"user{i}",
+                "password": f"pw{i}",
+                "sustainability_points": rng.randint(0, 50000),
+                "transit_trips": 0,
+                "walking_trips": 0,
+                "driving_trips": 0,
+                "bicycling_trips": 0
+            }
+            for i in range(start, min(start + batch_size, n_users))
+        ], ordered=False)
+
+
+def plan_stages(plan):
+    """Every stage name in an explain plan tree."""
+    stages = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if "stage" in node:
+                stages.append(node["stage"])
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return stages
+
+
+def winning_plan(explain):
+    planner = explain.get("queryPlanner") or explain["stages"][0]["$cursor"]["queryPlanner"]
+    return planner["winningPlan"]
+
+
+def hot_queries(db, username, points):
+    users = db["Users"]
+    return {
+        "signup / get_user_points": (
+            lambda: db.command("explain", {"find": "Users", "filter": {"username": username}, "limit": 1}),
+            lambda: users.find_one({"username": username})
+        ),
+        "login": (
+            lambda: db.command("explain", {"find": "Users", "filter": {"username": username, "password": "x"}, "limit": 1}),
+            lambda: users.find_one({"username": username, "password": "x"})
+        ),
+        "calculate_route_points award": (
+            lambda: db.command("explain", {
+                "findAndModify": "Users",
+                "query": award_filter(username, "bench-trip"),
+                "update": award_update({"walking": 0}, "bench-trip"),
+                "fields": USER_TOTALS_PROJECTION,
+                "new": True
+            }),
+            lambda: users.find_one_and_update(
+                award_filter(username, None), award_update({"walking": 0}),
+                projection=USER_TOTALS_PROJECTION, return_document=ReturnDocument.AFTER)
+        ),
+        "updatepassword": (
+            lambda: db.command("explain", {"update": "Users", "updates": [{
+                "q": {"username": username, "password": "x"},
+                "u": {"$set": {"password": "x"}}
+            }]}),
+            lambda: users.update_one({"username": username, "password": "x"}, {"$set": {"password": "x"}})
+        ),
+        "get_leaderboard top 10": (
+            lambda: db.command("explain", {"find": "Users", "filter": {},
+                                           "sort": {"sustainability_points": -1}, "limit": 10}),
+            lambda: list(users.find({}, {"username": 1, "sustainability_points": 1, "_id": 0})
+                         .sort("sustainability_points", -1).limit(10))
+        ),
+        "get_leaderboard rank": (
+            lambda: db.command("explain", {"count": "Users",
+                                           "query": {"sustainability_points": {"$gt": points}}}),
+            lambda: users.count_documents({"sustainability_points": {"$gt": points}})
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uri", default=os.getenv("MONGOSTRING", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default="ecotrail_index_bench")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--skip-seed", action="store_true")
+    args = parser.parse_args()
+
+    db = MongoClient(args.uri)[args.db]
+    if not args.skip_seed:
+        start = time.perf_counter()
+        seed(db["Users"], args.users)
+        print(f"seeded {args.users} users in {time.perf_counter() - start:.1f}s")
+    ensure_indexes(db)
+
+    username = f"user{args.users // 2}"
+    points = db["Users"].find_one({"username": username})["sustainability_points"]
+
+    failures = 0
+    for name, (explain, run) in hot_queries(db, username, points).items():
+        stages = plan_stages(winning_plan(explain()))
+        samples = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            run()
+            samples.append(time.perf_counter() - start)
+        ok = not BAD_STAGES.intersection(stages)
+        failures += not ok
+        print(f"{'ok ' if ok else 'BAD'} {name:<30} {statistics.median(samples) * 1000:7.2f} ms  "
+              f"{' > '.join(reversed(stages))}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Throughput and correctness of a factor recompute run (recompute.py).
+
+Seeds users with trip history scored with the built-in factors (half of it
+stored before trips kept their segments and factor version), then runs
+every chunk of a recompute run to a second factor set on a thread pool and
+reports:
+
+- `rescore` alone, in trips per second
+- the whole run (reads, re-scoring and the four writes), in trips per second
+
+It then checks that every user's total moved by exactly the difference
+between its trips' old and new points, that the rollups agree with the
+trips, and that a chunk which dies after the user updates but before the
+trip updates doesn't count anything twice when it's retried.
+
+The in-memory stand-in (benchmarks/standins.py) is used unless --uri
+points at a MongoDB 7.0+ server, whose `bench_recompute` database is
+dropped and seeded. The stand-in copies every document in and out, which
+dominates its run figure; only --uri measures the writes for real.
+
+    python benchmarks/bench_recompute.py --users 2000 --trips 20 --workers 4 --chunk-users 100
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from factors import DEFAULT_FACTORS, FactorSet  # noqa: E402
+from recompute import (  # noqa: E402
+    RUNS_COLLECTION, USERS_COLLECTION, recompute_chunk, rescore, run_status, start_run
+)
+from standins import memory_database  # noqa: E402
+from trips import ROLLUPS_COLLECTION, TRIPS_COLLECTION, TripStore  # noqa: E402
+
+MODES = ("driving", "transit", "walking", "bicycling")
+TRANSIT_VEHICLES = ("BUS", "SUBWAY", "TRAM", "COMMUTER_TRAIN")
+
+NEW_FACTORS = dict(
+    DEFAULT_FACTORS,
+    version="bench-2",
+    points=dict(DEFAULT_FACTORS["points"], walking=15, transit=9),
+    vehicles=dict(DEFAULT_FACTORS["vehicles"], BUS=65, SUBWAY=25),
+    regions={"fr": {"emission": {"driving": 150}, "vehicles": {"SUBWAY": 5, "COMMUTER_TRAIN": 6}}}
+)
+
+
+def make_trips(n_users, trips_per_user, seed=0):
+    """Trips scored with the built-in factors."""
+    rng = random.Random(seed)
+    builtin = FactorSet(DEFAULT_FACTORS)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    trips = []
+    for user in range(n_users):
+        for index in range(trips_per_user):
+            legs = []
+            for mode in rng.sample(MODES, rng.randint(1, 4)):
+                km = round(rng.uniform(0.5, 25), 6)
+                if mode == "transit":
+                    walk = round(rng.uniform(0.1, 1.0), 6)
+                    segments = {"WALKING": walk, rng.choice(TRANSIT_VEHICLES): km - walk}
+                else:
+                    segments = {mode.upper(): km}
+                legs.append({"mode": mode, "km": km, "min": round(km * 3, 1), "segments": segments})
+            trip = {
+                "ts": start + timedelta(hours=rng.randint(0, 24 * 180)),
+                "meta": {"user": f"user{user:06d}"},
+                "trip_id": f"t{user}-{index}",
+                "origin": "A",
+                "destination": "B",
+                "eco_mode": None,
+                "legs": legs
+            }
+            if index % 2:
+                # Stored before trips kept segments and the factor version
+                for leg in legs:
+                    del leg["segments"]
+            else:
+                trip["factors"] = builtin.version
+                trip["region"] = "fr" if index % 4 == 0 else None
+            trips.append(trip)
+    for trip, (legs, points) in zip(trips, rescore(trips, builtin)):
+        trip["legs"] = legs
+        trip["points"] = points
+    return trips
+
+
+def seed(db, trips, n_users):
+    users = {f"user{user:06d}": 1000 for user in range(n_users)}
+    for trip in trips:
+        users[trip["meta"]["user"]] += trip["points"]
+    db[USERS_COLLECTION].insert_many([
+        {"username": username, "sustainability_points": points} for username, points in users.items()
+    ])
+    store = TripStore(db)
+    for start in range(0, len(trips), 1000):
+        store.record([dict(trip) for trip in trips[start:start + 1000]])
+
+
+def run_chunks(db, run, workers):
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(lambda chunk: recompute_chunk(db, run["_id"], chunk), range(run["chunks"])))
+
+
+def check(db, trips, factors):
+    """Problems found comparing totals and rollups against the expected re-score."""
+    expected = {}
+    for trip, (_, points) in zip(trips, rescore(trips, factors)):
+        username = trip["meta"]["user"]
+        expected[username] = expected.get(username, 1000) + points
+    problems = []
+    for user in db[USERS_COLLECTION].find({}, {"username": 1, "sustainability_points": 1, "_id": 0}):
+        if user["sustainability_points"] != expected[user["username"]]:
+            problems.append(f"{user['username']}: {user['sustainability_points']} != {expected[user['username']]}")
+    stored = {}
+    for trip in db[TRIPS_COLLECTION].find({}, {"meta": 1, "points": 1, "factors": 1}):
+        if trip.get("factors") != factors.version:
+            problems.append(f"trip {trip['_id']} still has factors {trip.get('factors')}")
+        stored[trip["meta"]["user"]] = stored.get(trip["meta"]["user"], 0) + trip["points"]
+    rolled = {}
+    for bucket in db[ROLLUPS_COLLECTION].find({"period": "week"}, {"user": 1, "points": 1}):
+        rolled[bucket["user"]] = rolled.get(bucket["user"], 0) + bucket["points"]
+    problems += [f"{username} rollups: {rolled.get(username)} != {points}"
+                 for username, points in stored.items() if rolled.get(username) != points]
+    return problems
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_after_user_updates(db, run):
+    """Run chunk 0 with its trip updates failing, then retry it."""
+    trips = db[TRIPS_COLLECTION]
+    bulk_write = trips.bulk_write
+
+    def failing_bulk_write(*args, **kwargs):
+        raise Crash("worker died before the trip updates")
+
+    trips.bulk_write = failing_bulk_write
+    try:
+        recompute_chunk(db, run["_id"], 0)
+    except Crash:
+        pass
+    finally:
+        trips.bulk_write = bulk_write
+    return recompute_chunk(db, run["_id"], 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--trips", type=int, default=20, help="trips per user")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-users", type=int, default=100)
+    parser.add_argument("--uri", help="MongoDB 7.0+ to run against instead of the in-memory stand-in")
+    args = parser.parse_args()
+
+    if args.uri:
+        from pymongo import MongoClient
+        from schema import ensure_indexes
+
+        client = MongoClient(args.uri)
+        client.drop_database("bench_recompute")
+        db = client["bench_recompute"]
+        ensure_indexes(db)
+    else:
+        db = memory_database()
+
+    trips = make_trips(args.users, args.trips)
+    seed(db, trips, args.users)
+    factors = FactorSet(NEW_FACTORS)
+    print(f"users={args.users} trips={len(trips)} workers={args.workers} chunk_users={args.chunk_users}")
+
+    started = time.perf_counter()
+    rescore(trips, factors)
+    elapsed = time.perf_counter() - started
+    print(f"rescore only       {len(trips) / elapsed:12.0f} trips/s")
+
+    run = start_run(db, factors, args.chunk_users)
+    if not args.uri:
+        # Needs the stand-in's collection objects to fail the trip writes;
+        # it finishes the first chunk before the timed run
+        crash_after_user_updates(db, run)
+        db[RUNS_COLLECTION].update_one({"_id": run["_id"]}, {"$set": {"done": []}})
+    started = time.perf_counter()
+    results = run_chunks(db, run, args.workers)
+    elapsed = time.perf_counter() - started
+    rescored = sum(result["trips"] for result in results)
+    print(f"run ({run['chunks']} chunks)  {rescored / elapsed:12.0f} trips/s "
+          f"({rescored} trips in {elapsed:.2f} s)")
+
+    # Finished chunks run again (a duplicate job) must change nothing
+    db[RUNS_COLLECTION].update_one({"_id": run["_id"]}, {"$set": {"done": []}})
+    run_chunks(db, run, args.workers)
+
+    status = run_status(db, run["_id"])
+    print(f"status={status['status']} points_delta={status['points_delta']:+d}")
+    problems = check(db, trips, factors)
+    for problem in problems[:20]:
+        print(f"  {problem}")
+    print("check: " + (f"{len(problems)} problems" if problems else "totals and rollups reconcile"))
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Measure memory and CPU of the compact route model (route_model.py).
+
+Builds synthetic directions results (transit-style routes with several
+steps and alternatives) and reports, per mode and per request:
+
+- bytes retained by a cached leg: the raw directions JSON, the nested dict
+  summary the backend used to cache, and a `RouteOption`
+- time to parse one directions result into each of those
+- time to assemble a four-mode `RouteSet`, score it with
+  `newapp.score_routes` and encode the result with `route_model.dumps`
+  (orjson) or the standard library json module
+
+    python benchmarks/bench_route_model.py --legs 5000 --steps 12 --alternatives 3
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# Importing newapp must not reach out to anything
+os.environ.pop("API_KEY", None)
+os.environ.setdefault("MONGOSTRING", "mongodb://192.0.2.1:27017/?serverSelectionTimeoutMS=2000")
+
+import newapp  # noqa: E402
+from route_model import RouteOption, RouteSet, dumps  # noqa: E402
+
+MODES = ("driving", "transit", "walking", "bicycling")
+VEHICLES = ("BUS", "SUBWAY", "TRAM", "COMMUTER_TRAIN")
+
+
+def make_directions(mode, steps, alternatives, seed=0):
+    routes = []
+    for alternative in range(alternatives):
+        leg_steps = []
+        for step in range(steps):
+            meters = 300 + 97 * ((seed + step + alternative) % 13)
+            if mode == "transit" and step % 2:
+                leg_steps.append({
+                    "distance": {"text": f"{meters / 1000:.1f} km", "value": meters},
+                    "duration": {"text": "4 mins", "value": 240},
+                    "travel_mode": "TRANSIT",
+                    "html_instructions": "Take the line towards the terminus",
+                    "polyline": {"points": "a~l~Fjk~uOwHJy@P" * 4},
+                    "transit_details": {"line": {"vehicle": {"type": VEHICLES[step % len(VEHICLES)]}}}
+                })
+            else:
+                leg_steps.append({
+                    "distance": {"text": f"{meters / 1000:.1f} km", "value": meters},
+                    "duration": {"text": "3 mins", "value": 180},
+                    "travel_mode": "WALKING" if mode == "transit" else mode.upper(),
+                    "html_instructions": "Head <b>north</b> on Benchmark Street",
+                    "polyline": {"points": "a~l~Fjk~uOwHJy@P" * 4}
+                })
+        routes.append({
+            "summary": f"Route {alternative}",
+            "overview_polyline": {"points": "a~l~Fjk~uOwHJy@P" * 20},
+            "legs": [{
+                "distance": {"value": sum(step["distance"]["value"] for step in leg_steps)},
+                "duration": {"value": sum(step["duration"]["value"] for step in leg_steps)},
+                "steps": leg_steps
+            }]
+        })
+    return routes
+
+
+def dict_summary(directions, mode):
+    """The `{"distance_km", "duration_min", "alternatives": [...]}` leg cached before RouteOption."""
+    alternatives = []
+    for route in directions:
+        meters = seconds = 0
+        segments = {}
+        for leg in route["legs"]:
+            meters += leg["distance"]["value"]
+            seconds += leg["duration"]["value"]
+            for step in leg["steps"]:
+                transit = step.get("transit_details")
+                vehicle = transit["line"]["vehicle"]["type"] if transit else step["travel_mode"]
+                segments[vehicle] = segments.get(vehicle, 0) + step["distance"]["value"] / 1000
+        alternatives.append({"distance_km": meters / 1000, "duration_min": seconds / 60, "segments": segments})
+    first = directions[0]["legs"][0]
+    return {
+        "distance_km": first["distance"]["value"] / 1000,
+        "duration_min": first["duration"]["value"] / 60,
+        "alternatives": alternatives
+    }
+
+
+def retained_bytes(build, count):
+    gc.collect()
+    tracemalloc.start()
+    kept = [build(i) for i in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size / count
+
+
+def per_call_us(fn, runs):
+    fn()
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(runs):
+            fn()
+        best = min(best, (time.perf_counter() - start) / runs)
+    return best * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--legs", type=int, default=5000, help="cached legs to measure memory over")
+    parser.add_argument("--steps", type=int, default=12, help="steps per route")
+    parser.add_argument("--alternatives", type=int, default=3, help="routes per directions result")
+    parser.add_argument("--runs", type=int, default=2000)
+    args = parser.parse_args()
+
+    raw = {mode: make_directions(mode, args.steps, args.alternatives) for mode in MODES}
+    raw_json = {mode: json.dumps(directions) for mode, directions in raw.items()}
+
+    print(f"steps={args.steps} alternatives={args.alternatives} legs={args.legs}")
+    print("retained per cached transit leg:")
+    print(f"  raw directions     {retained_bytes(lambda i: json.loads(raw_json['transit']), args.legs // 10):10.0f} B")
+    print(f"  dict summary       {retained_bytes(lambda i: dict_summary(raw['transit'], 'transit'), args.legs):10.0f} B")
+    print(f"  RouteOption        {retained_bytes(lambda i: RouteOption.from_directions(raw['transit'], 'transit'), args.legs):10.0f} B")
+
+    print("parse one transit result:")
+    print(f"  dict summary       {per_call_us(lambda: dict_summary(raw['transit'], 'transit'), args.runs):10.1f} us")
+    print(f"  RouteOption        {per_call_us(lambda: RouteOption.from_directions(raw['transit'], 'transit'), args.runs):10.1f} us")
+
+    options = [RouteOption.from_directions(raw[mode], mode) for mode in MODES]
+    routes = RouteSet(options)
+    scored = newapp.score_routes(routes)
+    print("per request (four modes):")
+    print(f"  RouteSet           {per_call_us(lambda: RouteSet(options), args.runs):10.1f} us")
+    print(f"  score_routes       {per_call_us(lambda: newapp.score_routes(routes), args.runs):10.1f} us")
+    print(f"  encode (dumps)     {per_call_us(lambda: dumps(scored), args.runs):10.1f} us")
+    print(f"  encode (json)      {per_call_us(lambda: json.dumps(scored).encode('utf-8'), args.runs):10.1f} us")
+    print(f"  all (dumps)        "
+          f"{per_call_us(lambda: dumps(newapp.score_routes(RouteSet(options))), args.runs):10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark the vectorized scoring engine against the per-dict loop.
+
+Scores synthetic trips (one row per mode) with the lookup-table engine and
+with the original dict-at-a-time functions, and checks they agree.
+
+    python benchmarks/bench_scoring.py --trips 250000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from scoring import MODES, build_table, score_trips  # noqa: E402
+
+EMISSION_FACTORS = {"driving": 180, "transit": 80, "walking": 0, "bicycling": 0}
+POINTS_MULTIPLIER = {"walking": 12, "bicycling": 10, "transit": 8, "driving": 0}
+
+
+def make_trips(n_trips, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = n_trips * len(MODES)
+    trip_index = np.repeat(np.arange(n_trips), len(MODES))
+    mode_id = np.tile(np.arange(len(MODES)), n_trips)
+    distance_km = rng.uniform(0.5, 40, rows)
+    duration_min = rng.uniform(5, 180, rows)
+    return distance_km, duration_min, mode_id, trip_index
+
+
+def score_loop(distance_km, duration_min, mode_id, n_trips, max_duration):
+    """Original per-trip dict pipeline."""
+    total_points = 0
+    eco_modes = []
+    distance_km, duration_min = distance_km.tolist(), duration_min.tolist()
+    for trip in range(n_trips):
+        routes = {
+            MODES[mode]: {"distance_km": distance_km[row], "duration_min": duration_min[row]}
+            for row, mode in ((trip * len(MODES) + i, i) for i in range(len(MODES)))
+        }
+        footprints = {mode: data["distance_km"] * EMISSION_FACTORS[mode] for mode, data in routes.items()}
+        for mode, data in routes.items():
+            total_points += int(data["distance_km"] * POINTS_MULTIPLIER[mode])
+        filtered = {mode: footprints[mode] for mode, data in routes.items()
+                    if data["duration_min"] <= max_duration}
+        eco_modes.append(min(filtered, key=filtered.get) if filtered else None)
+    return total_points, eco_modes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trips", type=int, default=250000)
+    parser.add_argument("--max-duration", type=float, default=60)
+    args = parser.parse_args()
+
+    distance_km, duration_min, mode_id, trip_index = make_trips(args.trips)
+    emission_table = build_table(EMISSION_FACTORS)
+    points_table = build_table(POINTS_MULTIPLIER)
+
+    start = time.perf_counter()
+    _, points, eco_rows = score_trips(
+        distance_km, duration_min, mode_id, emission_table, points_table,
+        trip_index=trip_index, max_duration=args.max_duration)
+    vectorized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loop_points, loop_eco = score_loop(distance_km, duration_min, mode_id, args.trips, args.max_duration)
+    loop = time.perf_counter() - start
+
+    eco_modes = [MODES[mode_id[row]] if row >= 0 else None for row in eco_rows.tolist()]
+    assert int(points.sum()) == loop_points, "points disagree"
+    assert eco_modes == loop_eco, "eco-optimal modes disagree"
+
+    rows = len(distance_km)
+    print(f"rows={rows} trips={args.trips}")
+    print(f"dict loop:  {loop:7.3f} s  ({rows / loop / 1e6:6.2f} M rows/s)")
+    print(f"vectorized: {vectorized:7.3f} s  ({rows / vectorized / 1e6:6.2f} M rows/s)")
+    print(f"speedup:    {loop / vectorized:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Measure cold start: import, app factory, first request and forked workers.
+
+Every sample runs in a fresh interpreter with no API key, and MONGOSTRING
+points at an unroutable address (TEST-NET-1), so any client built or
+connection opened during startup shows up as a failure or a timeout. The
+sample reports:
+
+    import_newapp    `import newapp`
+    create_app       one more `newapp.create_app()`
+    first_request    first GET /cache_stats through the test client
+    fork_workers     `--workers` preforked children each serving their first
+                     request (what gunicorn --preload does on scale-out)
+    import_cli       `import app` (the command-line route finder), in its
+                     own interpreter
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --imports 15   # slowest imports too
+    python benchmarks/bench_startup.py --save benchmarks/startup_baseline.json
+    python benchmarks/bench_startup.py --compare benchmarks/startup_baseline.json
+
+With --compare it exits 1 if a median grew by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SAMPLE = r"""
+import json, os, sys, time
+
+start = time.perf_counter()
+import newapp
+imported = time.perf_counter()
+newapp.create_app()
+created = time.perf_counter()
+response = newapp.app.test_client().get('/cache_stats')
+assert response.status_code == 200, response.status_code
+served = time.perf_counter()
+
+workers = []
+for _ in range(int(sys.argv[1])):
+    pid = os.fork()
+    if pid == 0:
+        ok = newapp.app.test_client().get('/cache_stats').status_code == 200
+        os._exit(0 if ok and not newapp.client.is_built and not newapp.gmaps.is_built else 1)
+    workers.append(pid)
+failed = sum(os.waitpid(pid, 0)[1] != 0 for pid in workers)
+forked = time.perf_counter()
+
+print(json.dumps({
+    "import_newapp": imported - start,
+    "create_app": created - imported,
+    "first_request": served - created,
+    "fork_workers": forked - served,
+    "failed_workers": failed,
+    "clients_built": [name for name in ("client", "gmaps", "maps_session", "routing")
+                      if getattr(newapp, name).is_built]
+}))
+"""
+
+CLI_SAMPLE = r"""
+import time
+
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start)
+"""
+
+STEPS = ("import_newapp", "create_app", "first_request", "fork_workers", "import_cli")
+
+
+def sample_env():
+    env = dict(os.environ)
+    env.pop("API_KEY", None)
+    # Nothing should connect while starting up; if something does, it hangs here
+    env["MONGOSTRING"] = "mongodb://192.0.2.1:27017/?serverSelectionTimeoutMS=2000"
+    env.setdefault("CACHE_BACKEND", "memory")
+    env.setdefault("ROUTING_BACKEND", "google")
+    return env
+
+
+def run_python(code, env, *args):
+    """Last line of stdout from `code` run in a fresh interpreter."""
+    output = subprocess.run(
+        [sys.executable, "-c", code, *args],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True, timeout=120
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_sample(workers, env):
+    sample = run_python(SAMPLE, env, str(workers))
+    sample["import_cli"] = run_python(CLI_SAMPLE, env)
+    return sample
+
+
+def slowest_imports(env, count):
+    """Modules `newapp` imports directly, slowest cumulative first (`-X importtime`)."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import newapp"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        # Each nesting level indents the name by two more spaces
+        if (len(name) - len(name.lstrip())) // 2 == 1:
+            rows.append((int(cumulative_us), int(self_us), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--imports", type=int, default=0, help="also list the N slowest imports")
+    parser.add_argument("--save", help="write medians to this JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    env = sample_env()
+    run_sample(args.workers, env)  # Warm the filesystem cache and .pyc files
+    samples = [run_sample(args.workers, env) for _ in range(args.runs)]
+
+    built = {name for sample in samples for name in sample["clients_built"]}
+    failed = sum(sample["failed_workers"] for sample in samples)
+    medians = {step: statistics.median(sample[step] for sample in samples) for step in STEPS}
+    for step in STEPS:
+        values = [sample[step] * 1000 for sample in samples]
+        print(f"{step:<14} median {medians[step] * 1000:8.1f} ms  "
+              f"min {min(values):8.1f} ms  max {max(values):8.1f} ms")
+    print(f"clients built during startup: {', '.join(sorted(built)) or 'none'}; "
+          f"failed workers: {failed}")
+
+    if args.imports:
+        print("\nslowest imports (cumulative / self):")
+        for cumulative_us, self_us, name in slowest_imports(env, args.imports):
+            print(f"  {cumulative_us / 1000:8.1f} ms  {self_us / 1000:7.1f} ms  {name}")
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "runs": args.runs,
+            "workers": args.workers
+        },
+        "medians_s": medians
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved baseline to {args.save}")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["medians_s"]
+        for step, value in medians.items():
+            old = baseline.get(step)
+            # Sub-millisecond steps are all noise
+            if old and value > 0.001 and value > old * (1 + args.tolerance):
+                regressions.append(f"{step}: {old * 1000:.1f} -> {value * 1000:.1f} ms")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions or built or failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""Reproducible benchmark suite: no Google key, no MongoDB.
+
+Loads `newapp` with its Maps traffic served by the replay transport
+(benchmarks/replay.py, recorded fixtures plus injected latency) and its
+collections swapped for an in-memory stand-in (benchmarks/standins.py).
+Then, for each scenario and each concurrency level, it reports throughput
+and p50/p99 latency. A separate single-threaded pass under tracemalloc
+reports allocations per request.
+
+Scenarios:
+    calculate_route_points  POST /calculate_route_points, random address pairs
+    get_leaderboard         GET /get_leaderboard pages and username ranks
+    scoring                 newapp.score_routes on replayed directions
+    route_grid              nearby-route lookups and inserts around hotspots
+
+    python benchmarks/bench_suite.py --latency 0.05 --concurrency 1 4 16 \\
+        --save benchmarks/baseline.json
+    python benchmarks/bench_suite.py --compare benchmarks/baseline.json
+
+With --compare it exits 1 if a scenario's throughput dropped, or its p99
+or allocations grew, by more than --tolerance against the baseline.
+Baselines are machine-specific, so compare runs from the same machine.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+from replay import DEFAULT_FIXTURES, ReplayAdapter, load_fixtures  # noqa: E402
+from standins import memory_database  # noqa: E402
+
+STUB_API_KEY = "AIzaStubKeyForBenchmarkSuite0000000000"
+MODES = ["driving", "transit", "walking", "bicycling"]
+SCENARIOS = ("calculate_route_points", "get_leaderboard", "scoring", "route_grid")
+
+
+def load_app(latency, jitter, fixtures, n_users, seed=0):
+    """Import newapp wired to the replay transport and an in-memory database."""
+    os.environ["API_KEY"] = STUB_API_KEY
+    os.environ.setdefault("CACHE_BACKEND", "memory")
+    os.environ.setdefault("ROUTING_BACKEND", "google")
+    # Measure the serving path, not the Maps quota limiter
+    os.environ.setdefault("MAPS_QPS", "100000")
+    os.environ.setdefault("MAPS_MAX_PER_HOST", "512")
+    os.environ.setdefault("MAPS_POOL_SIZE", "512")
+    # The synthetic fixtures geocode every address to the same point, so
+    # nearby-route reuse would answer almost every lookup; measure it in
+    # the route_grid scenario instead
+    os.environ.setdefault("ROUTE_REUSE_MAX_ERROR_M", "0")
+    # Background jobs go to a throwaway queue; the fixtures have no map images
+    os.environ.setdefault("JOBS_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="bench-jobs-"), "jobs.sqlite3"))
+    os.environ.setdefault("PREFETCH_MAP_IMAGES", "false")
+
+    import newapp
+    from leaderboard import Leaderboard
+    from trips import TripStore
+
+    db = memory_database()
+    newapp.db = db
+    newapp.users_collection = db["Users"]
+    newapp.leaderboard = Leaderboard(
+        db["Users"], capacity=newapp.leaderboard.capacity, on_change=newapp.leaderboard.on_change,
+        refresh_seconds=newapp.leaderboard.refresh_seconds
+    )
+    newapp.trip_store = TripStore(db)
+    adapter = ReplayAdapter(load_fixtures(fixtures), latency=latency, jitter=jitter, seed=seed)
+    newapp.maps_session.mount("https://maps.googleapis.com/", adapter)
+
+    rng = random.Random(seed)
+    db["Users"].insert_many([
+        {
+            "username": f"user{i}",
+            "password": "bench",
+            "sustainability_points": rng.randint(0, 50000),
+            "walking_trips": 0,
+            "driving_trips": 0,
+            "transit_trips": 0,
+            "bicycling_trips": 0
+        }
+        for i in range(n_users)
+    ])
+    newapp.leaderboard.load()
+    return newapp, adapter
+
+
+def clear_caches(newapp):
+    for cache in (newapp.geocode_cache, newapp.directions_cache):
+        cache.clear()
+
+
+def make_scenarios(newapp, n_users, n_addresses, seed=0):
+    """`({name: factory}, grid)`; each factory returns a per-thread `run()` -> ok."""
+    from route_grid import RouteGrid
+    from route_model import RouteOption, RouteSet
+
+    addresses = [f"{i} Benchmark Street, Berlin" for i in range(n_addresses)]
+    trip_ids = itertools.count()
+
+    def calculate_route_points():
+        client = newapp.app.test_client()
+        rng = random.Random(threading.get_ident() ^ seed)
+
+        def run():
+            origin, destination = rng.sample(addresses, 2)
+            response = client.post('/calculate_route_points', json={
+                "username": f"user{rng.randrange(n_users)}",
+                "origin": origin,
+                "destination": destination,
+                "modes": MODES,
+                "trip_id": f"bench-{next(trip_ids)}"
+            })
+            return response.status_code == 200
+
+        return run
+
+    def get_leaderboard():
+        client = newapp.app.test_client()
+        rng = random.Random(threading.get_ident() ^ seed)
+
+        def run():
+            if rng.random() < 0.5:
+                response = client.get(f'/get_leaderboard?username=user{rng.randrange(n_users)}')
+            else:
+                response = client.get(f'/get_leaderboard?offset={rng.randrange(0, 500)}&limit=10')
+            return response.status_code == 200
+
+        return run
+
+    # Directions for every mode, fetched once through the replay transport
+    routes = RouteSet(
+        RouteOption.from_directions(
+            newapp.gmaps.directions(addresses[0], addresses[1], mode=mode, alternatives=True), mode
+        )
+        for mode in MODES
+    )
+
+    def scoring():
+        def run():
+            newapp.score_routes(routes)
+            return True
+
+        return run
+
+    # Trips between 30 hotspots, each end jittered by up to ~150 m
+    grid = RouteGrid(max_error_m=200, capacity=20000)
+    grid_rng = random.Random(seed)
+    hotspots = [(52.4 + grid_rng.random() * 0.25, 13.2 + grid_rng.random() * 0.4) for _ in range(30)]
+    grid_seeds = itertools.count(seed)
+    leg = routes.get("driving")
+
+    def route_grid():
+        # A fresh seed per thread; repeating a sequence would reuse at zero error
+        rng = random.Random(next(grid_seeds))
+
+        def jittered(point):
+            return point[0] + rng.uniform(-0.00135, 0.00135), point[1] + rng.uniform(-0.0022, 0.0022)
+
+        def run():
+            origin, destination = (jittered(point) for point in rng.sample(hotspots, 2))
+            mode = rng.choice(MODES)
+            if grid.lookup(origin, destination, mode) is None:
+                grid.add(origin, destination, mode, leg)
+            return True
+
+        return run
+
+    return {
+        "calculate_route_points": calculate_route_points,
+        "get_leaderboard": get_leaderboard,
+        "scoring": scoring,
+        "route_grid": route_grid
+    }, grid
+
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q) * 1000) if latencies else None
+
+
+def run_level(factory, concurrency, total):
+    """Run `total` calls spread over `concurrency` threads."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(total))
+    counter_lock = threading.Lock()
+
+    def worker():
+        nonlocal errors
+        run = factory()
+        local, local_errors = [], 0
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    break
+            start = time.perf_counter()
+            try:
+                ok = run()
+            except Exception:
+                ok = False
+            local.append(time.perf_counter() - start)
+            local_errors += not ok
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": total / elapsed,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99)
+    }
+
+
+def measure_allocations(factory, n):
+    """Mean peak and retained bytes traced per call, single-threaded."""
+    run = factory()
+    run()  # Warm up imports and lazy state outside the trace
+    tracemalloc.start()
+    peaks, retained = [], []
+    try:
+        for _ in range(n):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            run()
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+    return {"peak_kib": float(np.mean(peaks)) / 1024, "retained_bytes": float(np.mean(retained))}
+
+
+def compare(results, baseline, tolerance):
+    """Human-readable regressions of `results` against `baseline`."""
+    regressions = []
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if previous is None:
+            continue
+        for level, stats in current["levels"].items():
+            old = previous["levels"].get(level)
+            if old is None:
+                continue
+            if stats["rps"] < old["rps"] * (1 - tolerance):
+                regressions.append(f"{scenario} @{level}: {old['rps']:.0f} -> {stats['rps']:.0f} req/s")
+            if old["p99_ms"] and stats["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{scenario} @{level}: p99 {old['p99_ms']:.2f} -> {stats['p99_ms']:.2f} ms")
+        old_peak = previous.get("allocations", {}).get("peak_kib")
+        new_peak = current.get("allocations", {}).get("peak_kib")
+        if old_peak and new_peak and new_peak > old_peak * (1 + tolerance):
+            regressions.append(f"{scenario}: peak allocations {old_peak:.1f} -> {new_peak:.1f} KiB/request")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=400, help="calls per concurrency level")
+    parser.add_argument("--alloc-requests", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="replayed Maps latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--addresses", type=int, default=50)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    parser.add_argument("--save", help="write results to this JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    newapp, adapter = load_app(args.latency, args.jitter, args.fixtures, args.users)
+    scenarios, grid = make_scenarios(newapp, args.users, args.addresses)
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "requests": args.requests,
+            "users": args.users,
+            "addresses": args.addresses
+        },
+        "scenarios": {}
+    }
+    for name in args.scenarios:
+        levels = {}
+        for concurrency in args.concurrency:
+            clear_caches(newapp)  # Each level starts cold and warms up the same way
+            stats = levels[str(concurrency)] = run_level(scenarios[name], concurrency, args.requests)
+            print(f"{name:<24} c={concurrency:<4} {stats['rps']:9.1f} req/s  "
+                  f"p50 {stats['p50_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms  "
+                  f"errors {stats['errors']}")
+        clear_caches(newapp)
+        allocations = measure_allocations(scenarios[name], args.alloc_requests)
+        print(f"{name:<24} allocations: peak {allocations['peak_kib']:.1f} KiB/request, "
+              f"retained {allocations['retained_bytes']:.0f} B/request")
+        results["scenarios"][name] = {"levels": levels, "allocations": allocations}
+    if "route_grid" in args.scenarios:
+        stats = grid.stats()
+        print(f"route_grid reuse {stats['hit_ratio']:.1%}, mean error bound "
+              f"{stats['mean_error_bound_m']:.0f} m (max {stats['max_error_bound_m']:.0f} m), "
+              f"{stats['size']} routes, {stats['evictions']} evictions")
+    print(f"replayed {adapter.requests} Maps requests ({adapter.misses} without a recording)")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
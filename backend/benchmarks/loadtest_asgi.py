@@ -0,0 +1,193 @@
+"""Load-test the sync Flask path against the async ASGI path.
+
+Starts three local processes: a stub Google Maps server that answers
+geocode/directions with an injected latency, the Flask app (threaded
+werkzeug server, googlemaps traffic redirected to the stub) and the ASGI app
+under uvicorn. It then drives `/calculate_route_points` on each server at the
+same concurrency and reports requests/sec and latency percentiles.
+
+Both servers write to the Mongo database in MONGOSTRING (a local mongod,
+e.g. mongodb://localhost:27017/loadtest); the stub addresses are unique per
+request so the geocode/directions caches don't hide upstream latency.
+
+    MONGOSTRING=mongodb://localhost:27017 python benchmarks/loadtest_asgi.py \\
+        --latency 0.1 --concurrency 64 --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import parse_qs
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+MODES = ["driving", "transit", "walking", "bicycling"]
+STUB_API_KEY = "AIzaStubKeyForLoadTesting"
+
+
+def stub_maps_app(latency):
+    """ASGI app mimicking the Geocoding and Directions JSON APIs."""
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        query = {k: v[-1] for k, v in parse_qs(scope["query_string"].decode()).items()}
+        await asyncio.sleep(latency)
+        if scope["path"].endswith("/geocode/json"):
+            payload = {"status": "OK", "results": [{"formatted_address": query.get("address", "")}]}
+        else:
+            payload = {"status": "OK", "routes": [{"legs": [{
+                "distance": {"value": 8000 + 1000 * MODES.index(query.get("mode", "driving"))},
+                "duration": {"value": 1200}
+            }]}]}
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+
+    return app
+
+
+def serve(kind, port, latency, stub_url):
+    """Entry point of the server subprocesses."""
+    import uvicorn
+
+    if kind == "stub":
+        uvicorn.run(stub_maps_app(latency), host="127.0.0.1", port=port,
+                    log_level="warning", backlog=4096)
+        return
+
+    os.environ["API_KEY"] = STUB_API_KEY
+    os.environ["MAPS_BASE_URL"] = stub_url
+    # Measure the serving path, not the Maps quota limiter
+    os.environ.setdefault("MAPS_QPS", "100000")
+    os.environ.setdefault("MAPS_MAX_PER_HOST", "512")
+    os.environ.setdefault("MAPS_POOL_SIZE", "512")
+    if kind == "async":
+        uvicorn.run("asgi_app:app", host="127.0.0.1", port=port,
+                    log_level="warning", backlog=4096)
+        return
+
+    from werkzeug.serving import make_server
+
+    import newapp
+    from maps_http import MapsClient
+
+    # Before first use, so the directions backend is built on the stub client
+    newapp.gmaps.override(MapsClient(STUB_API_KEY, base_url=stub_url))
+    make_server("127.0.0.1", port, newapp.app, threaded=True).serve_forever()
+
+
+def start(kind, port, args, stub_url=""):
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", kind, "--port", str(port),
+         "--latency", str(args.latency), "--stub-url", stub_url],
+        cwd=BACKEND_DIR
+    )
+    wait_until_up(port)
+    return process
+
+
+def wait_until_up(port, timeout=30):
+    import socket
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+async def drive(base_url, concurrency, total, label):
+    import httpx
+
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        timeout=60,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    ) as client:
+        await client.post("/signup", json={"username": "loadtest", "password": "loadtest"})
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/calculate_route_points", json={
+                        "username": "loadtest",
+                        "origin": f"{label} origin {i}",
+                        "destination": f"{label} destination {i}",
+                        "modes": MODES
+                    })
+                    if response.status_code != 200:
+                        errors += 1
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": total / elapsed,
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.1, help="stub Maps latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--base-port", type=int, default=18080)
+    parser.add_argument("--serve", choices=["stub", "sync", "async"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--stub-url", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.latency, args.stub_url)
+        return
+
+    if not os.getenv("MONGOSTRING"):
+        parser.error("set MONGOSTRING to a local MongoDB, e.g. mongodb://localhost:27017")
+
+    stub_url = f"http://127.0.0.1:{args.base_port}"
+    processes = [start("stub", args.base_port, args)]
+    try:
+        processes.append(start("sync", args.base_port + 1, args, stub_url))
+        processes.append(start("async", args.base_port + 2, args, stub_url))
+
+        print(f"stub latency={args.latency * 1000:.0f}ms concurrency={args.concurrency} "
+              f"requests={args.requests}")
+        for label, port in (("sync", args.base_port + 1), ("async", args.base_port + 2)):
+            result = asyncio.run(drive(f"http://127.0.0.1:{port}", args.concurrency, args.requests, label))
+            print(f"{label:>5}: {result['rps']:8.1f} req/s  p50 {result['p50_ms']:8.1f} ms  "
+                  f"p99 {result['p99_ms']:8.1f} ms  errors {result['errors']}")
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
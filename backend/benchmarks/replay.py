@@ -0,0 +1,276 @@
+"""Replay transport serving recorded Google Maps responses.
+
+`ReplayAdapter` is a requests transport adapter. Mounted on the backend's
+`MapsSession`, it answers Geocoding, Directions and Static Maps requests
+from a fixture file after an injected latency, so the whole Maps path
+(googlemaps.Client, rate limiter, retries, caches) runs without a key or
+network access.
+
+A request is matched on its path and query parameters (minus the key). If
+there is no exact recording, a template recording for the same path and
+mode is used; templates substitute `{address}`, `{origin}` and
+`{destination}` from the request, so every address still gets its own
+cache entries.
+
+    # Record real responses (needs API_KEY)
+    python benchmarks/replay.py record --out fixtures/recorded.json \\
+        "Brandenburg Gate, Berlin" "Alexanderplatz, Berlin" ...
+
+    # Regenerate the synthetic fixtures shipped with the suite
+    python benchmarks/replay.py synthesize --out fixtures/maps_replay.json
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURES = os.path.join(BENCH_DIR, "fixtures", "maps_replay.json")
+
+# Query parameters that don't change the response
+IGNORED_PARAMS = {"key", "client", "signature", "channel"}
+
+MODES = ["driving", "transit", "walking", "bicycling"]
+
+
+def request_key(url):
+    """(path, sorted params) identifying a Maps request."""
+    parts = urlsplit(url)
+    params = tuple(sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name not in IGNORED_PARAMS
+    ))
+    return parts.path, params
+
+
+def load_fixtures(path=DEFAULT_FIXTURES):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["recordings"]
+
+
+class ReplayAdapter(BaseAdapter):
+    """Serve recordings after `latency` (+ up to `jitter`) seconds."""
+
+    def __init__(self, recordings, latency=0.0, jitter=0.0, seed=0):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._exact = {}
+        self._templates = {}
+        for recording in recordings:
+            params = tuple(sorted((name, str(value)) for name, value in recording["params"].items()))
+            if recording.get("template"):
+                self._templates[(recording["path"], dict(params).get("mode"))] = recording
+            else:
+                self._exact[(recording["path"], params)] = recording
+        self.requests = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _find(self, path, params):
+        recording = self._exact.get((path, params))
+        if recording is not None:
+            return recording, {}
+        values = dict(params)
+        template = (self._templates.get((path, values.get("mode")))
+                    or self._templates.get((path, None)))
+        return template, values
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        path, params = request_key(request.url)
+        recording, values = self._find(path, params)
+        with self._lock:
+            self.requests += 1
+            self.misses += recording is None
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.reason = "OK"
+        if recording is None:
+            response.status_code = 404
+            response._content = b'{"status": "NOT_FOUND", "error_message": "no recording"}'
+            response.headers["Content-Type"] = "application/json"
+            return response
+
+        response.status_code = recording.get("status", 200)
+        response.headers["Content-Type"] = recording.get("content_type", "application/json")
+        if "body_base64" in recording:
+            response._content = base64.b64decode(recording["body_base64"])
+        else:
+            body = json.dumps(recording["body"])
+            for name in ("address", "origin", "destination"):
+                if name in values:
+                    body = body.replace("{" + name + "}", json.dumps(values[name])[1:-1])
+            response._content = body.encode("utf-8")
+        response.encoding = "utf-8"
+        return response
+
+    def close(self):
+        pass
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Pass requests through to the network and keep every exchange."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recordings = []
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        path, params = request_key(request.url)
+        recording = {
+            "path": path,
+            "params": dict(params),
+            "status": response.status_code,
+            "content_type": response.headers.get("Content-Type", "application/json")
+        }
+        if recording["content_type"].startswith("application/json"):
+            recording["body"] = response.json()
+        else:
+            recording["body_base64"] = base64.b64encode(response.content).decode("ascii")
+        self.recordings.append(recording)
+        return response
+
+
+# A 1x1 transparent PNG stands in for Static Maps images
+PLACEHOLDER_PNG = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+def synthetic_step(travel_mode, meters, seconds, vehicle=None):
+    step = {
+        "travel_mode": travel_mode,
+        "distance": {"value": meters, "text": f"{meters / 1000:.1f} km"},
+        "duration": {"value": seconds, "text": f"{max(seconds // 60, 1)} mins"}
+    }
+    if vehicle:
+        step["transit_details"] = {"line": {"vehicle": {"type": vehicle}}}
+    return step
+
+
+def synthetic_route(steps):
+    meters = sum(step["distance"]["value"] for step in steps)
+    seconds = sum(step["duration"]["value"] for step in steps)
+    return {
+        "summary": "synthetic",
+        "legs": [{
+            "start_address": "{origin}",
+            "end_address": "{destination}",
+            "distance": {"value": meters, "text": f"{meters / 1000:.1f} km"},
+            "duration": {"value": seconds, "text": f"{max(seconds // 60, 1)} mins"},
+            "steps": steps
+        }]
+    }
+
+
+def synthesize():
+    """Synthetic recordings in the same shape as `record` produces."""
+    directions = {
+        "driving": [
+            [synthetic_step("DRIVING", 2500, 300), synthetic_step("DRIVING", 5500, 540)],
+            [synthetic_step("DRIVING", 9100, 900)]
+        ],
+        "transit": [
+            [synthetic_step("WALKING", 400, 300), synthetic_step("TRANSIT", 6000, 900, "SUBWAY"),
+             synthetic_step("WALKING", 250, 200)],
+            [synthetic_step("WALKING", 150, 120), synthetic_step("TRANSIT", 4200, 960, "BUS"),
+             synthetic_step("TRANSIT", 3100, 600, "TRAM"), synthetic_step("WALKING", 300, 240)]
+        ],
+        "walking": [[synthetic_step("WALKING", 7200, 5400)]],
+        "bicycling": [
+            [synthetic_step("BICYCLING", 7600, 1680)],
+            [synthetic_step("BICYCLING", 8100, 1740)]
+        ]
+    }
+    recordings = [{
+        "path": "/maps/api/geocode/json",
+        "params": {},
+        "template": True,
+        "status": 200,
+        "body": {"status": "OK", "results": [{
+            "formatted_address": "{address}",
+            "geometry": {"location": {"lat": 52.52, "lng": 13.405}}
+        }]}
+    }]
+    for mode, routes in directions.items():
+        recordings.append({
+            "path": "/maps/api/directions/json",
+            "params": {"mode": mode},
+            "template": True,
+            "status": 200,
+            "body": {"status": "OK", "routes": [synthetic_route(steps) for steps in routes]}
+        })
+    recordings.append({
+        "path": "/maps/api/staticmap",
+        "params": {},
+        "template": True,
+        "status": 200,
+        "content_type": "image/png",
+        "body_base64": PLACEHOLDER_PNG
+    })
+    return recordings
+
+
+def record(addresses, out):
+    """Record geocode, directions (every mode, consecutive pairs) and static maps."""
+    sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+    import googlemaps
+
+    from map_cache import STATIC_MAPS_URL, static_map_params
+
+    api_key = os.environ["API_KEY"]
+    session = requests.Session()
+    adapter = RecordingAdapter()
+    session.mount("https://", adapter)
+    gmaps = googlemaps.Client(key=api_key, requests_session=session)
+
+    formatted = []
+    for address in addresses:
+        result = gmaps.geocode(address)
+        formatted.append(result[0]["formatted_address"] if result else address)
+    for origin, destination in zip(formatted, formatted[1:]):
+        for mode in MODES:
+            gmaps.directions(origin, destination, mode=mode, alternatives=True)
+        session.get(STATIC_MAPS_URL, params=static_map_params(origin, destination, api_key))
+
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"recordings": adapter.recordings}, f, indent=1)
+    print(f"recorded {len(adapter.recordings)} responses to {out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    record_parser = commands.add_parser("record", help="record live responses (needs API_KEY)")
+    record_parser.add_argument("--out", required=True)
+    record_parser.add_argument("addresses", nargs="+")
+    synth_parser = commands.add_parser("synthesize", help="write the synthetic fixtures")
+    synth_parser.add_argument("--out", default=DEFAULT_FIXTURES)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.addresses, args.out)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"recordings": synthesize()}, f, indent=1)
+        print(f"wrote synthetic fixtures to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
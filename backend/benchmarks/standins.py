@@ -0,0 +1,286 @@
+"""In-memory MongoDB stand-in for benchmarks.
+
+`memory_database()` returns a database whose collections implement just
+the calls bench_suite.py and bench_recompute.py make:
+
+- `find` (with `sort`/`limit`), `find_one`, `count_documents`
+- `insert_one`, `insert_many`, `update_one`, `find_one_and_update` and
+  `bulk_write` of `UpdateOne` (with upserts) and `UpdateMany`
+- equality, `$ne`, `$in` and range filters on dotted paths, where arrays match
+  per element
+- `$set`, `$setOnInsert`, `$inc` and `$push` (with `$each`/`$slice`)
+- inclusion and exclusion projections
+- duplicate `_id`s, as DuplicateKeyError (BulkWriteError from `bulk_write`)
+
+Anything else fails (a KeyError or AttributeError) rather than answering
+differently from Mongo, and writes return nothing. mongomock isn't used:
+its bulk_write rejects current pymongo's operations, and without hash
+indexes its lookups would dominate the figures. Equality lookups on `_id` and
+`username` use a hash index, like the real unique indexes. Each
+collection has one lock, which stands in for Mongo's document-level
+atomicity. Documents are copied on the way in and out, as they would be
+over the wire.
+"""
+import copy
+import operator
+import threading
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateMany
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+INDEXED_FIELDS = ("_id", "username")
+COMPARISONS = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt, "$lte": operator.le}
+_MISSING = object()
+# Mongo's duplicate key error code
+DUPLICATE_KEY = 11000
+
+
+def get_path(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return _MISSING
+        doc = doc[part]
+    return doc
+
+
+def set_path(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _values(value):
+    """Values a filter condition is matched against (arrays match per element)."""
+    if isinstance(value, list):
+        return value + [value]
+    return [value]
+
+
+def _compare(op, value, operand):
+    if op == "$ne":
+        return value is _MISSING or operand not in _values(value)
+    if op == "$in":
+        return value is not _MISSING and any(candidate in operand for candidate in _values(value))
+    compare = COMPARISONS[op]
+    if value is _MISSING:
+        return False
+    for candidate in _values(value):
+        try:
+            if compare(candidate, operand):
+                return True
+        except TypeError:  # Mongo only compares values of the same type
+            continue
+    return False
+
+
+def matches(doc, query):
+    for path, condition in query.items():
+        value = get_path(doc, path)
+        if isinstance(condition, dict) and condition and next(iter(condition)).startswith("$"):
+            if not all(_compare(op, value, operand) for op, operand in condition.items()):
+                return False
+        elif value is _MISSING or condition not in _values(value):
+            return False
+    return True
+
+
+def apply_update(doc, update, inserting=False):
+    for path, value in update.get("$set", {}).items():
+        set_path(doc, path, copy.deepcopy(value))
+    if inserting:
+        for path, value in update.get("$setOnInsert", {}).items():
+            set_path(doc, path, copy.deepcopy(value))
+    for path, amount in update.get("$inc", {}).items():
+        current = get_path(doc, path)
+        set_path(doc, path, amount if current is _MISSING else current + amount)
+    for path, value in update.get("$push", {}).items():
+        current = get_path(doc, path)
+        items = list(current) if current is not _MISSING else []
+        if isinstance(value, dict) and "$each" in value:
+            items.extend(copy.deepcopy(value["$each"]))
+            if "$slice" in value:
+                limit = value["$slice"]
+                items = items[limit:] if limit < 0 else items[:limit]
+        else:
+            items.append(copy.deepcopy(value))
+        set_path(doc, path, items)
+
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    if any(projection.values()):
+        include = {path for path, flag in projection.items() if flag and path != "_id"}
+        result = {}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        for path in include:
+            value = get_path(doc, path)
+            if value is not _MISSING:
+                set_path(result, path, copy.deepcopy(value))
+        return result
+    result = copy.deepcopy(doc)
+    for path in projection:
+        parts = path.split(".")
+        parent = get_path(result, ".".join(parts[:-1])) if len(parts) > 1 else result
+        if isinstance(parent, dict):
+            parent.pop(parts[-1], None)
+    return result
+
+
+class MemoryCursor:
+    def __init__(self, docs, projection):
+        self._docs = docs
+        self._projection = projection
+        self._sort = None
+        self._limit = 0
+
+    def sort(self, path, direction=1):
+        self._sort = (path, direction)
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def __iter__(self):
+        docs = self._docs
+        if self._sort:
+            path, direction = self._sort
+            docs = sorted(docs, key=lambda doc: _sort_key(get_path(doc, path)), reverse=direction < 0)
+        if self._limit:
+            docs = docs[:self._limit]
+        return (project(doc, self._projection) for doc in docs)
+
+
+def _sort_key(value):
+    return (value is not _MISSING, value if value is not _MISSING else 0)
+
+
+class MemoryCollection:
+    def __init__(self, name):
+        self.name = name
+        self._docs = {}  # _id -> document
+        self._indexes = {field: {} for field in INDEXED_FIELDS}
+        self._lock = threading.RLock()
+
+    def _index(self, doc):
+        for field, index in self._indexes.items():
+            if field in doc:
+                index.setdefault(doc[field], set()).add(doc["_id"])
+
+    def _unindex(self, doc):
+        for field, index in self._indexes.items():
+            if field in doc:
+                index.get(doc[field], set()).discard(doc["_id"])
+
+    def _matching(self, query):
+        query = query or {}
+        candidates = self._docs.values()
+        for field, index in self._indexes.items():
+            value = query.get(field, _MISSING)
+            if value is not _MISSING and not isinstance(value, dict):
+                candidates = [self._docs[_id] for _id in index.get(value, ())]
+                break
+        return [doc for doc in candidates if matches(doc, query)]
+
+    def find(self, filter=None, projection=None):
+        with self._lock:
+            return MemoryCursor(self._matching(filter), projection)
+
+    def find_one(self, filter=None, projection=None):
+        with self._lock:
+            found = self._matching(filter)
+            return project(found[0], projection) if found else None
+
+    def count_documents(self, filter):
+        with self._lock:
+            return len(self._matching(filter))
+
+    def _insert(self, document):
+        doc = copy.deepcopy(document)
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self._docs:
+            raise DuplicateKeyError(f"duplicate key: {doc['_id']!r}", code=DUPLICATE_KEY)
+        document.setdefault("_id", doc["_id"])
+        self._docs[doc["_id"]] = doc
+        self._index(doc)
+
+    def insert_one(self, document):
+        with self._lock:
+            self._insert(document)
+
+    def insert_many(self, documents, ordered=True):
+        with self._lock:
+            for document in documents:
+                self._insert(document)
+
+    def _update(self, filter, update, upsert=False):
+        """Update the first match; returns (before, after)."""
+        found = self._matching(filter)
+        if found:
+            doc = found[0]
+            before = copy.deepcopy(doc)
+            self._unindex(doc)
+            apply_update(doc, update)
+            self._index(doc)
+            return before, doc
+        if not upsert:
+            return None, None
+        doc = {path: value for path, value in filter.items()
+               if not isinstance(value, dict) and "." not in path}
+        apply_update(doc, update, inserting=True)
+        self._insert(doc)
+        return None, doc
+
+    def update_one(self, filter, update):
+        with self._lock:
+            self._update(filter, update)
+
+    def find_one_and_update(self, filter, update, projection=None,
+                            return_document=ReturnDocument.BEFORE):
+        with self._lock:
+            before, after = self._update(filter, update)
+            result = after if return_document == ReturnDocument.AFTER else before
+            return project(result, projection) if result is not None else None
+
+    def bulk_write(self, requests, ordered=True):
+        errors = []
+        with self._lock:
+            for index, op in enumerate(requests):
+                if isinstance(op, UpdateMany):
+                    for doc in self._matching(op._filter):
+                        self._unindex(doc)
+                        apply_update(doc, op._doc)
+                        self._index(doc)
+                    continue
+                try:
+                    self._update(op._filter, op._doc, op._upsert)
+                except DuplicateKeyError as e:
+                    errors.append({"index": index, "code": e.code, "errmsg": str(e)})
+                    if ordered:
+                        break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": []})
+
+
+class MemoryDatabase:
+    def __init__(self, name="bench"):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(name)
+            return self._collections[name]
+
+
+def memory_database(name="bench"):
+    return MemoryDatabase(name)
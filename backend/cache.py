@@ -0,0 +1,219 @@
+"""Size-bounded TTL/LRU caches for geocode and directions lookups."""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+# Returned by `get` on a miss, so a cached `None` (e.g. "no such address") can
+# still be told apart from "not cached"
+MISSING = object()
+
+KEY_SEPARATOR = "\x1f"
+
+
+def make_key(*parts):
+    """Join key parts into a single string usable by every backend."""
+    return KEY_SEPARATOR.join(str(part) for part in parts)
+
+
+def normalize_address(address):
+    """Normalize a free-form address so trivial variations share a cache entry."""
+    if not address:
+        return ""
+    return " ".join(address.split()).lower()
+
+
+class TTLCache:
+    """In-process cache with a size bound, per-entry TTLs and LRU eviction."""
+
+    def __init__(self, name, maxsize=10000, ttl=3600):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+class MongoCache:
+    """Shared cache stored in a MongoDB collection.
+
+    Entries expire through a TTL index on `expires_at`; Mongo's TTL monitor
+    only runs about once a minute, so `get` also checks the expiry itself.
+    Values that aren't BSON-safe go through `encode` on the way in and
+    `decode` on the way out; `decode` returns MISSING to reject an entry.
+    """
+
+    def __init__(self, name, collection, ttl=3600, encode=None, decode=None):
+        self.name = name
+        self.collection = collection
+        self.ttl = ttl
+        self.encode = encode
+        self.decode = decode
+        self.hits = 0
+        self.misses = 0
+        self._indexed = False
+
+    def get(self, key, default=MISSING):
+        entry = self.get_entry(key)
+        return default if entry is MISSING else entry[0]
+
+    def get_entry(self, key):
+        """`(value, seconds until it expires)` for `key`, or MISSING."""
+        doc = self.collection.find_one({"_id": key}, {"value": 1, "expires_at": 1})
+        now = datetime.now(timezone.utc)
+        if doc is None or doc["expires_at"].replace(tzinfo=timezone.utc) <= now:
+            self.misses += 1
+            return MISSING
+        value = doc["value"] if self.decode is None else self.decode(doc["value"])
+        if value is MISSING:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return value, (doc["expires_at"].replace(tzinfo=timezone.utc) - now).total_seconds()
+
+    def set(self, key, value, ttl=None):
+        if not self._indexed:
+            # On first write rather than at construction, so importing the app stays offline
+            self.collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl if ttl is None else ttl)
+        if self.encode is not None:
+            value = self.encode(value)
+        self.collection.replace_one(
+            {"_id": key},
+            {"_id": key, "value": value, "expires_at": expires_at},
+            upsert=True
+        )
+
+    def delete(self, key):
+        self.collection.delete_one({"_id": key})
+
+    def clear(self):
+        self.collection.delete_many({})
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "mongo",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+class TieredCache:
+    """A local TTLCache in front of a shared backend (e.g. MongoCache).
+
+    Shared hits are copied into the local tier, for the rest of their shared
+    TTL, so repeat lookups in the same worker never leave the process.
+    """
+
+    def __init__(self, local, shared):
+        self.name = local.name
+        self.local = local
+        self.shared = shared
+
+    def get(self, key, default=MISSING):
+        value = self.local.get(key)
+        if value is not MISSING:
+            return value
+        return self.get_shared(key, default)
+
+    def get_shared(self, key, default=MISSING):
+        """Look `key` up in the shared tier only, copying a hit into the local one."""
+        try:
+            entry = self.shared.get_entry(key)
+        except Exception as e:
+            print(f"Error reading shared cache '{self.name}': {e}")
+            return default
+        if entry is MISSING:
+            return default
+        value, ttl = entry
+        # Keep the writer's TTL (e.g. a short negative geocode), not the local default
+        self.local.set(key, value, ttl=max(0, ttl))
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.local.set(key, value, ttl)
+        self.set_shared(key, value, ttl)
+
+    def set_shared(self, key, value, ttl=None):
+        try:
+            self.shared.set(key, value, ttl)
+        except Exception as e:
+            print(f"Error writing shared cache '{self.name}': {e}")
+
+    def delete(self, key):
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def stats(self):
+        return {"local": self.local.stats(), "shared": self.shared.stats()}
+
+
+def build_cache(name, maxsize, ttl, backend="memory", db=None, encode=None, decode=None):
+    """Create a cache for `name` using the configured backend.
+
+    `backend` is "memory" for a per-process cache or "mongo" for a local LRU
+    tier backed by the shared `Cache_<name>` collection in `db`. The local
+    tier keeps values as they are; `encode`/`decode` convert them for Mongo.
+    """
+    local = TTLCache(name, maxsize=maxsize, ttl=ttl)
+    if backend == "mongo" and db is not None:
+        return TieredCache(local, MongoCache(name, db[f"Cache_{name}"], ttl=ttl, encode=encode, decode=decode))
+    return local
@@ -0,0 +1,83 @@
+"""Lazily built, per-process clients.
+
+`ProcessLocal(factory)` stands in for a client (MongoClient,
+googlemaps.Client, a requests session, a road graph...) and only calls
+`factory()` when it is first used. A forked child never inherits a built
+client: every `ProcessLocal` is reset in the child, so preforking servers
+(gunicorn `--preload`, uvicorn `--workers`) can import the app in the
+master and each worker opens its own sockets and monitor threads.
+
+Attribute access and calls are forwarded to the built value (the proxy's
+own methods are `instance`, `override`, `reset` and `is_built`). Subscripting
+returns another `ProcessLocal`, so Mongo handles stay lazy all the way
+down:
+
+    client = ProcessLocal(lambda: MongoClient(MONGO_URI))
+    users_collection = client["test"]["Users"]   # nothing connected yet
+    users_collection.find_one({...})             # builds the client here
+"""
+import os
+import threading
+import weakref
+
+_instances = weakref.WeakSet()
+
+
+class ProcessLocal:
+    def __init__(self, factory, name=None):
+        self._factory = factory
+        self._name = name or getattr(factory, "__name__", "client")
+        self._value = None
+        self._built = False
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    def instance(self):
+        """The value for this process, built on first use."""
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._value = self._factory()
+                    self._built = True
+        return self._value
+
+    def override(self, value):
+        """Use `value` in this process instead of building one (benchmarks, tests)."""
+        with self._lock:
+            self._value = value
+            self._built = True
+
+    @property
+    def is_built(self):
+        return self._built
+
+    def reset(self):
+        """Forget the value; the next use builds a new one."""
+        self._value = None
+        self._built = False
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.instance(), name)
+
+    def __getitem__(self, key):
+        return ProcessLocal(lambda: self.instance()[key], name=f"{self._name}[{key!r}]")
+
+    def __call__(self, *args, **kwargs):
+        return self.instance()(*args, **kwargs)
+
+    def __repr__(self):
+        state = "built" if self._built else "not built"
+        return f"<ProcessLocal {self._name} ({state})>"
+
+
+def _reset_after_fork():
+    # The parent's sockets and threads aren't usable here; build fresh ones
+    for instance in list(_instances):
+        instance.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
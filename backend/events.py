@@ -0,0 +1,295 @@
+"""Push leaderboard diffs and point updates to clients as server-sent events.
+
+Publishers call `EventBus.publish(topic, event)`:
+
+- the `Leaderboard` publishes every change to `"leaderboard"` (its
+  `on_change` hook): `{"type": "update", "version", "username",
+  "sustainability_points", "rank", "previous_rank"}`, or `{"type": "reload"}`
+  after a rebuild
+- points awards publish `{"username", "total_points", ...}` to
+  `user_topic(username)`, and finished background jobs (jobs.py) publish
+  `{"type": "job", "job_id", "kind", "status", ...}` there too
+
+Each subscriber has a bounded queue. A client that falls behind by more
+than `EVENTS_QUEUE_SIZE` events is sent a fresh snapshot instead of the
+backlog. Events carry absolute points and ranks, so applying one twice, or
+after a snapshot that already includes it, is harmless.
+
+The bus is per process. With several workers, set `EVENTS_SOURCE=mongo`:
+`ChangeStreamSource` then watches the Users collection (a replica set or
+Atlas is required) and republishes every points change in every worker,
+whichever worker made it.
+
+A stream (`GET /events?username=<name>&limit=<n>`) sends:
+
+    event: snapshot      {"leaderboard": [...top n], "version", "user": {...}}
+    event: leaderboard   a diff touching the top n (id: board version)
+    event: points        {"username", "total_points", "delta", ...}
+    event: job           {"job_id", "kind", "status", "result", "error"}
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+import metrics
+
+LEADERBOARD_TOPIC = "leaderboard"
+
+EVENTS_SOURCE = os.getenv("EVENTS_SOURCE", "local")  # "local" or "mongo"
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 256))
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", 15))
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", 3000))
+
+# Mongo's error code for change streams on a standalone server
+CHANGE_STREAM_UNSUPPORTED = 40573
+
+
+def user_topic(username):
+    return f"user:{username}"
+
+
+class Subscription:
+    """One client's queue of `(topic, event)` pairs.
+
+    Consumers wait on `wait()` (threads) or `wait_async()` (pass the event
+    loop to `EventBus.subscribe`), then `drain()`. Publishers only signal an
+    empty queue, so a burst of events costs the consumer one wakeup.
+    """
+
+    def __init__(self, topics, maxsize, loop=None):
+        self.topics = frozenset(topics)
+        self.maxsize = maxsize
+        self._events = deque()
+        self._overflowed = False
+        self._signalled = False
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._ready = threading.Event() if loop is None else asyncio.Event()
+
+    def push(self, topic, event):
+        with self._lock:
+            if len(self._events) >= self.maxsize:
+                # Too far behind; the consumer resyncs from a snapshot
+                self._events.clear()
+                self._overflowed = True
+                metrics.events_dropped.inc(topic=topic.split(":", 1)[0])
+            else:
+                self._events.append((topic, event))
+            signal = not self._signalled
+            self._signalled = True
+        if signal:
+            if self._loop is None:
+                self._ready.set()
+            else:
+                try:
+                    self._loop.call_soon_threadsafe(self._ready.set)
+                except RuntimeError:
+                    pass  # Loop closed; the stream is gone
+
+    def drain(self):
+        """`(events, overflowed)` since the last drain."""
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+            overflowed, self._overflowed = self._overflowed, False
+            self._signalled = False
+            self._ready.clear()
+        return events, overflowed
+
+    def wait(self, timeout):
+        """Block until there is something to drain; False on timeout."""
+        return self._ready.wait(timeout)
+
+    async def wait_async(self, timeout):
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class EventBus:
+    def __init__(self, maxsize=EVENTS_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self._subscribers = {}  # topic -> set of Subscriptions
+        self._lock = threading.Lock()
+
+    def subscribe(self, topics, loop=None):
+        subscription = Subscription(topics, self.maxsize, loop)
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._subscribers.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[topic]
+
+    def publish(self, topic, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            subscription.push(topic, event)
+        metrics.events_published.inc(topic=topic.split(":", 1)[0])
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({s for subscribers in self._subscribers.values() for s in subscribers})
+
+
+def format_event(name, data, event_id=None):
+    """One SSE frame."""
+    lines = [f"event: {name}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+def keepalive_frame():
+    # A comment line; keeps proxies and mobile networks from closing the stream
+    return ": keepalive\n\n"
+
+
+def retry_frame():
+    return f"retry: {EVENTS_RETRY_MS}\n\n"
+
+
+class StreamState:
+    """What one client has been sent: turns bus events into SSE frames.
+
+    Leaderboard diffs are only sent when they touch the client's top
+    `limit`; point events carry the delta against the last total sent.
+    """
+
+    def __init__(self, username=None, limit=10):
+        self.username = username
+        self.limit = limit
+        self.total_points = None
+        self.version = None  # Board version of the last snapshot
+
+    def topics(self):
+        return [LEADERBOARD_TOPIC] + ([user_topic(self.username)] if self.username else [])
+
+    def snapshot(self, leaderboard):
+        """Snapshot frame; may query Mongo for a user below the board."""
+        entries, version, _ = leaderboard.page(0, self.limit)
+        data = {"leaderboard": entries, "version": version}
+        self.version = version
+        if self.username:
+            result = leaderboard.rank_of(self.username)
+            if result is not None:
+                rank, points = result
+                self.total_points = points
+                data["user"] = {"username": self.username, "rank": rank, "sustainability_points": points}
+        return format_event("snapshot", data, version)
+
+    def frames(self, events):
+        """Frames for `events`, or None if the client needs a new snapshot."""
+        frames = []
+        for topic, event in events:
+            if topic == LEADERBOARD_TOPIC:
+                if self.version is not None and event["version"] <= self.version:
+                    continue  # Already in the snapshot
+                if event["type"] == "reload":
+                    return None
+                if self._visible(event["rank"]) or self._visible(event["previous_rank"]):
+                    frames.append(format_event("leaderboard", event, event["version"]))
+            elif event.get("type") == "job":
+                frames.append(format_event("job", event))
+            else:
+                total = event["total_points"]
+                delta = total - self.total_points if self.total_points is not None \
+                    else event.get("points_earned", 0)
+                if delta == 0 and self.total_points is not None:
+                    continue  # Already included in what the client has
+                self.total_points = total
+                frames.append(format_event("points", dict(event, delta=delta)))
+        return frames
+
+    def _visible(self, rank):
+        return rank is not None and rank <= self.limit
+
+
+class ChangeStreamSource:
+    """Republish points changes from every worker, via a Users change stream.
+
+    Runs on a daemon thread and resumes after errors from the last event
+    it saw. The worker that made a change sees it twice; the second
+    `Leaderboard.record` is a no-op and streams skip zero deltas.
+    """
+
+    PIPELINE = [
+        {"$match": {"$or": [
+            {"operationType": "insert"},
+            {"operationType": "update",
+             "updateDescription.updatedFields.sustainability_points": {"$exists": True}}
+        ]}},
+        {"$project": {
+            "operationType": 1,
+            "fullDocument.username": 1,
+            "fullDocument.sustainability_points": 1,
+            "updateDescription.updatedFields.sustainability_points": 1
+        }}
+    ]
+
+    def __init__(self, collection, bus, leaderboard, max_backoff=30):
+        self.collection = collection
+        self.bus = bus
+        self.leaderboard = leaderboard
+        self.max_backoff = max_backoff
+        self._resume_token = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="users-change-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        backoff = 1
+        while not self._stopped.is_set():
+            try:
+                with self.collection.watch(
+                    self.PIPELINE, full_document="updateLookup", resume_after=self._resume_token
+                ) as stream:
+                    backoff = 1
+                    while not self._stopped.is_set():
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+                        self._resume_token = stream.resume_token
+                        self.apply(change)
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_UNSUPPORTED:
+                    print(f"Change streams need a replica set; EVENTS_SOURCE=mongo is disabled: {e}")
+                    return
+                print(f"Error in Users change stream: {e}")
+            except PyMongoError as e:
+                print(f"Error in Users change stream: {e}")
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def apply(self, change):
+        document = change.get("fullDocument") or {}
+        username = document.get("username")
+        if username is None:
+            return
+        updated = change.get("updateDescription", {}).get("updatedFields", {})
+        # The value written by this change; fullDocument may already be newer
+        points = updated.get("sustainability_points", document.get("sustainability_points", 0))
+        self.leaderboard.record(username, points)
+        self.bus.publish(user_topic(username), {"username": username, "total_points": points})
@@ -0,0 +1,281 @@
+"""Versioned emission and points factors, swapped in without a restart.
+
+A factor set is one JSON/BSON document:
+
+    {"version": "2026-10",
+     "emission": {mode: g CO₂ per km},           # every mode in scoring.MODES
+     "points": {mode: points per km},            # every mode in scoring.MODES
+     "vehicles": {vehicle type: g CO₂ per passenger km},
+     "regions": {region: {"emission": {...}, "points": {...}, "vehicles": {...}}}}
+
+Region entries override only the factors they list. Vehicle types named
+after a mode ("DRIVING", "WALKING", "BICYCLING", "TRANSIT") default to that
+mode's emission factor, and other vehicle types missing from `vehicles` to
+the transit one. `FactorSet` checks a document and builds the scoring
+lookup tables once per region.
+
+`FactorRegistry` holds the current set and asks its source for a newer one
+at most every `reload_seconds`. A new set replaces the old one in a single
+assignment, so a request that took a set scores with it to the end.
+Versions are immutable: a changed document under a version that is
+already loaded is ignored. Sources:
+
+- `BuiltinSource`: `DEFAULT_FACTORS`
+- `FileSource`: a JSON file, read again when it changes
+- `MongoSource`: the newest set in `FactorSets` (see `publish`)
+
+`source_from_env` picks one from FACTORS_SOURCE ("builtin", "file" with
+FACTORS_PATH, or "mongo").
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from pymongo import DESCENDING
+
+from scoring import MODES, VEHICLES, build_table, build_vehicle_table
+
+FACTORS_COLLECTION = "FactorSets"
+FACTORS_SOURCE = os.getenv("FACTORS_SOURCE", "builtin")
+FACTORS_PATH = os.getenv("FACTORS_PATH")
+FACTORS_RELOAD_SECONDS = float(os.getenv("FACTORS_RELOAD_SECONDS", 30))
+
+DEFAULT_FACTORS = {
+    "version": "builtin-1",
+    # Grams CO₂ per km
+    "emission": {
+        "driving": 180,   # Average car emissions
+        "transit": 80,    # Bus emissions
+        "walking": 0,     # Walking has no emissions
+        "bicycling": 0    # Bicycling has no emissions
+    },
+    "points": {
+        "walking": 12,
+        "bicycling": 10,
+        "transit": 8,
+        "driving": 0  # No points for driving
+    },
+    # Per-vehicle factors (grams CO₂ per passenger km) for the steps of each
+    # route; WALKING (which includes transit transfers) and the other
+    # mode-named types follow "emission"
+    "vehicles": {
+        "BUS": 80,
+        "INTERCITY_BUS": 30,
+        "TROLLEYBUS": 30,
+        "SHARE_TAXI": 120,
+        "RAIL": 35,
+        "HEAVY_RAIL": 40,
+        "COMMUTER_TRAIN": 40,
+        "HIGH_SPEED_TRAIN": 25,
+        "SUBWAY": 30,
+        "METRO_RAIL": 30,
+        "TRAM": 30,
+        "MONORAIL": 30,
+        "FERRY": 110,
+        "CABLE_CAR": 10,
+        "GONDOLA_LIFT": 10,
+        "FUNICULAR": 10
+    },
+    "regions": {}
+}
+
+# Lookup tables for the vectorized scoring engine (see scoring.py), plus
+# the driving factor that CO₂ savings are measured against
+FactorTables = namedtuple("FactorTables", "emission points vehicle driving")
+
+
+def _factors(doc, field, names, complete):
+    factors = doc.get(field, {})
+    if not isinstance(factors, dict):
+        raise ValueError(f"'{field}' must be an object")
+    unknown = [name for name in factors if name not in names]
+    if unknown:
+        raise ValueError(f"Unknown names in '{field}': {unknown}")
+    missing = [name for name in names if name not in factors] if complete else []
+    if missing:
+        raise ValueError(f"'{field}' is missing {missing}")
+    for name, factor in factors.items():
+        if isinstance(factor, bool) or not isinstance(factor, (int, float)) or factor < 0:
+            raise ValueError(f"'{field}.{name}' must be a non-negative number")
+    return dict(factors)
+
+
+class FactorSet:
+    """One validated factor document; raises ValueError for a bad one."""
+
+    def __init__(self, doc):
+        if not isinstance(doc, dict) or doc.get("version") in (None, ""):
+            raise ValueError("A factor set needs a 'version'")
+        self.version = str(doc["version"])
+        self.emission = _factors(doc, "emission", MODES, complete=True)
+        self.points = _factors(doc, "points", MODES, complete=True)
+        self.vehicles = _factors(doc, "vehicles", VEHICLES, complete=False)
+        regions = doc.get("regions") or {}
+        if not isinstance(regions, dict):
+            raise ValueError("'regions' must be an object")
+        self.regions = {}
+        for region, overrides in regions.items():
+            if not isinstance(overrides, dict) or set(overrides) - {"emission", "points", "vehicles"}:
+                raise ValueError(f"Region '{region}' may only override emission, points and vehicles")
+            self.regions[str(region)] = {
+                "emission": _factors(overrides, "emission", MODES, complete=False),
+                "points": _factors(overrides, "points", MODES, complete=False),
+                "vehicles": _factors(overrides, "vehicles", VEHICLES, complete=False)
+            }
+        self._tables = {None: self._build({}, {}, {})}
+        for region, overrides in self.regions.items():
+            self._tables[region] = self._build(overrides["emission"], overrides["points"], overrides["vehicles"])
+
+    def _build(self, emission, points, vehicles):
+        emission = {**self.emission, **emission}
+        vehicle_factors = {mode.upper(): factor for mode, factor in emission.items()}
+        vehicle_factors.update(self.vehicles)
+        vehicle_factors.update(vehicles)
+        return FactorTables(
+            build_table(emission),
+            build_table({**self.points, **points}),
+            build_vehicle_table(vehicle_factors, default=emission["transit"]),
+            emission["driving"]
+        )
+
+    def region_of(self, region):
+        """`region` if this set has factors for it, else None (the defaults)."""
+        return region if region in self.regions else None
+
+    def tables(self, region=None):
+        return self._tables.get(region, self._tables[None])
+
+    def to_document(self):
+        return {
+            "version": self.version,
+            "emission": self.emission,
+            "points": self.points,
+            "vehicles": self.vehicles,
+            "regions": self.regions
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, FactorSet) and self.to_document() == other.to_document()
+
+    def __repr__(self):
+        return f"<FactorSet {self.version}, {len(self.regions)} regions>"
+
+
+class BuiltinSource:
+    def load(self):
+        return DEFAULT_FACTORS
+
+
+class FileSource:
+    """A JSON factor document on disk; `load` is None while the file is unchanged."""
+
+    def __init__(self, path):
+        self.path = path
+        self._stamp = None
+
+    def load(self):
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return None
+        with open(self.path, encoding="utf-8") as f:
+            doc = json.load(f)
+        self._stamp = stamp
+        return doc
+
+
+class MongoSource:
+    """The most recently published set in `FactorSets`; None if nothing is published yet."""
+
+    def __init__(self, db):
+        self.collection = db[FACTORS_COLLECTION]
+
+    def load(self):
+        return self.collection.find_one({}, sort=[("published_at", DESCENDING)])
+
+    def get(self, version):
+        doc = self.collection.find_one({"_id": str(version)})
+        return FactorSet(doc) if doc is not None else None
+
+
+def publish(db, doc):
+    """Validate a factor document and make it the newest set in `FactorSets`.
+
+    The version is the document's `_id`, so publishing a version twice
+    raises DuplicateKeyError instead of changing history.
+    """
+    factors = FactorSet(doc)
+    db[FACTORS_COLLECTION].insert_one(dict(
+        factors.to_document(), _id=factors.version, published_at=datetime.now(timezone.utc)
+    ))
+    return factors
+
+
+def source_from_env(db=None):
+    """Factor source for FACTORS_SOURCE; "mongo" needs `db`."""
+    if FACTORS_SOURCE == "file":
+        if FACTORS_PATH:
+            return FileSource(FACTORS_PATH)
+        print("FACTORS_SOURCE=file needs FACTORS_PATH; using built-in factors.")
+    elif FACTORS_SOURCE == "mongo":
+        if db is not None:
+            return MongoSource(db)
+        print("FACTORS_SOURCE=mongo needs a database; using built-in factors.")
+    elif FACTORS_SOURCE != "builtin":
+        print(f"Unknown FACTORS_SOURCE '{FACTORS_SOURCE}'; using built-in factors.")
+    return BuiltinSource()
+
+
+class FactorRegistry:
+    """The current `FactorSet`, reloaded from `source` every `reload_seconds`.
+
+    The first `current()` waits for the source. After that, one caller
+    checks for a new version while the others keep the set they have. If
+    the source fails before anything loads, the built-in factors are used
+    until it recovers.
+    """
+
+    def __init__(self, source, reload_seconds=FACTORS_RELOAD_SECONDS):
+        self.source = source
+        self.reload_seconds = reload_seconds
+        self._current = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def due(self):
+        """Whether the next `current()` may ask the source (and wait for it)."""
+        return self._current is None or time.monotonic() >= self._next_check
+
+    def current(self):
+        if time.monotonic() >= self._next_check and self._lock.acquire(blocking=self._current is None):
+            try:
+                if self._current is None or time.monotonic() >= self._next_check:
+                    self.reload()
+            finally:
+                self._lock.release()
+        return self._current
+
+    def reload(self):
+        """Ask the source for its set now; returns the current set."""
+        self._next_check = time.monotonic() + self.reload_seconds
+        try:
+            doc = self.source.load()
+            loaded = FactorSet(doc) if doc is not None else None
+        except Exception as e:
+            print(f"Error loading emission factors: {e}")
+            loaded = None
+        if loaded is None:
+            if self._current is None:
+                self._current = FactorSet(DEFAULT_FACTORS)
+            return self._current
+        if self._current is not None and loaded.version == self._current.version:
+            if loaded != self._current:
+                print(f"Ignoring changed factors under loaded version '{loaded.version}'; "
+                      f"publish them under a new version.")
+            return self._current
+        self._current = loaded
+        print(f"Loaded emission factors version '{loaded.version}'.")
+        return loaded
@@ -0,0 +1,20 @@
+"""gunicorn settings for the Flask app:
+
+    gunicorn 'newapp:create_app()'
+
+gunicorn reads this file from the working directory. The app is imported
+once in the master and forked; `post_fork` then runs `newapp.bootstrap()`
+in every worker, so the clients, change stream and job workers it starts
+belong to that worker.
+"""
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+preload_app = True
+
+
+def post_fork(server, worker):
+    import newapp
+
+    newapp.bootstrap()
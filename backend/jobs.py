@@ -0,0 +1,322 @@
+"""Durable background jobs for work the response doesn't need to wait on.
+
+`JobQueue` keeps jobs in a local SQLite file (WAL mode), so they survive a
+restart and every worker process on the host shares one queue. A job is
+claimed with a lease, which `WorkerPool` renews every third of
+`lease_seconds` while the handler runs; if its worker dies, the job is
+claimed again once the lease runs out, and only that new claim can
+finish it. Failed jobs are retried with exponential backoff until
+`max_attempts`, then stay `failed` with their last error.
+
+`WorkerPool` runs handlers on a few daemon threads:
+
+    pool = WorkerPool(queue, {"render_map": render_map}).start()
+    job_id = queue.enqueue("render_map", {"origin": ..., "destination": ...})
+    pool.notify()
+
+A handler gets the job (a dict with `id`, `kind`, `payload`, `attempts`) and
+returns a JSON-serializable result; raising schedules a retry. Delivery is
+at least once, so handlers must tolerate running twice.
+
+Job states: queued -> running -> done, or back to queued on error, or
+failed after the last attempt.
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+import metrics
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    run_at REAL NOT NULL,
+    lease_until REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_run_at ON jobs (status, run_at);
+"""
+
+# Returned to clients polling a job; the payload stays on the server
+PUBLIC_FIELDS = ("id", "kind", "status", "attempts", "max_attempts",
+                 "created_at", "finished_at", "result", "error")
+
+
+def _row_to_job(row):
+    job = dict(row)
+    for field in ("payload", "result"):
+        if job.get(field) is not None:
+            job[field] = json.loads(job[field])
+    return job
+
+
+class JobQueue:
+    def __init__(self, path, lease_seconds=60, retry_base_seconds=2, retry_max_seconds=300):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connection(self):
+        """This thread's connection; a forked child opens its own."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit; claims take the write lock explicitly (BEGIN IMMEDIATE)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+            if not self._schema_ready:
+                with self._schema_lock:
+                    connection.executescript(SCHEMA)
+                    self._schema_ready = True
+        return connection
+
+    def enqueue(self, kind, payload, owner=None, max_attempts=5, delay=0):
+        """Add a job and return its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO jobs (id, kind, owner, payload, status, max_attempts, created_at, run_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, owner, json.dumps(payload, separators=(",", ":")), QUEUED,
+             max_attempts, now, now + delay)
+        )
+        return job_id
+
+    def claim(self, kinds=None):
+        """Lease the next due job (or one whose lease ran out); None if there is none.
+
+        With `kinds`, only jobs of those kinds are claimed.
+        """
+        connection = self._connection()
+        now = time.time()
+        query = "SELECT * FROM jobs WHERE ((status = ? AND run_at <= ?) OR (status = ? AND lease_until <= ?))"
+        params = [QUEUED, now, RUNNING, now]
+        if kinds is not None:
+            query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(query + " ORDER BY run_at LIMIT 1", params).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ? WHERE id = ?",
+                (RUNNING, now + self.lease_seconds, row["id"])
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        job = _row_to_job(row)
+        job["status"] = RUNNING
+        job["attempts"] += 1
+        return job
+
+    def renew(self, job):
+        """Extend a claimed job's lease; False if it was since claimed again or finished."""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND attempts = ?",
+            (time.time() + self.lease_seconds, job["id"], RUNNING, job["attempts"])
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job, result=None):
+        """Mark a claimed job done; False if it was since claimed again or finished."""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_until = NULL,"
+            " finished_at = ? WHERE id = ? AND status = ? AND attempts = ?",
+            (DONE, json.dumps(result, separators=(",", ":")), time.time(), job["id"],
+             RUNNING, job["attempts"])
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, job, error):
+        """Schedule a retry with backoff, or mark the job failed; returns the new status.
+
+        Returns None if the job was since claimed again or finished.
+        """
+        now = time.time()
+        if job["attempts"] >= job["max_attempts"]:
+            cursor = self._connection().execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, finished_at = ?"
+                " WHERE id = ? AND status = ? AND attempts = ?",
+                (FAILED, error, now, job["id"], RUNNING, job["attempts"])
+            )
+            return FAILED if cursor.rowcount == 1 else None
+        delay = min(self.retry_base_seconds * 2 ** (job["attempts"] - 1), self.retry_max_seconds)
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, run_at = ?"
+            " WHERE id = ? AND status = ? AND attempts = ?",
+            (QUEUED, error, now + delay * random.uniform(0.8, 1.2), job["id"], RUNNING, job["attempts"])
+        )
+        return QUEUED if cursor.rowcount == 1 else None
+
+    def get(self, job_id):
+        """Public fields of a job, or None."""
+        row = self._connection().execute(
+            f"SELECT {', '.join(PUBLIC_FIELDS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return _row_to_job(row) if row is not None else None
+
+    def stats(self):
+        """Job counts by status, plus the age of the oldest due job (`lag_seconds`)."""
+        connection = self._connection()
+        now = time.time()
+        counts = dict.fromkeys((QUEUED, RUNNING, DONE, FAILED), 0)
+        counts.update(connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        oldest = connection.execute(
+            "SELECT MIN(run_at) FROM jobs WHERE status = ? AND run_at <= ?", (QUEUED, now)
+        ).fetchone()[0]
+        return {
+            "depth": counts[QUEUED] + counts[RUNNING],
+            "counts": counts,
+            "lag_seconds": now - oldest if oldest is not None else 0.0
+        }
+
+    def purge(self, older_than_seconds):
+        """Delete finished jobs older than `older_than_seconds`; returns how many."""
+        cursor = self._connection().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (DONE, FAILED, time.time() - older_than_seconds)
+        )
+        return cursor.rowcount
+
+
+class WorkerPool:
+    """Daemon threads that claim jobs from a `JobQueue` and run their handlers.
+
+    Workers only claim the kinds in `handlers`, so a pool for some kinds
+    can share the queue with the app's. Idle workers poll every
+    `poll_seconds`; `notify()` wakes them at once
+    for jobs enqueued by this process. `on_finish(job)` is called after a
+    job completes or fails for good (job has `status`, `result`, `error`).
+    """
+
+    def __init__(self, queue, handlers, workers=2, poll_seconds=1.0, on_finish=None,
+                 purge_after_seconds=7 * 24 * 3600):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.on_finish = on_finish
+        self.purge_after_seconds = purge_after_seconds
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+        self._last_purge = 0.0
+        self._running = {}  # job id -> job, for the heartbeat
+        self._running_lock = threading.Lock()
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f"jobs-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self.heartbeat, name="jobs-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                job = self.queue.claim(tuple(self.handlers))
+                if job is not None:
+                    self.run_job(job)
+                    continue
+                self._maybe_purge()
+            except sqlite3.Error as e:
+                print(f"Error in job queue: {e}")
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+    def heartbeat(self):
+        """Renew the leases of running jobs until the pool stops."""
+        while not self._stopped.wait(self.queue.lease_seconds / 3):
+            with self._running_lock:
+                jobs = list(self._running.values())
+            for job in jobs:
+                try:
+                    if not self.queue.renew(job):
+                        print(f"Lost the lease on {job['kind']} job {job['id']}")
+                except sqlite3.Error as e:
+                    print(f"Error renewing job {job['id']}: {e}")
+
+    def run_job(self, job):
+        handler = self.handlers.get(job["kind"])
+        start = time.perf_counter()
+        with self._running_lock:
+            self._running[job["id"]] = job
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job kind '{job['kind']}'")
+            result = handler(job)
+        except Exception as e:
+            print(f"Error running {job['kind']} job {job['id']} (attempt {job['attempts']}): {e}")
+            job["status"] = self.queue.fail(job, str(e))
+            job["error"] = str(e)
+        else:
+            if self.queue.complete(job, result):
+                job.update(status=DONE, result=result, error=None)
+            else:
+                job["status"] = None
+        finally:
+            with self._running_lock:
+                del self._running[job["id"]]
+        if job["status"] is None:
+            # Reclaimed after the lease ran out; the current claim reports it
+            print(f"Lost the lease on {job['kind']} job {job['id']}; dropping attempt {job['attempts']}")
+            return
+        metrics.job_duration.observe(time.perf_counter() - start, kind=job["kind"])
+        metrics.jobs_finished.inc(kind=job["kind"], status=job["status"])
+        if job["status"] != QUEUED and self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                print(f"Error reporting job {job['id']}: {e}")
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        try:
+            self.queue.purge(self.purge_after_seconds)
+        except sqlite3.Error as e:
+            print(f"Error purging finished jobs: {e}")
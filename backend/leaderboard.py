@@ -0,0 +1,192 @@
+"""In-memory sustainability leaderboard kept in sync with the Users collection."""
+import hashlib
+import json
+import threading
+import time
+from bisect import bisect_left, insort
+
+from pymongo import DESCENDING
+
+
+class Leaderboard:
+    """Top-`capacity` users by sustainability points, ordered in memory.
+
+    The board is loaded once from an indexed sort and then updated in place
+    with each user's new total, so reads never touch Mongo. Entries are kept
+    as `(-points, username)` keys so ties break alphabetically and `bisect`
+    gives ranks directly.
+
+    Users below the board are ranked with an index-only count. If a user on
+    the board loses points the next-best user is unknown, so the board is
+    rebuilt on the next read.
+
+    Awards made by other processes only reach the board through `record`
+    (the change stream, see events.py). With `refresh_seconds` set, the
+    first read after that many seconds also reloads it, so a worker that
+    doesn't hear about them is at most that far behind.
+
+    Mongo is only queried outside the board lock: a reload reads the new
+    board first and swaps it in under the lock, and while one reader
+    reloads the others keep answering from the current board. `on_change`,
+    if given, is called with every change (see events.py) after the board
+    lock is released, in version order.
+    """
+
+    def __init__(self, collection, capacity=1000, on_change=None, refresh_seconds=None):
+        self.collection = collection
+        self.capacity = capacity
+        self.on_change = on_change
+        self.refresh_seconds = refresh_seconds
+        self.version = 0
+        self._keys = []  # sorted (-points, username)
+        self._points = {}  # username -> points, for users on the board
+        self._loaded = False
+        self._stale = False
+        self._loaded_at = 0.0
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        # Taken under `_lock` and held while notifying, so changes are published in order
+        self._publish_lock = threading.Lock()
+        self._page_cache = {}  # (offset, limit) -> (entries, etag), cleared on every change
+
+    def load(self):
+        """(Re)build the board from the sustainability_points index (see schema.py)."""
+        cursor = self.collection.find(
+            {},
+            {'username': 1, 'sustainability_points': 1, '_id': 0}
+        ).sort('sustainability_points', DESCENDING).limit(self.capacity)
+        points = {
+            entry.get('username', 'Unknown'): entry.get('sustainability_points', 0)
+            for entry in cursor
+        }
+        keys = sorted((-value, name) for name, value in points.items())
+        with self._lock:
+            self._loaded_at = time.monotonic()
+            self._stale = False
+            if self._loaded and points == self._points:
+                return  # Nothing changed; keep the version and cached pages
+            self._points = points
+            self._keys = keys
+            self._loaded = True
+            self._bump()
+            event = {"type": "reload", "version": self.version}
+            self._publish_lock.acquire()
+        self._publish(event)
+
+    def _needs_load(self):
+        return not self._loaded or self._stale or (
+            self.refresh_seconds is not None
+            and time.monotonic() - self._loaded_at >= self.refresh_seconds
+        )
+
+    def _ensure_loaded(self):
+        """Reload if due; call without the board lock held."""
+        if not self._needs_load():
+            return
+        # Only the first load makes readers wait; later ones serve the current board
+        if self._load_lock.acquire(blocking=not self._loaded):
+            try:
+                if self._needs_load():
+                    self.load()
+            finally:
+                self._load_lock.release()
+
+    def _bump(self):
+        self.version += 1
+        self._page_cache.clear()
+
+    def _publish(self, event):
+        """Call `on_change` with `_publish_lock`, acquired under `_lock`, held."""
+        try:
+            if self.on_change is not None:
+                self.on_change(event)
+        finally:
+            self._publish_lock.release()
+
+    def _rank(self, points):
+        return bisect_left(self._keys, (-points,)) + 1
+
+    def _remove(self, username):
+        key = (-self._points.pop(username), username)
+        del self._keys[bisect_left(self._keys, key)]
+
+    def record(self, username, points):
+        """Set a user's current total after an update to the Users collection."""
+        with self._lock:
+            if not self._loaded:
+                return
+            previous = self._points.get(username)
+            if previous == points:
+                return
+            key = (-points, username)
+            previous_rank = None
+            if previous is not None:
+                previous_rank = self._rank(previous)
+                self._remove(username)
+                if points < previous and len(self._keys) >= self.capacity - 1:
+                    # Someone off the board may now outrank this user
+                    self._stale = True
+            elif len(self._keys) >= self.capacity and key > self._keys[-1]:
+                return  # Still below the board
+            insort(self._keys, key)
+            self._points[username] = points
+            while len(self._keys) > self.capacity:
+                _, dropped = self._keys.pop()
+                del self._points[dropped]
+            self._bump()
+            event = {
+                "type": "update",
+                "version": self.version,
+                "username": username,
+                "sustainability_points": points,
+                "rank": self._rank(points) if username in self._points else None,
+                "previous_rank": previous_rank
+            }
+            self._publish_lock.acquire()
+        self._publish(event)
+
+    def page(self, offset=0, limit=10):
+        """Return `(entries, version, etag)` for a slice of the ranking."""
+        self._ensure_loaded()
+        with self._lock:
+            cache_key = (offset, limit)
+            cached = self._page_cache.get(cache_key)
+            if cached is None:
+                entries = [
+                    {
+                        'rank': self._rank(-neg_points),
+                        'username': username,
+                        'sustainability_points': -neg_points
+                    }
+                    for neg_points, username in self._keys[offset:offset + limit]
+                ]
+                # Content hash, so every worker agrees on the ETag
+                digest = hashlib.blake2b(
+                    json.dumps(entries, sort_keys=True).encode('utf-8'),
+                    digest_size=12
+                ).hexdigest()
+                cached = (entries, digest)
+                self._page_cache[cache_key] = cached
+            return cached[0], self.version, cached[1]
+
+    def rank_of(self, username):
+        """Return `(rank, points)` for a user, or `None` if they don't exist."""
+        self._ensure_loaded()
+        with self._lock:
+            points = self._points.get(username)
+            if points is not None:
+                return self._rank(points), points
+
+        user = self.collection.find_one(
+            {'username': username},
+            {'sustainability_points': 1, '_id': 0}
+        )
+        if user is None:
+            return None
+        points = user.get('sustainability_points', 0)
+        # Answered from the sustainability_points index alone
+        ahead = self.collection.count_documents({'sustainability_points': {'$gt': points}})
+        return ahead + 1, points
+
+    def __len__(self):
+        return len(self._keys)
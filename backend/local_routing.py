@@ -0,0 +1,419 @@
+"""Offline routing over a road graph built from a local OpenStreetMap extract.
+
+`load_road_graph("city.osm")` parses an OSM XML extract once and caches the
+result next to it as `city.osm.npz`; later starts load the arrays directly.
+Each mode (walking, bicycling, driving) gets its own CSR adjacency:
+
+    indptr[n]:indptr[n + 1]   edges leaving node n
+    indices[e]                edge e's head node
+    length_m[e], time_s[e]    edge e's length and travel time
+
+`LocalRouter.directions` answers with the same shape as
+`googlemaps.Client.directions`, so `RouteOption.from_directions`, the directions
+cache and the scoring path work unchanged; `is_local` tells its results
+apart, so they're cached only briefly. `FallbackDirections` puts the
+local router behind the Maps API for when the API is failing or slow.
+"""
+import heapq
+import math
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+LOCAL_MODES = ("walking", "bicycling", "driving")
+
+# Driving speeds (km/h) by highway type when a way has no usable maxspeed
+DRIVING_SPEEDS_KMH = {
+    "motorway": 100, "motorway_link": 60,
+    "trunk": 80, "trunk_link": 50,
+    "primary": 60, "primary_link": 40,
+    "secondary": 50, "secondary_link": 40,
+    "tertiary": 40, "tertiary_link": 30,
+    "unclassified": 30, "residential": 25,
+    "living_street": 10, "service": 15, "road": 30
+}
+WALKING_SPEED_KMH = 5
+BICYCLING_SPEED_KMH = 15
+
+# Highway types usable by each mode besides the driving network
+FOOT_ONLY = {"footway", "pedestrian", "steps", "path", "track", "cycleway", "bridleway"}
+BICYCLE_EXTRA = {"cycleway", "path", "track"}
+NO_FOOT_OR_BICYCLE = {"motorway", "motorway_link", "trunk", "trunk_link"}
+
+# Origins/destinations farther than this from any routable node get no route
+MAX_SNAP_METERS = float(os.getenv("LOCAL_ROUTING_MAX_SNAP_METERS", 2000))
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_maxspeed(value):
+    """OSM maxspeed tag to km/h, or None if it isn't numeric."""
+    if not value:
+        return None
+    value = value.strip().lower()
+    factor = 1.609344 if value.endswith("mph") else 1.0
+    try:
+        return float(value.replace("mph", "").replace("km/h", "").strip()) * factor
+    except ValueError:
+        return None
+
+
+def way_directions(tags, mode):
+    """(forward, backward) access of a way for `mode`, or None if it's closed to it."""
+    highway = tags.get("highway")
+    if highway is None or tags.get("area") == "yes":
+        return None
+    access = tags.get("access")
+    if mode == "walking":
+        if highway in NO_FOOT_OR_BICYCLE or tags.get("foot") == "no":
+            return None
+        if access in ("no", "private") and tags.get("foot") not in ("yes", "designated"):
+            return None
+        return True, True
+
+    oneway = tags.get("oneway")
+    if tags.get("junction") == "roundabout" or (mode == "driving" and highway == "motorway"):
+        oneway = oneway or "yes"
+    if mode == "bicycling":
+        allowed = highway in DRIVING_SPEEDS_KMH or highway in BICYCLE_EXTRA
+        if highway in NO_FOOT_OR_BICYCLE or tags.get("bicycle") == "no":
+            return None
+        if not allowed and tags.get("bicycle") not in ("yes", "designated"):
+            return None
+        if access in ("no", "private") and tags.get("bicycle") not in ("yes", "designated"):
+            return None
+        if tags.get("oneway:bicycle") == "no":
+            oneway = "no"
+    else:
+        if highway not in DRIVING_SPEEDS_KMH:
+            return None
+        if access in ("no", "private") or tags.get("motor_vehicle") == "no":
+            return None
+
+    if oneway in ("yes", "true", "1"):
+        return True, False
+    if oneway == "-1":
+        return False, True
+    return True, True
+
+
+def way_speed_kmh(tags, mode):
+    if mode == "walking":
+        return WALKING_SPEED_KMH
+    if mode == "bicycling":
+        return BICYCLING_SPEED_KMH
+    return parse_maxspeed(tags.get("maxspeed")) or DRIVING_SPEEDS_KMH[tags["highway"]]
+
+
+class ModeGraph:
+    """CSR adjacency for one mode."""
+
+    def __init__(self, indptr, indices, length_m, time_s):
+        self.indptr = indptr
+        self.indices = indices
+        self.length_m = length_m
+        self.time_s = time_s
+        # Fastest edge, so distance / max_speed never overestimates (admissible A*)
+        self.max_speed = float((length_m / np.maximum(time_s, 1e-6)).max()) if len(time_s) else 1.0
+        # Nodes the search can leave from; snapping only considers these
+        self.routable = np.flatnonzero(np.diff(indptr) > 0)
+        # memoryviews index as plain Python numbers, much faster than numpy
+        # scalars inside the search loop, without copying the arrays
+        self._indptr = memoryview(indptr)
+        self._indices = memoryview(indices)
+        self._length = memoryview(length_m)
+        self._time = memoryview(time_s)
+
+    @classmethod
+    def from_edges(cls, n_nodes, heads, tails, length_m, time_s):
+        order = np.argsort(heads, kind="stable")
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(heads, minlength=n_nodes), out=indptr[1:])
+        return cls(
+            indptr,
+            np.ascontiguousarray(tails[order], dtype=np.int32),
+            np.ascontiguousarray(length_m[order], dtype=np.float32),
+            np.ascontiguousarray(time_s[order], dtype=np.float32)
+        )
+
+
+class RoadGraph:
+    """Node coordinates plus one `ModeGraph` per mode."""
+
+    def __init__(self, lat, lon, modes):
+        self.lat = lat
+        self.lon = lon
+        self.modes = modes
+        self._lat = memoryview(lat)
+        self._lon = memoryview(lon)
+
+    @classmethod
+    def from_osm(cls, path):
+        """Parse an OSM XML extract (`.osm`), keeping only routable ways."""
+        coords = {}
+        ways = []
+        for _, elem in ET.iterparse(path, events=("end",)):
+            if elem.tag == "node":
+                coords[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+                elem.clear()
+            elif elem.tag == "way":
+                tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+                if "highway" in tags:
+                    ways.append(([int(nd.get("ref")) for nd in elem.iter("nd")], tags))
+                elem.clear()
+
+        # Compact node ids: only nodes on routable ways get an index
+        index = {}
+        for refs, _ in ways:
+            for ref in refs:
+                if ref in coords and ref not in index:
+                    index[ref] = len(index)
+        lat = np.empty(len(index), dtype=np.float64)
+        lon = np.empty(len(index), dtype=np.float64)
+        for ref, i in index.items():
+            lat[i], lon[i] = coords[ref]
+        del coords
+
+        edges = {mode: ([], [], [], []) for mode in LOCAL_MODES}
+        for refs, tags in ways:
+            refs = [index[ref] for ref in refs if ref in index]
+            for mode in LOCAL_MODES:
+                access = way_directions(tags, mode)
+                if access is None:
+                    continue
+                forward, backward = access
+                speed_ms = way_speed_kmh(tags, mode) / 3.6
+                heads, tails, lengths, times = edges[mode]
+                for u, v in zip(refs, refs[1:]):
+                    length = haversine_m(lat[u], lon[u], lat[v], lon[v])
+                    for a, b, allowed in ((u, v, forward), (v, u, backward)):
+                        if allowed:
+                            heads.append(a)
+                            tails.append(b)
+                            lengths.append(length)
+                            times.append(length / speed_ms)
+
+        modes = {
+            mode: ModeGraph.from_edges(
+                len(index),
+                np.asarray(heads, dtype=np.int64),
+                np.asarray(tails, dtype=np.int64),
+                np.asarray(lengths, dtype=np.float64),
+                np.asarray(times, dtype=np.float64)
+            )
+            for mode, (heads, tails, lengths, times) in edges.items()
+        }
+        return cls(lat, lon, modes)
+
+    def save(self, path):
+        arrays = {"lat": self.lat, "lon": self.lon}
+        for mode, graph in self.modes.items():
+            arrays[f"{mode}_indptr"] = graph.indptr
+            arrays[f"{mode}_indices"] = graph.indices
+            arrays[f"{mode}_length_m"] = graph.length_m
+            arrays[f"{mode}_time_s"] = graph.time_s
+        # Write-then-rename so a concurrent loader never sees half a file
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            modes = {
+                mode: ModeGraph(
+                    arrays[f"{mode}_indptr"],
+                    arrays[f"{mode}_indices"],
+                    arrays[f"{mode}_length_m"],
+                    arrays[f"{mode}_time_s"]
+                )
+                for mode in LOCAL_MODES
+                if f"{mode}_indptr" in arrays
+            }
+            return cls(arrays["lat"], arrays["lon"], modes)
+
+    def nearest_node(self, mode, lat, lon):
+        """Closest routable node for `mode` as (node, meters), or (None, None)."""
+        candidates = self.modes[mode].routable
+        if not len(candidates):
+            return None, None
+        dlat = self.lat[candidates] - lat
+        dlon = (self.lon[candidates] - lon) * math.cos(math.radians(lat))
+        node = int(candidates[np.argmin(dlat * dlat + dlon * dlon)])
+        return node, haversine_m(lat, lon, self._lat[node], self._lon[node])
+
+    def shortest_path(self, mode, source, target):
+        """Fastest path by A*; returns (length_m, time_s) or None if unreachable."""
+        graph = self.modes[mode]
+        indptr, indices = graph._indptr, graph._indices
+        lengths, times = graph._length, graph._time
+        node_lat, node_lon = self._lat, self._lon
+        target_lat, target_lon = node_lat[target], node_lon[target]
+        inv_speed = 1.0 / graph.max_speed
+
+        best = {source: 0.0}
+        settled = set()
+        heap = [(haversine_m(node_lat[source], node_lon[source], target_lat, target_lon) * inv_speed,
+                 0.0, 0.0, source)]
+        while heap:
+            _, time_s, length_m, node = heapq.heappop(heap)
+            if node == target:
+                return length_m, time_s
+            if node in settled:
+                continue
+            settled.add(node)
+            for edge in range(indptr[node], indptr[node + 1]):
+                head = indices[edge]
+                candidate = time_s + times[edge]
+                if candidate < best.get(head, math.inf):
+                    best[head] = candidate
+                    estimate = haversine_m(node_lat[head], node_lon[head], target_lat, target_lon) * inv_speed
+                    heapq.heappush(heap, (candidate + estimate, candidate, length_m + lengths[edge], head))
+        return None
+
+
+def load_road_graph(path):
+    """Load `path` (an `.osm` extract or its `.npz` cache), building the cache if needed."""
+    if path.endswith(".npz"):
+        return RoadGraph.load(path)
+    cache_path = f"{path}.npz"
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        return RoadGraph.load(cache_path)
+    graph = RoadGraph.from_osm(path)
+    try:
+        graph.save(cache_path)
+    except OSError as e:
+        print(f"Error caching road graph to '{cache_path}': {e}")
+    return graph
+
+
+def parse_coordinates(value):
+    """'lat,lng' string to a (lat, lng) tuple, or None."""
+    try:
+        lat, lng = (float(part) for part in value.split(","))
+    except (AttributeError, ValueError):
+        return None
+    if -90 <= lat <= 90 and -180 <= lng <= 180:
+        return lat, lng
+    return None
+
+
+def leg_text(distance_m, duration_s):
+    return f"{distance_m / 1000:.1f} km", f"{max(round(duration_s / 60), 1)} mins"
+
+
+class LocalRouter:
+    """Directions from a `RoadGraph`, shaped like the Directions API's.
+
+    `locate(address)` turns an address into `(lat, lng)` (or None); plain
+    "lat,lng" strings are used as-is. The distance from each address to
+    its nearest node is added as a straight access leg at the mode's speed.
+    """
+
+    ACCESS_SPEED_KMH = {"walking": WALKING_SPEED_KMH, "bicycling": BICYCLING_SPEED_KMH, "driving": 20}
+
+    def __init__(self, graph, locate=None):
+        self.graph = graph
+        self.locate = locate
+
+    def _point(self, address):
+        point = parse_coordinates(address)
+        if point is None and self.locate is not None:
+            point = self.locate(address)
+        return point
+
+    def route(self, origin, destination, mode):
+        """`{"distance_km", "duration_min"}` for one leg, or None if there's no route."""
+        if mode not in self.graph.modes:
+            return None
+        start, end = self._point(origin), self._point(destination)
+        if start is None or end is None:
+            return None
+        source, source_gap = self.graph.nearest_node(mode, *start)
+        target, target_gap = self.graph.nearest_node(mode, *end)
+        if source is None or target is None or max(source_gap, target_gap) > MAX_SNAP_METERS:
+            return None
+        path = self.graph.shortest_path(mode, source, target)
+        if path is None:
+            return None
+        length_m, time_s = path
+        access_m = source_gap + target_gap
+        return {
+            "distance_km": (length_m + access_m) / 1000,
+            "duration_min": (time_s + access_m / (self.ACCESS_SPEED_KMH[mode] / 3.6)) / 60
+        }
+
+    def directions(self, origin, destination, mode="driving", **kwargs):
+        """Drop-in for `googlemaps.Client.directions`; extra kwargs are ignored."""
+        leg = self.route(origin, destination, mode)
+        if leg is None:
+            return []
+        distance_m = leg["distance_km"] * 1000
+        duration_s = leg["duration_min"] * 60
+        distance_text, duration_text = leg_text(distance_m, duration_s)
+        return [{
+            "summary": "local",
+            "local": True,
+            "legs": [{
+                "start_address": origin,
+                "end_address": destination,
+                "distance": {"value": round(distance_m), "text": distance_text},
+                "duration": {"value": round(duration_s), "text": duration_text}
+            }]
+        }]
+
+
+def is_local(directions):
+    """Whether a directions result came from `LocalRouter` rather than the Maps API."""
+    return bool(directions) and directions[0].get("local", False)
+
+
+class FallbackDirections:
+    """Call `primary`, switching to `fallback` while `primary` is failing or slow.
+
+    A call that raises, or takes longer than `slow_after` seconds, routes
+    every call for the next `cooldown` seconds to `fallback`. The failed
+    call itself is retried on `fallback`.
+    """
+
+    def __init__(self, primary, fallback, slow_after=3.0, cooldown=60.0):
+        self.primary = primary
+        self.fallback = fallback
+        self.slow_after = slow_after
+        self.cooldown = cooldown
+        self._fallback_until = 0.0
+        self._lock = threading.Lock()
+
+    def use_fallback(self):
+        return time.monotonic() < self._fallback_until
+
+    def report(self, elapsed, failed=False):
+        """Record one primary call; a failure or slow call opens the cooldown."""
+        if failed or elapsed > self.slow_after:
+            with self._lock:
+                self._fallback_until = time.monotonic() + self.cooldown
+
+    def __call__(self, *args, **kwargs):
+        if self.use_fallback():
+            return self.fallback(*args, **kwargs)
+        start = time.monotonic()
+        try:
+            result = self.primary(*args, **kwargs)
+        except Exception as e:
+            self.report(time.monotonic() - start, failed=True)
+            print(f"Primary directions failed ({e}); using local routing for {self.cooldown:g}s.")
+            return self.fallback(*args, **kwargs)
+        self.report(time.monotonic() - start)
+        return result
@@ -0,0 +1,160 @@
+"""Content-addressed on-disk cache for Static Maps route images.
+
+Images are only served for keys the app signed (`MapImageCache.signature`),
+so /map_image can't be used to render arbitrary places with our API key.
+The cache is kept under `max_bytes` by deleting the least recently used
+images, and images unused for `max_age_seconds` are deleted too.
+"""
+import hashlib
+import hmac
+import os
+import tempfile
+import threading
+import time
+
+from metrics import timed
+
+STATIC_MAPS_URL = "https://maps.googleapis.com/maps/api/staticmap"
+
+# Styling used for every route image; part of the cache key
+DEFAULT_STYLE = {
+    "size": "600x400",
+    "origin_color": "red",
+    "destination_color": "green",
+    "path_color": "blue",
+    "path_weight": 5
+}
+
+
+def map_key(origin, destination, style=DEFAULT_STYLE):
+    """Stable key for an image of `origin` -> `destination` drawn with `style`."""
+    parts = [origin, destination] + [f"{name}={style[name]}" for name in sorted(style)]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def static_map_params(origin, destination, api_key, style=DEFAULT_STYLE):
+    """Query parameters for a Static Maps request."""
+    return [
+        ("size", style["size"]),
+        ("markers", f"color:{style['origin_color']}|{origin}"),
+        ("markers", f"color:{style['destination_color']}|{destination}"),
+        ("path", f"color:{style['path_color']}|weight:{style['path_weight']}|{origin}|{destination}"),
+        ("key", api_key)
+    ]
+
+
+class MapImageCache:
+    """PNG files stored under `directory/<key[:2]>/<key>.png`.
+
+    Files are written to a temp file and renamed into place, so concurrent
+    workers never serve a partial image. A hit refreshes the file's mtime,
+    which is what `prune` evicts by; it runs every `prune_seconds`, or
+    sooner once this process's writes take the cache over `max_bytes`.
+    """
+
+    def __init__(self, directory, api_key, session, signing_key, max_bytes=None,
+                 max_age_seconds=None, prune_seconds=300):
+        self.directory = directory
+        self.api_key = api_key
+        self.session = session
+        self.signing_key = signing_key.encode("utf-8")
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.prune_seconds = prune_seconds
+        self._size = None  # Bytes on disk at the last prune, plus writes since
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+
+    def signature(self, key):
+        """Signature /map_image requires along with the origin and destination of `key`."""
+        return hmac.new(self.signing_key, key.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def verify(self, key, signature):
+        return hmac.compare_digest(self.signature(key), signature or "")
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def get(self, key):
+        """Return cached image bytes for `key`, or None."""
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as f:
+                image = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return image
+
+    def put(self, key, image):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(image)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += len(image)
+            due = time.monotonic() >= self._next_prune or (
+                self.max_bytes is not None and self._size is not None and self._size > self.max_bytes
+            )
+            if due:
+                self._next_prune = time.monotonic() + self.prune_seconds
+        if due:
+            self.prune()
+
+    def prune(self):
+        """Delete images unused for `max_age_seconds`, then the least recently
+        used ones until the cache fits `max_bytes`; returns how many were deleted."""
+        images = []
+        try:
+            for subdirectory in os.scandir(self.directory):
+                if subdirectory.is_dir():
+                    for entry in os.scandir(subdirectory.path):
+                        if entry.name.endswith(".png"):
+                            stat = entry.stat()
+                            images.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        images.sort()
+        total = sum(size for _, size, _ in images)
+        now = time.time()
+        removed = 0
+        for mtime, size, path in images:
+            expired = self.max_age_seconds is not None and now - mtime > self.max_age_seconds
+            if not expired and (self.max_bytes is None or total <= self.max_bytes):
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass  # Another worker pruned it
+            total -= size
+        with self._lock:
+            self._size = total
+        return removed
+
+    def fetch(self, origin, destination, style=DEFAULT_STYLE):
+        """Return `(key, image)`, downloading and caching the image on a miss.
+
+        `image` is None when the Static Maps request fails.
+        """
+        key = map_key(origin, destination, style)
+        image = self.get(key)
+        if image is not None:
+            return key, image
+        try:
+            with timed("static_map"):
+                response = self.session.get(
+                    STATIC_MAPS_URL,
+                    params=static_map_params(origin, destination, self.api_key, style)
+                )
+            if response.status_code != 200:
+                print(f"Failed to fetch map image. Status code: {response.status_code}")
+                return key, None
+        except Exception as e:
+            print(f"Error generating map image: {e}")
+            return key, None
+        self.put(key, response.content)
+        return key, response.content
@@ -0,0 +1,137 @@
+"""Google Maps web service clients for the async serving mode.
+
+`AsyncMapsClient` calls the Geocoding and Directions JSON APIs with httpx on
+the running event loop. `MapsClient` is its blocking twin with the same
+interface as the subset of `googlemaps.Client` the backend uses, so both
+serving modes can point at the same (possibly stubbed) `base_url`.
+"""
+import asyncio
+import os
+
+from maps_transport import (
+    MAPS_BURST,
+    MAPS_MAX_PER_HOST,
+    MAPS_MAX_RETRIES,
+    MAPS_QPS,
+    MAPS_TIMEOUT,
+    RETRY_STATUSES,
+    RateLimiter,
+    backoff_delay,
+    session_from_env
+)
+
+MAPS_BASE_URL = os.getenv("MAPS_BASE_URL", "https://maps.googleapis.com")
+GEOCODE_PATH = "/maps/api/geocode/json"
+DIRECTIONS_PATH = "/maps/api/directions/json"
+
+
+class MapsApiError(Exception):
+    """Raised when the Maps API answers with a non-OK status."""
+
+    def __init__(self, status, message=None):
+        super().__init__(f"{status}: {message}" if message else status)
+        self.status = status
+
+
+def geocode_params(address, api_key):
+    return {"address": address, "key": api_key}
+
+
+def directions_params(origin, destination, mode, api_key, alternatives=False):
+    params = {"origin": origin, "destination": destination, "mode": mode, "key": api_key}
+    if alternatives:
+        params["alternatives"] = "true"
+    return params
+
+
+def parse_response(payload, field):
+    """Return `payload[field]` the way googlemaps.Client does.
+
+    ZERO_RESULTS and NOT_FOUND become an empty list; any other non-OK status
+    raises MapsApiError.
+    """
+    status = payload.get("status")
+    if status == "OK":
+        return payload.get(field, [])
+    if status in ("ZERO_RESULTS", "NOT_FOUND"):
+        return []
+    raise MapsApiError(status, payload.get("error_message"))
+
+
+class MapsClient:
+    """Blocking Geocoding/Directions client over the shared MapsSession."""
+
+    def __init__(self, key, base_url=MAPS_BASE_URL, session=None):
+        self.key = key
+        self.base_url = base_url.rstrip("/")
+        self.session = session or session_from_env()
+
+    def _get(self, path, params, field):
+        response = self.session.get(self.base_url + path, params=params)
+        response.raise_for_status()
+        return parse_response(response.json(), field)
+
+    def geocode(self, address):
+        return self._get(GEOCODE_PATH, geocode_params(address, self.key), "results")
+
+    def directions(self, origin, destination, mode="driving", alternatives=False, **kwargs):
+        return self._get(
+            DIRECTIONS_PATH,
+            directions_params(origin, destination, mode, self.key, alternatives),
+            "routes"
+        )
+
+
+class AsyncMapsClient:
+    """Non-blocking Geocoding/Directions client over an httpx.AsyncClient.
+
+    Applies the same QPS limit, per-host connection cap and jittered retries
+    as MapsSession, without blocking the event loop.
+    """
+
+    def __init__(self, key, base_url=MAPS_BASE_URL, timeout=MAPS_TIMEOUT,
+                 max_connections=MAPS_MAX_PER_HOST, rate_limiter=None,
+                 max_retries=MAPS_MAX_RETRIES):
+        import httpx
+
+        self.key = key
+        self.base_url = base_url.rstrip("/")
+        self.rate_limiter = rate_limiter or RateLimiter(MAPS_QPS, MAPS_BURST)
+        self.max_retries = max_retries
+        self.http = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            )
+        )
+
+    async def _get(self, path, params, field):
+        import httpx
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            await self.rate_limiter.acquire_async()
+            try:
+                response = await self.http.get(self.base_url + path, params=params)
+            except httpx.TransportError:
+                if last_attempt:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or last_attempt:
+                    response.raise_for_status()
+                    return parse_response(response.json(), field)
+            await asyncio.sleep(backoff_delay(attempt))
+
+    async def geocode(self, address):
+        return await self._get(GEOCODE_PATH, geocode_params(address, self.key), "results")
+
+    async def directions(self, origin, destination, mode="driving", alternatives=False, **kwargs):
+        return await self._get(
+            DIRECTIONS_PATH,
+            directions_params(origin, destination, mode, self.key, alternatives),
+            "routes"
+        )
+
+    async def aclose(self):
+        await self.http.aclose()
@@ -0,0 +1,132 @@
+"""Shared HTTP transport for all Google Maps traffic.
+
+Geocoding, Directions (through `googlemaps.Client(requests_session=...)`)
+and Static Maps downloads all go through one `MapsSession` per process:
+
+- pooled keep-alive connections (`MAPS_POOL_SIZE` per host)
+- at most `MAPS_MAX_PER_HOST` requests in flight per host
+- a token bucket holding the process to `MAPS_QPS` (bursts of `MAPS_BURST`)
+- retries of connection errors, 429 and 5xx with full-jitter backoff
+
+Callers over the limits wait their turn rather than failing.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Defaults should match the project's Maps quota
+MAPS_QPS = float(os.getenv("MAPS_QPS", 50))
+MAPS_BURST = float(os.getenv("MAPS_BURST", 0)) or None
+MAPS_POOL_SIZE = int(os.getenv("MAPS_POOL_SIZE", 32))
+MAPS_MAX_PER_HOST = int(os.getenv("MAPS_MAX_PER_HOST", 32))
+MAPS_MAX_RETRIES = int(os.getenv("MAPS_MAX_RETRIES", 3))
+MAPS_TIMEOUT = float(os.getenv("MAPS_TIMEOUT", 10))
+
+
+def backoff_delay(attempt, base=0.25, cap=8.0):
+    """Full-jitter exponential backoff for retry number `attempt` (from 0)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RateLimiter:
+    """Thread-safe token bucket; `acquire` blocks until a token is free.
+
+    Each caller reserves the next slot under the lock and sleeps outside it,
+    so waiting callers are released in arrival order at `rate` per second.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class MapsSession(requests.Session):
+    """requests.Session with pooling, per-host limits, QPS limiting and retries."""
+
+    def __init__(self, qps=50, burst=None, pool_size=32, max_per_host=32,
+                 max_retries=3, backoff_base=0.25, backoff_max=8.0, timeout=10):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.rate_limiter = RateLimiter(qps, burst)
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self._host_slots = {}
+        self._host_lock = threading.Lock()
+
+    def _slot(self, url):
+        host = urlsplit(url).netloc
+        with self._host_lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return slot
+
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        slot = self._slot(url)
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            self.rate_limiter.acquire()
+            try:
+                with slot:
+                    response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or last_attempt:
+                    return response
+                response.close()
+            time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max))
+
+
+def session_from_env():
+    """Build the process-wide MapsSession from MAPS_* environment variables."""
+    return MapsSession(
+        qps=MAPS_QPS,
+        burst=MAPS_BURST,
+        pool_size=MAPS_POOL_SIZE,
+        max_per_host=MAPS_MAX_PER_HOST,
+        max_retries=MAPS_MAX_RETRIES,
+        timeout=MAPS_TIMEOUT
+    )
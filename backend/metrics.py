@@ -0,0 +1,410 @@
+"""Latency histograms, error counters and a Prometheus text exporter.
+
+Every Flask route is timed through `init_app` (asgi_app.py times its native
+routes itself); external calls are timed with `timed("geocode")`-style
+context managers, and Mongo commands through `MongoCommandTimer`, a pymongo
+command listener. `/metrics` renders the registry in the Prometheus text
+format.
+
+Clients that send `X-Debug-Timing: 1` (or every request, with
+`TIMING_HEADER=always`) get a `Server-Timing` header listing how long each
+external call in that request took. The breakdown lives in a context
+variable, so it follows a request onto its asyncio tasks as well as its
+thread.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+TIMING_HEADER = os.getenv("TIMING_HEADER", "opt-in")  # "opt-in", "always" or "off"
+TIMING_REQUEST_HEADER = "X-Debug-Timing"
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in key
+    )
+    return "{" + body + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.type = "counter"
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge:
+    """A gauge whose samples come from a callback at scrape time."""
+
+    def __init__(self, name, help_text, collect):
+        self.name = name
+        self.help = help_text
+        self.type = "gauge"
+        self._collect = collect
+
+    def samples(self):
+        return [(self.name, _label_key(labels), value) for labels, value in self._collect()]
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.type = "histogram"
+        self.buckets = tuple(buckets)
+        self._series = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            series_items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", key + (("le", bound),), cumulative))
+            samples.append((f"{self.name}_sum", key, series[-1]))
+            samples.append((f"{self.name}_count", key, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text):
+        return self._register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, collect):
+        return self._register(Gauge(name, help_text, collect))
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_duration = registry.histogram(
+    "ecotrail_http_request_duration_seconds",
+    "Latency of HTTP requests by route, method and status."
+)
+http_errors = registry.counter(
+    "ecotrail_http_request_errors_total",
+    "HTTP requests that ended in a 5xx or an unhandled exception."
+)
+external_duration = registry.histogram(
+    "ecotrail_external_call_duration_seconds",
+    "Latency of calls to external services (Maps APIs, queues, ...)."
+)
+external_errors = registry.counter(
+    "ecotrail_external_call_errors_total",
+    "External calls that raised an exception."
+)
+mongo_duration = registry.histogram(
+    "ecotrail_mongo_command_duration_seconds",
+    "Latency of MongoDB commands by command name."
+)
+mongo_errors = registry.counter(
+    "ecotrail_mongo_command_errors_total",
+    "MongoDB commands that failed."
+)
+coalesced_calls = registry.counter(
+    "ecotrail_coalesced_calls_total",
+    "Lookups answered by an identical call already in flight instead of going upstream."
+)
+events_published = registry.counter(
+    "ecotrail_events_published_total",
+    "Events published to push-stream subscribers, by topic."
+)
+events_dropped = registry.counter(
+    "ecotrail_events_dropped_total",
+    "Subscriber backlogs dropped because the client fell behind (it gets a snapshot instead)."
+)
+job_duration = registry.histogram(
+    "ecotrail_job_duration_seconds",
+    "Background job run time by kind, per attempt."
+)
+jobs_finished = registry.counter(
+    "ecotrail_jobs_finished_total",
+    "Background job attempts by kind and resulting status (done, queued for retry, failed)."
+)
+
+
+_caches = []
+
+
+def register_cache(cache):
+    """Export hit/miss counts and the hit ratio of a cache from cache.py."""
+    _caches.append(cache)
+
+
+def _cache_samples(field):
+    def collect():
+        samples = []
+        for cache in _caches:
+            stats = cache.stats()
+            # Tiered caches report their local and shared tiers separately
+            tiers = stats.items() if "local" in stats else [(stats.get("backend"), stats)]
+            samples.extend(
+                ({"cache": cache.name, "tier": tier}, tier_stats.get(field, 0))
+                for tier, tier_stats in tiers
+            )
+        return samples
+    return collect
+
+
+registry.gauge("ecotrail_cache_hits", "Cache hits by cache and tier.", _cache_samples("hits"))
+registry.gauge("ecotrail_cache_misses", "Cache misses by cache and tier.", _cache_samples("misses"))
+registry.gauge("ecotrail_cache_hit_ratio", "Cache hit ratio by cache and tier.", _cache_samples("hit_ratio"))
+
+
+_event_buses = []
+
+
+def register_event_bus(bus):
+    """Export the number of open push-stream subscriptions of an events.EventBus."""
+    _event_buses.append(bus)
+
+
+registry.gauge(
+    "ecotrail_event_subscribers",
+    "Open push-stream (/events) subscriptions.",
+    lambda: [({}, sum(bus.subscriber_count() for bus in _event_buses))]
+)
+
+
+_job_queues = []
+
+
+def register_job_queue(queue):
+    """Export the depth and lag of a jobs.JobQueue."""
+    _job_queues.append(queue)
+
+
+def _job_queue_samples(field):
+    def collect():
+        samples = []
+        for queue in _job_queues:
+            try:
+                stats = queue.stats()
+            except Exception as e:
+                print(f"Error reading job queue stats: {e}")
+                continue
+            if field == "counts":
+                samples.extend(({"status": status}, count) for status, count in stats["counts"].items())
+            else:
+                samples.append(({}, stats[field]))
+        return samples
+    return collect
+
+
+registry.gauge("ecotrail_job_queue_jobs", "Background jobs by status.", _job_queue_samples("counts"))
+registry.gauge("ecotrail_job_queue_depth", "Background jobs queued or running.", _job_queue_samples("depth"))
+registry.gauge(
+    "ecotrail_job_queue_lag_seconds",
+    "How long the oldest due background job has been waiting.",
+    _job_queue_samples("lag_seconds")
+)
+
+
+_factor_registries = []
+
+
+def register_factor_registry(registry):
+    """Export the version of the factor set a factors.FactorRegistry scores with."""
+    _factor_registries.append(registry)
+
+
+registry.gauge(
+    "ecotrail_factors_info",
+    "Emission and points factor set in use (always 1), by version.",
+    lambda: [({"version": factors.current().version}, 1) for factors in _factor_registries]
+)
+
+
+# Per-request timing breakdown -------------------------------------------------
+
+_breakdown = ContextVar("breakdown", default=None)
+
+
+def current_breakdown():
+    """The timing list of the request being served in this context, or None."""
+    return _breakdown.get()
+
+
+def start_breakdown():
+    """Collect timings for a request; returns a token for `end_breakdown`."""
+    return _breakdown.set([])
+
+
+def end_breakdown(token):
+    _breakdown.reset(token)
+
+
+def timing_requested(debug_header):
+    """Whether to send Server-Timing, given the request's X-Debug-Timing value."""
+    return TIMING_HEADER == "always" or (TIMING_HEADER == "opt-in" and bool(debug_header))
+
+
+def _record_breakdown(breakdown, name, seconds):
+    if breakdown is not None:
+        breakdown.append((name, seconds))
+
+
+def propagate(fn):
+    """Bind the caller's request breakdown to `fn` for use on another thread.
+
+    Wrap callables handed to the route_fetch pool with this so their
+    external calls and Mongo commands still show up in Server-Timing.
+    """
+    breakdown = current_breakdown()
+
+    def wrapper(*args, **kwargs):
+        token = _breakdown.set(breakdown)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _breakdown.reset(token)
+
+    return wrapper
+
+
+@contextmanager
+def timed(call, **labels):
+    """Time an external call into the histogram and the request breakdown."""
+    breakdown = current_breakdown()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        external_errors.inc(call=call, **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        external_duration.observe(elapsed, call=call, **labels)
+        suffix = "-".join(str(value) for value in labels.values())
+        _record_breakdown(breakdown, f"{call}-{suffix}" if suffix else call, elapsed)
+
+
+def instrument(fn, call, label="mode"):
+    """Wrap `fn` so each call is timed, labelled by its `label` kwarg."""
+
+    def wrapper(*args, **kwargs):
+        labels = {label: kwargs[label]} if label in kwargs else {}
+        with timed(call, **labels):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """pymongo command listener feeding the Mongo latency histogram."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        mongo_duration.observe(seconds, command=event.command_name)
+        _record_breakdown(current_breakdown(), f"mongo-{event.command_name}", seconds)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        mongo_duration.observe(seconds, command=event.command_name)
+        mongo_errors.inc(command=event.command_name)
+        _record_breakdown(current_breakdown(), f"mongo-{event.command_name}", seconds)
+
+
+def server_timing(breakdown, total):
+    """Format a breakdown as a Server-Timing header value."""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in breakdown]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def init_app(app):
+    """Time every Flask route and serve the registry at /metrics."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        _breakdown.set([])
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop("metrics_start", None)
+        breakdown = current_breakdown()
+        _breakdown.set(None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        http_duration.observe(elapsed, route=route, method=request.method, status=response.status_code)
+        if response.status_code >= 500:
+            http_errors.inc(route=route, method=request.method)
+        if timing_requested(request.headers.get(TIMING_REQUEST_HEADER)):
+            response.headers["Server-Timing"] = server_timing(breakdown or [], elapsed)
+        return response
+
+    @app.teardown_request
+    def _clear_breakdown(error):
+        _breakdown.set(None)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return app.response_class(registry.render(), mimetype="text/plain; version=0.0.4")
@@ -1,157 +1,499 @@
-from flask import Flask, request, jsonify
-from pymongo import MongoClient
+from flask import Blueprint, Flask, current_app, request, jsonify, url_for, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 from dotenv import load_dotenv
+import hashlib
 import os
+import sqlite3
 from flask_cors import CORS
-import base64
-import requests
 
-import googlemaps
-from datetime import datetime
+from datetime import datetime, timezone
+
+import metrics
+from cache import MISSING, build_cache, make_key, normalize_address
+from clients import ProcessLocal
+from events import (
+    EVENTS_KEEPALIVE_SECONDS,
+    EVENTS_SOURCE,
+    LEADERBOARD_TOPIC,
+    ChangeStreamSource,
+    EventBus,
+    StreamState,
+    keepalive_frame,
+    retry_frame,
+    user_topic
+)
+from factors import FactorRegistry, source_from_env
+from jobs import JobQueue, WorkerPool
+from leaderboard import Leaderboard
+from local_routing import FallbackDirections, LocalRouter, load_road_graph
+from map_cache import MapImageCache, map_key
+from maps_transport import MAPS_QPS, session_from_env
+from route_fetch import batch_executor, fetch_legs, fetch_modes, route_executor
+from route_grid import NearbyRoutes, RouteGrid
+from route_model import RouteOption, RouteSet, dumps
+from recompute import recompute_chunk
+from scoring import pareto_front
+from scoring import points as earned_points
+from schema import ensure_indexes
+from singleflight import SingleFlight
+from trips import TripStore, from_payload, to_json_line, to_payload, trip_document
+from user_points import USER_TOTALS_PROJECTION, award_filter, award_points, award_update
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
+# Routes live on a blueprint; create_app() builds the Flask app around it
+api = Blueprint('api', __name__)
 
-# MongoDB connection
+# MongoDB connection, opened per process on first use (see clients.py)
 MONGO_URI = os.getenv("MONGOSTRING")
+MONGO_DB = os.getenv("MONGO_DB", "test")
+USERS_COLLECTION = "Users"
 API_KEY = os.getenv("API_KEY")
-client = MongoClient(MONGO_URI)
-db = client['test']  # Replace with your database name
-users_collection = db['Users']  # Replace with your collection name
-
-# Points multiplier and emission factors for different modes
-POINTS_MULTIPLIER = {
-    "walking": 12,
-    "bicycling": 10,
-    "transit": 8,
-    "driving": 0  # No points for driving
-}
 
-EMISSION_FACTORS = {
-    "driving": 180,   # Average car emissions
-    "transit": 80,    # Bus emissions
-    "walking": 0,     # Walking has no emissions
-    "bicycling": 0    # Bicycling has no emissions
+def connect_mongo():
+    """MongoClient for this process; it starts monitor threads, so never share it across a fork."""
+    return MongoClient(MONGO_URI, event_listeners=[metrics.MongoCommandTimer()])
+
+client = ProcessLocal(connect_mongo)
+db = client[MONGO_DB]
+users_collection = db[USERS_COLLECTION]
+
+# Emission factors and points multipliers, per region and vehicle type,
+# reloaded from FACTORS_SOURCE every FACTORS_RELOAD_SECONDS (see factors.py)
+factor_registry = FactorRegistry(source_from_env(db))
+metrics.register_factor_registry(factor_registry)
+
+# Upper bound on trips accepted by /calculate_route_points/batch
+MAX_BATCH_TRIPS = int(os.getenv("MAX_BATCH_TRIPS", 500))
+
+# Push stream (/events) of leaderboard diffs and point updates; with
+# EVENTS_SOURCE=mongo every worker also hears about other workers' awards
+event_bus = EventBus()
+metrics.register_event_bus(event_bus)
+
+# Leaderboard kept in memory and updated on every points award. Awards
+# made by other workers only arrive with EVENTS_SOURCE=mongo, so it is also
+# reloaded every LEADERBOARD_REFRESH_SECONDS
+MAX_LEADERBOARD_PAGE = 100
+LEADERBOARD_REFRESH_SECONDS = float(os.getenv("LEADERBOARD_REFRESH_SECONDS", 30))
+leaderboard = Leaderboard(
+    users_collection,
+    capacity=int(os.getenv("LEADERBOARD_CAPACITY", 1000)),
+    on_change=lambda event: event_bus.publish(LEADERBOARD_TOPIC, event),
+    refresh_seconds=LEADERBOARD_REFRESH_SECONDS
+)
+
+def start_change_feed():
+    """Users change stream for this process, or None unless EVENTS_SOURCE=mongo."""
+    if EVENTS_SOURCE != "mongo":
+        return None
+    return ChangeStreamSource(users_collection, event_bus, leaderboard).start()
+
+change_feed = ProcessLocal(start_change_feed)
+
+def publish_points(username, total_points, points_earned, trip_id=None):
+    """Tell the user's open streams about an award made by this worker."""
+    if EVENTS_SOURCE == "mongo":
+        return  # The change stream publishes every award, in every worker
+    event_bus.publish(user_topic(username), {
+        "username": username,
+        "total_points": total_points,
+        "points_earned": points_earned,
+        "trip_id": trip_id
+    })
+
+# Append-only trip history and its daily/weekly rollups
+trip_store = TripStore(db)
+
+# Google Maps client, built per process on first use; all Maps HTTP
+# traffic shares one pooled, rate-limited session
+MAPS_RETRY_TIMEOUT = int(os.getenv("MAPS_RETRY_TIMEOUT", 20))
+maps_session = ProcessLocal(session_from_env)
+
+def connect_maps():
+    """googlemaps.Client on this process's Maps session; needs API_KEY."""
+    import googlemaps
+
+    return googlemaps.Client(
+        key=API_KEY,
+        requests_session=maps_session.instance(),
+        queries_per_second=max(int(MAPS_QPS), 1),
+        # The client's default 6000/minute would cap it at 100/s whatever MAPS_QPS says
+        queries_per_minute=max(int(MAPS_QPS * 60), 60),
+        retry_timeout=MAPS_RETRY_TIMEOUT
+    )
+
+gmaps = ProcessLocal(connect_maps)
+
+# Static map images, cached on disk by origin, destination and styling.
+# /map_image only serves keys signed with MAP_SIGNING_KEY (by default derived
+# from API_KEY, so every worker agrees without extra configuration)
+MAP_CACHE_MAX_AGE = int(os.getenv("MAP_CACHE_MAX_AGE", 7 * 24 * 3600))
+MAP_CACHE_MAX_BYTES = int(os.getenv("MAP_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+MAP_SIGNING_KEY = os.getenv("MAP_SIGNING_KEY") or hashlib.sha256(
+    f"map_image:{API_KEY or ''}".encode("utf-8")
+).hexdigest()
+map_image_cache = MapImageCache(
+    os.getenv("MAP_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_cache")),
+    API_KEY,
+    maps_session,
+    MAP_SIGNING_KEY,
+    max_bytes=MAP_CACHE_MAX_BYTES,
+    max_age_seconds=MAP_CACHE_MAX_AGE
+)
+
+def map_image_params(origin, destination):
+    """`map_key` and the signed /map_image query for a route."""
+    key = map_key(origin, destination)
+    return key, {"origin": origin, "destination": destination, "sig": map_image_cache.signature(key)}
+
+# Background jobs: trip history and map image prefetch run after the
+# response, with retries. The queue is a SQLite file shared by every worker
+# on the host; each process runs its own pool of JOB_WORKERS threads.
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+PREFETCH_MAP_IMAGES = os.getenv("PREFETCH_MAP_IMAGES", "true").lower() == "true"
+job_queue = JobQueue(JOBS_DB_PATH)
+metrics.register_job_queue(job_queue)
+
+def record_trips_job(job):
+    """Store queued trips; a retry skips trips an earlier attempt already stored."""
+    trip_store.record([from_payload(trip) for trip in job["payload"]["trips"]], resume=job["attempts"] > 1)
+    return {"trips": len(job["payload"]["trips"])}
+
+def render_map_job(job):
+    """Download a route image into the map cache, so /map_image serves it from disk."""
+    key, image = map_image_cache.fetch(job["payload"]["origin"], job["payload"]["destination"])
+    if image is None:
+        raise RuntimeError("Unable to fetch map image")
+    return {"map_key": key}
+
+def recompute_chunk_job(job):
+    """Re-score one chunk of a recompute run (see recompute.py)."""
+    return recompute_chunk(db, job["payload"]["run_id"], job["payload"]["chunk"], on_total=leaderboard.record)
+
+JOB_HANDLERS = {
+    "record_trips": record_trips_job,
+    "render_map": render_map_job,
+    "recompute_chunk": recompute_chunk_job
 }
 
-# Initialize Google Maps client
-gmaps = googlemaps.Client(key=API_KEY)
+def publish_job(job):
+    """Tell the owner's open streams (on this worker) that a job finished."""
+    if job.get("owner"):
+        event_bus.publish(user_topic(job["owner"]), {
+            "type": "job",
+            "job_id": job["id"],
+            "kind": job["kind"],
+            "status": job["status"],
+            "result": job.get("result"),
+            "error": job.get("error")
+        })
+
+def start_job_workers():
+    """This process's job workers, or None with JOB_WORKERS=0 (enqueue only)."""
+    if JOB_WORKERS <= 0:
+        return None
+    return WorkerPool(job_queue, JOB_HANDLERS, workers=JOB_WORKERS, on_finish=publish_job).start()
+
+job_workers = ProcessLocal(start_job_workers)
+
+def enqueue_job(kind, payload, owner=None):
+    """Queue a job and wake this process's workers; returns its id, or None on error."""
+    try:
+        job_id = job_queue.enqueue(kind, payload, owner, max_attempts=JOB_MAX_ATTEMPTS)
+    except sqlite3.Error as e:
+        print(f"Error queueing {kind} job: {e}")
+        return None
+    pool = job_workers.instance()
+    if pool is not None:
+        pool.notify()
+    return job_id
+
+# Geocode and directions caches ("memory" per process, or "mongo" shared)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", 7 * 24 * 3600))
+GEOCODE_NEGATIVE_TTL = int(os.getenv("GEOCODE_NEGATIVE_TTL", 600))
+DIRECTIONS_CACHE_TTL = int(os.getenv("DIRECTIONS_CACHE_TTL", 3600))
+
+geocode_cache = build_cache(
+    "geocode",
+    maxsize=int(os.getenv("GEOCODE_CACHE_SIZE", 50000)),
+    ttl=GEOCODE_CACHE_TTL,
+    backend=CACHE_BACKEND,
+    db=db
+)
+directions_cache = build_cache(
+    "directions",
+    maxsize=int(os.getenv("DIRECTIONS_CACHE_SIZE", 50000)),
+    ttl=DIRECTIONS_CACHE_TTL,
+    backend=CACHE_BACKEND,
+    db=db,
+    encode=RouteOption.to_document,
+    decode=RouteOption.from_document
+)
+
+# Recent routes reused for trips whose endpoints are within
+# ROUTE_REUSE_MAX_ERROR_M of a cached trip's (0 turns reuse off)
+ROUTE_REUSE_MAX_ERROR_M = float(os.getenv("ROUTE_REUSE_MAX_ERROR_M", 200))
+
+def cached_location(address):
+    """(lat, lng) of an address geocoded earlier, without calling upstream."""
+    cached = geocode_cache.get(make_key("location", address))
+    if cached is MISSING or not cached:
+        return None
+    return tuple(cached)
+
+nearby_routes = NearbyRoutes(
+    RouteGrid(
+        cell_m=float(os.getenv("ROUTE_REUSE_CELL_M", 200)),
+        max_error_m=ROUTE_REUSE_MAX_ERROR_M,
+        capacity=int(os.getenv("ROUTE_REUSE_CAPACITY", 20000)),
+        ttl=DIRECTIONS_CACHE_TTL
+    ),
+    cached_location,
+    audit_rate=float(os.getenv("ROUTE_REUSE_AUDIT_RATE", 0))
+) if ROUTE_REUSE_MAX_ERROR_M > 0 else None
+
+metrics.register_cache(geocode_cache)
+metrics.register_cache(directions_cache)
+if nearby_routes is not None:
+    metrics.register_cache(nearby_routes)
+
+# Identical lookups already in flight are shared instead of repeated
+geocode_flight = SingleFlight("geocode")
+directions_flight = SingleFlight("directions")
 
 def geocode_address(address):
     """Geocode an address to validate and get its formatted address."""
+    key = make_key("geocode", normalize_address(address))
+    cached = geocode_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    # Concurrent misses for the same address share one upstream call
+    return geocode_flight.do(key, fetch_geocode, address, key)
+
+def fetch_geocode(address, key):
+    """Geocode `address` upstream and fill the geocode cache."""
     try:
-        geocode_result = gmaps.geocode(address)
+        with metrics.timed("geocode"):
+            geocode_result = gmaps.geocode(address)
         if not geocode_result:
+            # Remember unknown addresses briefly so typos don't burn quota
+            geocode_cache.set(key, None, ttl=GEOCODE_NEGATIVE_TTL)
             return None
-        return geocode_result[0]["formatted_address"]
+        formatted_address = geocode_result[0]["formatted_address"]
     except Exception as e:
         print(f"Error geocoding address '{address}': {e}")
         return None
+    geocode_cache.set(key, formatted_address)
+    # Clients often send the formatted address back on the next trip
+    geocode_cache.set(make_key("geocode", normalize_address(formatted_address)), formatted_address)
+    # Local routing needs coordinates for the formatted address
+    location = geocode_result[0].get("geometry", {}).get("location")
+    if location:
+        geocode_cache.set(make_key("location", formatted_address), [location["lat"], location["lng"]])
+    return formatted_address
 
-
-
-def get_map_image(origin, destination, api_key):
-    """Generate base64 encoded map image"""
+def geocode_location(address):
+    """(lat, lng) of a geocoded address, from the geocode cache when possible."""
+    key = make_key("location", address)
+    cached = geocode_cache.get(key)
+    if cached is not MISSING:
+        return tuple(cached) if cached else None
     try:
-        # Static Maps API URL
-        map_url = (
-            f"https://maps.googleapis.com/maps/api/staticmap?"
-            f"size=600x400&"
-            f"markers=color:red|{origin}&"
-            f"markers=color:green|{destination}&"
-            f"path=color:blue|weight:5|{origin}|{destination}&"
-            f"key={api_key}"
-        )
-        
-        # Fetch the image
-        response = requests.get(map_url)
-        print(map_url)
-        # Convert to base64
-        if response.status_code == 200:
-            base64_image = base64.b64encode(response.content).decode('utf-8')
-            return f"data:image/png;base64,{base64_image}"
-        else:
-            print(f"Failed to fetch map image. Status code: {response.status_code}")
-            return None
-    
+        with metrics.timed("geocode"):
+            geocode_result = gmaps.geocode(address)
     except Exception as e:
-        print(f"Error generating map image: {e}")
+        print(f"Error locating address '{address}': {e}")
         return None
-    
+    if not geocode_result:
+        geocode_cache.set(key, None, ttl=GEOCODE_NEGATIVE_TTL)
+        return None
+    location = geocode_result[0]["geometry"]["location"]
+    geocode_cache.set(key, [location["lat"], location["lng"]])
+    return location["lat"], location["lng"]
+
+def build_directions():
+    """Directions function for ROUTING_BACKEND; local routers route off ROAD_GRAPH_PATH."""
+    google = metrics.instrument(gmaps.directions, "directions")
+    if ROUTING_BACKEND == "google":
+        return google, None
+    if not ROAD_GRAPH_PATH:
+        print(f"ROUTING_BACKEND={ROUTING_BACKEND} needs ROAD_GRAPH_PATH; using Google directions.")
+        return google, None
+    try:
+        local_router = LocalRouter(load_road_graph(ROAD_GRAPH_PATH), geocode_location)
+    except Exception as e:
+        print(f"Error loading road graph '{ROAD_GRAPH_PATH}': {e}; using Google directions.")
+        return google, None
+    local = metrics.instrument(local_router.directions, "local_directions")
+    if ROUTING_BACKEND == "local":
+        return local, local
+    return FallbackDirections(
+        google, local, slow_after=ROUTING_SLOW_SECONDS, cooldown=ROUTING_FALLBACK_COOLDOWN
+    ), local
+
+# Directions backend: "google", "local" (offline road graph only) or
+# "fallback" (Google, switching to the road graph while it fails or is slow).
+# `routing` is `(directions, local_directions)`, built on first use because
+# loading the road graph can take seconds.
+ROUTING_BACKEND = os.getenv("ROUTING_BACKEND", "google")
+ROAD_GRAPH_PATH = os.getenv("ROAD_GRAPH_PATH")
+ROUTING_SLOW_SECONDS = float(os.getenv("ROUTING_SLOW_SECONDS", 3))
+ROUTING_FALLBACK_COOLDOWN = float(os.getenv("ROUTING_FALLBACK_COOLDOWN", 60))
+routing = ProcessLocal(build_directions)
+
+def directions(*args, **kwargs):
+    """Directions from the configured backend."""
+    return routing.instance()[0](*args, **kwargs)
+
+def directions_key(origin, destination, mode, **directions_kwargs):
+    """directions_flight key for a lookup, shared with asgi_app so both coalesce.
 
+    Every caller asks for alternatives, so the other arguments aren't part of it.
+    """
+    return make_key(origin, destination, mode)
+
+coalesced_directions = directions_flight.wrap(directions, key=directions_key)
 
 def fetch_route_data(origin, destination, modes):
-    """Fetch route data for multiple transportation modes."""
-    routes = {}
-    no_route = {}
-    for mode in modes:
+    """Fetch route data for multiple transportation modes concurrently.
+
+    Returns `(routes, no_route)`: a `RouteSet` and the modes with no route.
+    """
+    return fetch_modes(
+        metrics.propagate(coalesced_directions),
+        origin,
+        destination,
+        modes,
+        cache=directions_cache,
+        nearby=nearby_routes,
+        alternatives=True
+    )
+
+def calculate_carbon_footprint(routes, region=None):
+    """Carbon footprints (grams of CO₂) for each mode of a RouteSet, scored like score_routes."""
+    vehicle_table = factor_registry.current().tables(region).vehicle
+    return dict(zip(routes.modes, routes.alternative_footprints(vehicle_table)[routes.primary].tolist()))
+
+def suggest_eco_friendly_route(footprints, routes, max_duration=None):
+    """Suggest the most eco-friendly route within time constraints: `(mode, RouteOption)`."""
+    row = routes.eco_row([footprints[mode] for mode in routes.modes], max_duration)
+    if row < 0:
+        return None, None
+    return routes.modes[row], routes.options[row]
+
+def record_trips(trips, owner=None):
+    """Queue scored trips for the history; returns the job id.
+
+    History is best-effort and never fails the award. If the queue is
+    unavailable the trips are stored inline instead, and the id is None.
+    """
+    job_id = enqueue_job("record_trips", {"trips": [to_payload(trip) for trip in trips]}, owner)
+    if job_id is None:
         try:
-            directions = gmaps.directions(
-                origin=origin,
-                destination=destination,
-                mode=mode,
-                alternatives = True
-            )
-            if directions:
-                route = directions[0]["legs"][0]
-                distance_km = route["distance"]["value"] / 1000  # Convert to km
-                duration_min = route["duration"]["value"] / 60  # Convert to minutes
-                routes[mode] = {
-                    "distance_km": distance_km,
-                    "duration_min": duration_min
-                }
-            else:
-                print(f"No route found for mode '{mode}'.")
-                no_route = {mode}
+            trip_store.record(trips)
         except Exception as e:
-            print(f"Error fetching data for mode '{mode}': {e}")
-    return routes,no_route
-
-def calculate_carbon_footprint(routes):
-    """Calculate carbon footprints for each mode."""
-    footprints = {}
-    for mode, data in routes.items():
-        distance = data["distance_km"]
-        emissions = EMISSION_FACTORS.get(mode, 0)
-        footprints[mode] = distance * emissions  # Total CO₂ in grams
-    return footprints
+            print(f"Error recording trips: {e}")
+    return job_id
 
-def suggest_eco_friendly_route(footprints, routes, max_duration=None):
-    """Suggest the most eco-friendly route within time constraints."""
-    filtered_routes = {
-        mode: data for mode, data in routes.items()
-        if max_duration is None or data["duration_min"] <= max_duration
-    }
+def prefetch_map(origin, destination, owner=None):
+    """Queue rendering of the route image; returns the job id, or None."""
+    if not PREFETCH_MAP_IMAGES:
+        return None
+    return enqueue_job("render_map", {"origin": origin, "destination": destination}, owner)
 
-    if not filtered_routes:
-        return None, None
+def parse_timestamp(value):
+    """ISO 8601 query parameter to an aware UTC datetime (naive means UTC)."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+def score_routes(routes, factors=None, region=None):
+    """Score a RouteSet with a FactorSet (the current one by default).
 
-    filtered_footprints = {
-        mode: footprints[mode] for mode in filtered_routes.keys()
-    }
-    eco_friendly_mode = min(filtered_footprints, key=filtered_footprints.get)
-    return eco_friendly_mode, filtered_routes[eco_friendly_mode]
+    Footprints are summed step by step with `region`'s per-vehicle factors
+    over every alternative route. Returns `(route_details, total_points,
+    eco_friendly_route, pareto_routes)`; the first alternative of each mode
+    is the one scored, and `pareto_routes` lists the alternatives (any
+    mode) no other alternative beats on both duration and CO₂.
+    """
+    tables = (factors or factor_registry.current()).tables(region)
+    alt_footprints = routes.alternative_footprints(tables.vehicle)
+    footprints = alt_footprints[routes.primary]
+    points = earned_points(routes.distance_km, routes.mode_id, tables.points)
+    modes = routes.modes
 
-@app.route('/calculate_route_points', methods=['POST'])
+    alternatives = []
+    alt_footprint_list = alt_footprints.tolist()
+    for option, first in zip(routes, routes.primary.tolist()):
+        option_alternatives = option.alternatives()
+        for index, alternative in enumerate(option_alternatives):
+            alternative["carbon_footprint"] = alt_footprint_list[first + index] / 1000  # Convert to kg
+        alternatives.append(option_alternatives)
+
+    route_details = [
+        {
+            "mode": mode,
+            "distance": option.distance_km,
+            "duration": option.duration_min,
+            "points_earned": mode_points,
+            "carbon_footprint": footprint / 1000,  # Convert to kg
+            "alternatives": mode_alternatives
+        }
+        for mode, option, mode_points, footprint, mode_alternatives
+        in zip(modes, routes, points.tolist(), footprints.tolist(), alternatives)
+    ]
+    total_points = int(points.sum())
+
+    pareto_routes = []
+    for alt in pareto_front(routes.alt_duration_min, alt_footprints).tolist():
+        row = int(routes.alt_row[alt])
+        index = alt - int(routes.primary[row])
+        pareto_routes.append(dict(alternatives[row][index], mode=modes[row], alternative=index))
+
+    eco_friendly_route = None
+    eco_row = routes.eco_row(footprints)
+    if eco_row >= 0:
+        eco_friendly_route = {
+            "mode": modes[eco_row],
+            "details": {
+                "distance_km": routes.options[eco_row].distance_km,
+                "duration_min": routes.options[eco_row].duration_min
+            }
+        }
+    return route_details, total_points, eco_friendly_route, pareto_routes
+
+@api.route('/calculate_route_points', methods=['POST'])
 def calculate_route_points():
     data = request.json
     username = data.get('username')
     origin = data.get('origin')
     destination = data.get('destination')
     modes = data.get('modes', [])
+    trip_id = data.get('trip_id')
+    # One factor set for the whole request; unknown regions get the defaults
+    factors = factor_registry.current()
+    region = factors.region_of(data.get('region'))
 
-    # Geocode addresses
-    origin = geocode_address(origin)
+    # Geocode both addresses at the same time
+    origin_future = route_executor.submit(metrics.propagate(geocode_address), origin)
     destination = geocode_address(destination)
+    origin = origin_future.result()
 
     if not origin or not destination:
         return jsonify({"error": "Invalid addresses"}), 400
 
     # Validate modes
-    invalid_modes = [mode for mode in modes if mode not in POINTS_MULTIPLIER]
+    invalid_modes = [mode for mode in modes if mode not in factors.points]
     if invalid_modes:
         return jsonify({"error": f"Invalid modes: {invalid_modes}"}), 400
 
@@ -160,85 +502,347 @@ def calculate_route_points():
     if not routes:
         return jsonify({"error": "No routes found"}), 404
 
-    # Calculate carbon footprints
-    footprints = calculate_carbon_footprint(routes)
+    # Score every mode and pick the eco-friendly one
+    route_details, total_points, eco_friendly_route, pareto_routes = score_routes(routes, factors, region)
+
+    # Award points and trip counters in one atomic round trip; a repeated
+    # trip_id returns the current totals without awarding again
+    user, duplicate = award_points(
+        users_collection,
+        username,
+        {detail["mode"]: detail["points_earned"] for detail in route_details},
+        trip_id
+    )
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    current_points = user.get('sustainability_points', total_points)
+    leaderboard.record(username, current_points)
+    # History and the map image are written after the response (see jobs.py)
+    jobs = {"trip_history": None, "map_image": prefetch_map(origin, destination, username)}
+    if not duplicate:
+        publish_points(username, current_points, total_points, trip_id)
+        jobs["trip_history"] = record_trips([trip_document(
+            username, origin, destination, route_details,
+            eco_friendly_route["mode"] if eco_friendly_route else None,
+            factors.tables(region).driving, trip_id, factors=factors.version, region=region
+        )], username)
+
+    key, map_params = map_image_params(origin, destination)
+    return jsonify({
+        "message": "Trip already recorded" if duplicate else "Points calculated and updated",
+        "duplicate_trip": duplicate,
+        "route_details": route_details,
+        "total_points_earned": 0 if duplicate else total_points,
+        "total_points": current_points,
+        "eco_friendly_route": eco_friendly_route,
+        "pareto_routes": pareto_routes,
+        "factors": {"version": factors.version, "region": region},
+        # The image itself is served lazily by /map_image
+        "map_key": key,
+        "map_image_url": url_for('.map_image', _external=True, **map_params),
+        # Poll /jobs/<id>, or watch /events?username=... for "job" events
+        "jobs": jobs
+    }), 200
 
-    # Suggest eco-friendly route
-    eco_friendly_mode, eco_route = suggest_eco_friendly_route(footprints, routes)
+@api.route('/calculate_route_points/batch', methods=['POST'])
+def calculate_route_points_batch():
+    """Score many offline-recorded trips in one request.
 
-    # Calculate points for each route
-    route_details = []
-    total_points = 0
+    Identical geocodes and (origin, destination, mode) lookups are fetched
+    once for the whole batch, and all point increments are committed with a
+    single bulk_write. Each trip gets its own result entry, so one bad trip
+    doesn't fail the rest.
+    """
+    data = request.json or {}
+    trips = data.get('trips')
+    if not isinstance(trips, list) or not trips:
+        return jsonify({"error": "A non-empty 'trips' list is required"}), 400
+    if len(trips) > MAX_BATCH_TRIPS:
+        return jsonify({"error": f"At most {MAX_BATCH_TRIPS} trips per batch"}), 400
 
-    for mode, route_info in routes.items():
-        points = int(route_info["distance_km"] * POINTS_MULTIPLIER[mode])
-        total_points += points
+    results = [None] * len(trips)
+    factors = factor_registry.current()
 
-        route_details.append({
-            "mode": mode,
-            "distance": route_info["distance_km"],
-            "duration": route_info["duration_min"],
-            "points_earned": points,
-            "carbon_footprint": footprints[mode] / 1000  # Convert to kg
-        })
+    def fail(index, message):
+        results[index] = {
+            "index": index,
+            "trip_id": trips[index].get('trip_id') if isinstance(trips[index], dict) else None,
+            "status": "error",
+            "error": message
+        }
 
-    # Create static map URL
-    markers = f"markers={origin}&markers={destination}"
-    path = f"path=color:blue|weight:5|{origin}|{destination}"
-    map_image = get_map_image(origin, destination, API_KEY)
-    # print(f"Generated Map URL: {map_url}")
+    # Validate trips
+    valid = []
+    for index, trip in enumerate(trips):
+        if not isinstance(trip, dict):
+            fail(index, "Trip must be an object")
+            continue
+        modes = trip.get('modes', [])
+        invalid_modes = [mode for mode in modes if mode not in factors.points]
+        if not trip.get('username') or not trip.get('origin') or not trip.get('destination'):
+            fail(index, "username, origin and destination are required")
+        elif invalid_modes:
+            fail(index, f"Invalid modes: {invalid_modes}")
+        else:
+            valid.append(index)
 
-    # Update user's points in MongoDB
-    result = users_collection.update_one(
-        {"username": username},
-        {"$inc": {"sustainability_points": total_points}}
+    # Geocode every distinct address once, concurrently, on the batch pool
+    addresses = list(dict.fromkeys(
+        address for index in valid
+        for address in (trips[index]['origin'], trips[index]['destination'])
+    ))
+    geocoded = dict(zip(addresses, batch_executor.map(metrics.propagate(geocode_address), addresses)))
+
+    resolved = []
+    for index in valid:
+        origin = geocoded[trips[index]['origin']]
+        destination = geocoded[trips[index]['destination']]
+        if not origin or not destination:
+            fail(index, "Invalid addresses")
+        else:
+            resolved.append((index, origin, destination))
+
+    # Fetch every distinct directions lookup once, concurrently
+    legs, _, timed_out = fetch_legs(
+        metrics.propagate(coalesced_directions),
+        [
+            (origin, destination, mode)
+            for index, origin, destination in resolved
+            for mode in trips[index].get('modes', [])
+        ],
+        cache=directions_cache,
+        nearby=nearby_routes,
+        executor=batch_executor,
+        alternatives=True
     )
 
-    # Retrieve updated user document
-    user = users_collection.find_one({"username": username})
-    current_points = user.get('sustainability_points', total_points)
+    # Score trips
+    scored = []
+    trip_addresses = {}
+    for index, origin, destination in resolved:
+        lookups = [(origin, destination, mode) for mode in trips[index].get('modes', [])]
+        routes = RouteSet.from_legs(legs, lookups)
+        slow_modes = [lookup[2] for lookup in dict.fromkeys(lookups) if lookup in timed_out]
+        if not routes:
+            fail(index, f"Timed out fetching routes for modes {slow_modes}" if slow_modes else "No routes found")
+            continue
+        region = factors.region_of(trips[index].get('region'))
+        route_details, total_points, eco_friendly_route, pareto_routes = score_routes(routes, factors, region)
+        username = trips[index]['username']
+        scored.append(index)
+        trip_addresses[index] = (origin, destination)
+        results[index] = {
+            "index": index,
+            "trip_id": trips[index].get('trip_id'),
+            "status": "ok",
+            "username": username,
+            "route_details": route_details,
+            "total_points_earned": total_points,
+            "eco_friendly_route": eco_friendly_route,
+            "pareto_routes": pareto_routes,
+            "factors": {"version": factors.version, "region": region},
+            # Modes left out of the score because their lookup timed out
+            "timed_out_modes": slow_modes
+        }
+
+    # Find missing users and already-recorded trip_ids in one query
+    usernames = list(dict.fromkeys(results[index]['username'] for index in scored))
+    try:
+        known_trips = {
+            user['username']: set(user.get('trip_ids', []))
+            for user in users_collection.find(
+                {"username": {"$in": usernames}},
+                {"username": 1, "trip_ids": 1, "_id": 0}
+            )
+        } if usernames else {}
+    except Exception as e:
+        print(f"Error reading batch users: {e}")
+        known_trips = None
+
+    awards = []
+    for index in scored:
+        if known_trips is None:
+            fail(index, "Unable to update points")
+            continue
+        result = results[index]
+        trip_id = result['trip_id']
+        seen = known_trips.get(result['username'])
+        if seen is None:
+            fail(index, "User not found")
+        elif trip_id is not None and trip_id in seen:
+            result['duplicate_trip'] = True
+            result['total_points_earned'] = 0
+        else:
+            if trip_id is not None:
+                seen.add(trip_id)  # Also catches repeats within this batch
+            result['duplicate_trip'] = False
+            awards.append(index)
+
+    # Commit every award in one round trip, then read totals back
+    totals = {}
+    if awards:
+        unapplied = set()
+        try:
+            users_collection.bulk_write(
+                [
+                    UpdateOne(
+                        award_filter(results[index]['username'], results[index]['trip_id']),
+                        award_update(
+                            {
+                                detail["mode"]: detail["points_earned"]
+                                for detail in results[index]['route_details']
+                            },
+                            results[index]['trip_id']
+                        )
+                    )
+                    for index in awards
+                ],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            # Unordered: every award but the failed ones was applied
+            unapplied = {awards[error["index"]] for error in e.details.get("writeErrors", [])}
+        except PyMongoError:
+            unapplied = set(awards)
+        for index in unapplied:
+            fail(index, "Unable to update points")
+        awards = [index for index in awards if index not in unapplied]
+        if awards:
+            record_trips([
+                trip_document(
+                    results[index]['username'],
+                    *trip_addresses[index],
+                    results[index]['route_details'],
+                    (results[index]['eco_friendly_route'] or {}).get("mode"),
+                    factors.tables(results[index]['factors']['region']).driving,
+                    results[index]['trip_id'],
+                    factors=factors.version,
+                    region=results[index]['factors']['region']
+                )
+                for index in awards
+            ])
+    if known_trips:
+        try:
+            totals = {
+                user['username']: user.get('sustainability_points', 0)
+                for user in users_collection.find(
+                    {"username": {"$in": list(known_trips)}},
+                    USER_TOTALS_PROJECTION
+                )
+            }
+        except Exception as e:
+            print(f"Error reading batch totals: {e}")
+
+    for index in scored:
+        result = results[index]
+        if result['status'] == 'ok' and result['username'] in totals:
+            result['total_points'] = totals[result['username']]
+    earned = {}
+    for index in awards:
+        if results[index]['status'] == 'ok':
+            username = results[index]['username']
+            earned[username] = earned.get(username, 0) + results[index]['total_points_earned']
+    for username, points in totals.items():
+        leaderboard.record(username, points)
+        if username in earned:
+            publish_points(username, points, earned[username])
+
+    # 200 when every trip scored, 207 on partial failure, 400 when none did
+    failed = sum(1 for result in results if result['status'] == 'error')
+    if not failed:
+        status = 200
+    elif failed < len(results):
+        status = 207
+    else:
+        status = 400
 
     return jsonify({
-        "message": "Points calculated and updated",
-        "route_details": route_details,
-        "total_points_earned": total_points,
-        "total_points": current_points,
-        "eco_friendly_route": {
-            "mode": eco_friendly_mode,
-            "details": eco_route
-        } if eco_friendly_mode else None,
-        "map_image": map_image  # Add map URL to the response
-    }), 200
+        "message": "Batch processed",
+        "results": results,
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "users": totals
+    }), status
 
 
 
     
-@app.route('/get_leaderboard', methods=['GET'])
+@api.route('/map_image', methods=['GET'])
+def map_image():
+    origin = request.args.get('origin')
+    destination = request.args.get('destination')
+    if not origin or not destination:
+        return jsonify({"error": "Origin and destination are required"}), 400
+
+    # Only routes calculate_route_points signed, so nobody else spends our quota
+    key = map_key(origin, destination)
+    if not map_image_cache.verify(key, request.args.get('sig')):
+        return jsonify({"error": "Invalid map image signature"}), 403
+
+    # The key is the ETag, so revalidation never needs the image
+    if request.if_none_match.contains(key):
+        response = current_app.response_class(status=304)
+    else:
+        key, image = map_image_cache.fetch(origin, destination)
+        if image is None:
+            return jsonify({"error": "Unable to fetch map image"}), 502
+        response = current_app.response_class(image, mimetype='image/png')
+    response.set_etag(key)
+    response.headers['Cache-Control'] = f'public, max-age={MAP_CACHE_MAX_AGE}'
+    return response
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a background job: queued, running, done or failed."""
+    try:
+        job = job_queue.get(job_id)
+    except sqlite3.Error as e:
+        print(f"Error reading job {job_id}: {e}")
+        return jsonify({"error": "Unable to read job"}), 500
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@api.route('/factors', methods=['GET'])
+def get_factors():
+    """The emission and points factor set this worker scores with."""
+    return jsonify(factor_registry.current().to_document()), 200
+
+@api.route('/get_leaderboard', methods=['GET'])
 def get_leaderboard():
     try:
-        # Retrieve all users, sort by sustainability points in descending order
-        # Limit to top 10 users
-        leaderboard = list(users_collection.find(
-            {},  # No filter, get all users
-            {
-                'username': 1, 
-                'sustainability_points': 1, 
-                '_id': 0
-            }  # Project only needed fields
-        ).sort('sustainability_points', -1).limit(10))
-
-        # Ensure all entries have default values if missing
-        processed_leaderboard = [
-            {
-                'username': entry.get('username', 'Unknown'),
-                'sustainability_points': entry.get('sustainability_points', 0)
-            } 
-            for entry in leaderboard
-        ]
+        # Rank lookup for a single user
+        username = request.args.get('username')
+        if username:
+            result = leaderboard.rank_of(username)
+            if result is None:
+                return jsonify({"error": "User not found"}), 404
+            rank, points = result
+            return jsonify({
+                "username": username,
+                "rank": rank,
+                "sustainability_points": points
+            }), 200
 
-        return jsonify({
-            "leaderboard": processed_leaderboard
-        }), 200
+        # Paged leaderboard served from memory, top 10 by default
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_LEADERBOARD_PAGE)
+        entries, version, etag = leaderboard.page(offset, limit)
+
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+
+        response = jsonify({
+            "leaderboard": entries,
+            "version": version,
+            "offset": offset,
+            "limit": limit
+        })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response, 200
 
     except Exception as e:
         print(f"Error retrieving leaderboard: {e}")
@@ -248,7 +852,94 @@ def get_leaderboard():
             "leaderboard": []  # Return empty list to prevent null errors
         }), 500
 
-@app.route('/signup', methods=['POST'])
+@api.route('/events', methods=['GET'])
+def event_stream():
+    """Server-sent events: a snapshot, then leaderboard diffs and point updates.
+
+    Replaces polling /get_leaderboard and /get_user_points; see events.py
+    for the frames. `username` adds that user's point updates and `limit`
+    sizes the leaderboard (top 10 by default).
+    """
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_LEADERBOARD_PAGE)
+    state = StreamState(request.args.get('username'), limit)
+    change_feed.instance()
+
+    def generate():
+        # Subscribe before the snapshot, so nothing between the two is missed
+        subscription = event_bus.subscribe(state.topics())
+        try:
+            yield retry_frame()
+            yield state.snapshot(leaderboard)
+            while True:
+                if not subscription.wait(EVENTS_KEEPALIVE_SECONDS):
+                    yield keepalive_frame()
+                    continue
+                events, overflowed = subscription.drain()
+                frames = None if overflowed else state.frames(events)
+                if frames is None:
+                    yield state.snapshot(leaderboard)
+                else:
+                    yield from frames
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    response = current_app.response_class(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@api.route('/users/<username>/trips', methods=['GET'])
+def export_trips(username):
+    """Stream a user's trip history as NDJSON, oldest first.
+
+    The cursor is read `EXPORT_BATCH_SIZE` documents at a time and each
+    trip is written out as soon as it arrives, so memory use doesn't grow
+    with the history. Optional `since`/`until` take ISO 8601 timestamps.
+    """
+    try:
+        since = parse_timestamp(request.args.get('since'))
+        until = parse_timestamp(request.args.get('until'))
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO 8601 timestamps"}), 400
+
+    cursor = trip_store.export(username, since, until)
+
+    def generate():
+        try:
+            for trip in cursor:
+                yield to_json_line(trip)
+        finally:
+            cursor.close()
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@api.route('/users/<username>/trip_stats', methods=['GET'])
+def trip_stats(username):
+    """Daily or weekly totals (points, CO₂ and CO₂ saved, per mode) from the rollups."""
+    period = request.args.get('period', 'week')
+    if period not in ('day', 'week'):
+        return jsonify({"error": "period must be 'day' or 'week'"}), 400
+    try:
+        since = parse_timestamp(request.args.get('since'))
+        limit = min(max(int(request.args.get('limit', 52)), 1), 366)
+    except ValueError:
+        return jsonify({"error": "Invalid since or limit"}), 400
+    return jsonify({
+        "username": username,
+        "period": period,
+        "buckets": trip_store.stats(username, period, since, limit)
+    }), 200
+
+@api.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "geocode": geocode_cache.stats(),
+        "directions": directions_cache.stats(),
+        "route_grid": nearby_routes.stats() if nearby_routes is not None else None
+    }), 200
+
+@api.route('/signup', methods=['POST'])
 def signup():
     data = request.json
     username = data.get('username')
@@ -271,9 +962,10 @@ def signup():
         "driving_trips": 0,
         "bicycling_trips": 0
     })
+    leaderboard.record(username, 0)
     return jsonify({"message": "Signup successful"}), 201
 
-@app.route('/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
 def login():
     data = request.json
     username = data.get('username')
@@ -293,7 +985,7 @@ def login():
     else:
         return jsonify({"error": "Invalid username or password"}), 401
 
-@app.route('/get_user_points', methods=['GET'])
+@api.route('/get_user_points', methods=['GET'])
 def get_user_points():
     username = request.args.get('username')
     
@@ -315,29 +1007,69 @@ def get_user_points():
     else:
         return jsonify({"error": "User not found"}), 404
 
-@app.route('/updatepassword', methods=['POST'])
+@api.route('/updatepassword', methods=['POST'])
 def update_password():
-    print("trying to update password")
     data = request.json
+    username = data.get('username')
     old_password = data.get('old_password')
     new_password = data.get('new_password')
-    print("this is old password " + old_password)
-    print("this is new password " + new_password)
-    if not old_password or not new_password:
-        return jsonify({"error": "Old password and new password are required"}), 400
-    
-    # Verify user credentials (assuming current logged-in user's credentials)
-    user = users_collection.find_one({"password": old_password})
-    print(user)
-    if not user:
-        return jsonify({"error": "Invalid old password"}), 401
-    
-    # Update password
-    users_collection.update_one(
-        {"_id": user['_id']},
+    if not username or not old_password or not new_password:
+        return jsonify({"error": "Username, old password and new password are required"}), 400
+
+    # Verify and update in one indexed write, keyed by the user's name
+    result = users_collection.update_one(
+        {"username": username, "password": old_password},
         {"$set": {"password": new_password}}
     )
+    if not result.matched_count:
+        return jsonify({"error": "Invalid old password"}), 401
     return jsonify({"message": "Password updated successfully"}), 200
 
+def bootstrap():
+    """Ensure indexes, load the factor set, build the leaderboard, load the
+    directions backend, start the change stream (EVENTS_SOURCE=mongo) and
+    the job workers.
+
+    Safe to call repeatedly. Call it in each worker, not in a preforking
+    master, so the clients it opens belong to the worker.
+    """
+    try:
+        ensure_indexes(db)
+    except Exception as e:
+        print(f"Error ensuring indexes: {e}")
+    factor_registry.current()
+    leaderboard.load()
+    routing.instance()
+    change_feed.instance()
+    job_workers.instance()
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON through route_model.dumps, the encoder the ASGI app uses too."""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        return self._app.response_class(dumps(self._prepare_response_obj(args, kwargs)),
+                                        mimetype=self.mimetype)
+
+def create_app():
+    """Flask app serving the API.
+
+    Nothing here touches the network: Mongo, Maps and the road graph are
+    built per process on first use, so `gunicorn --preload 'newapp:create_app()'`
+    can import the app before forking workers. Each worker still has to call
+    `bootstrap()`; gunicorn.conf.py does it in `post_fork`.
+    """
+    flask_app = Flask(__name__)
+    flask_app.json = JSONProvider(flask_app)
+    CORS(flask_app, resources={r"/*": {"origins": "*"}})
+    metrics.init_app(flask_app)
+    flask_app.register_blueprint(api)
+    return flask_app
+
+app = create_app()
+
 if __name__ == "__main__":
+    bootstrap()
     app.run(host='192.168.12.171', port=5000, debug=True)
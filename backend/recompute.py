@@ -0,0 +1,291 @@
+"""Re-score stored trips with a factor set and reconcile user totals.
+
+`start_run` freezes a factor set into a `RecomputeRuns` document and splits
+users (by username, in index order) into chunks of `chunk_users`. Each
+chunk is one `recompute_chunk` job on the job queue (see jobs.py), so every
+worker process and `python recompute.py ... --workers N` take chunks in
+parallel, and a chunk that dies is retried from its lease.
+
+A chunk re-scores its users' trips stored before the run started that
+weren't scored with the run's version. All legs and segments are scored
+in one pass of array operations. Writes go in this order:
+
+1. each touched rollup bucket `$inc`s the difference (old trip out, new in)
+2. each user `$inc`s `sustainability_points` by its difference
+3. the trips get their new legs, points and factor version
+4. the chunk is marked done on the run
+
+Steps 1 and 2 only match documents whose `recompute_run` isn't this run,
+and set it. A user and their buckets belong to one chunk, so a retried
+chunk never applies a difference twice. Until step 3 has run, a retry
+reads the same trips and computes the same differences. Re-queueing a
+chunk that is still queued is therefore safe, and that is all `resume`
+does.
+
+Trip updates need MongoDB 7.0+ for time-series collections.
+
+    python recompute.py start [--chunk-users 200] [--workers 4]
+    python recompute.py resume <run_id> [--workers 4]
+    python recompute.py status <run_id>
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+
+from factors import FactorSet
+from jobs import QUEUED, RUNNING, WorkerPool
+from route_model import MODE_VEHICLES
+from scoring import MODE_IDS, MODES, UNKNOWN_MODE_ID, UNKNOWN_VEHICLE_ID, VEHICLE_IDS, VEHICLES
+from scoring import carbon_footprints, points, segment_footprints
+from trips import ROLLUPS_COLLECTION, TRIPS_COLLECTION, rollup_buckets, rollup_increments
+
+RUNS_COLLECTION = "RecomputeRuns"
+USERS_COLLECTION = "Users"
+RUN_FIELD = "recompute_run"
+RECOMPUTE_CHUNK_USERS = int(os.getenv("RECOMPUTE_CHUNK_USERS", 200))
+TRIP_FIELDS = {"_id": 1, "ts": 1, "meta": 1, "points": 1, "region": 1, "legs": 1}
+TRIP_BATCH_SIZE = 1000
+
+MODE_COLUMNS = len(MODES) + 1  # Width of a scoring table row, unknown mode included
+VEHICLE_COLUMNS = len(VEHICLES) + 1
+
+
+def rescore(trips, factors):
+    """`(legs, points)` for every trip, scored with a `FactorSet`.
+
+    Legs stored without `segments` count as one segment of their mode's
+    vehicle type, like a route without step detail.
+    """
+    regions = {region: index for index, region in enumerate((None, *factors.regions))}
+    tables = [factors.tables(region) for region in regions]
+    # Regions' tables end to end; an id is looked up at region * row width + id
+    points_table = np.concatenate([region_tables.points for region_tables in tables])
+    vehicle_table = np.concatenate([region_tables.vehicle for region_tables in tables])
+    driving_table = np.array([region_tables.driving for region_tables in tables], dtype=np.float64)
+
+    leg_region, leg_mode, leg_km = array("q"), array("q"), array("d")
+    segment_leg, segment_vehicle, segment_km = array("q"), array("q"), array("d")
+    for trip in trips:
+        region = regions.get(trip.get("region"), 0)
+        for leg in trip["legs"]:
+            mode_id = MODE_IDS.get(leg["mode"], UNKNOWN_MODE_ID)
+            segments = leg.get("segments") or {MODE_VEHICLES.get(mode_id, "OTHER"): leg["km"]}
+            for vehicle, km in segments.items():
+                segment_leg.append(len(leg_km))
+                segment_vehicle.append(region * VEHICLE_COLUMNS + VEHICLE_IDS.get(vehicle, UNKNOWN_VEHICLE_ID))
+                segment_km.append(km)
+            leg_region.append(region)
+            leg_mode.append(region * MODE_COLUMNS + mode_id)
+            leg_km.append(leg["km"])
+
+    km = np.frombuffer(leg_km, dtype=np.float64)
+    earned = points(km, np.frombuffer(leg_mode, dtype=np.int64), points_table).tolist()
+    co2 = segment_footprints(
+        np.frombuffer(segment_leg, dtype=np.int64),
+        np.frombuffer(segment_vehicle, dtype=np.int64),
+        np.frombuffer(segment_km, dtype=np.float64),
+        vehicle_table,
+        len(km)
+    )
+    driving = carbon_footprints(km, np.frombuffer(leg_region, dtype=np.int64), driving_table)
+    saved = np.maximum(driving - co2, 0).tolist()
+    co2 = co2.tolist()
+
+    results = []
+    row = 0
+    for trip in trips:
+        legs = []
+        for leg in trip["legs"]:
+            legs.append(dict(leg, co2_g=round(co2[row], 1), co2_saved_g=round(saved[row], 1), points=earned[row]))
+            row += 1
+        results.append((legs, sum(leg["points"] for leg in legs)))
+    return results
+
+
+def chunk_starts(users, chunk_users):
+    """First username of every chunk of `chunk_users` users; the first chunk starts at ""."""
+    starts = [""]
+    cursor = users.find({}, {"username": 1, "_id": 0}).sort("username", 1).batch_size(TRIP_BATCH_SIZE)
+    for count, user in enumerate(cursor):
+        if count and count % chunk_users == 0:
+            starts.append(user["username"])
+    return starts
+
+
+def user_range(run, chunk, field):
+    """Filter on `field` for the usernames in a chunk (the last one is open-ended)."""
+    condition = {"$gte": run["starts"][chunk]}
+    if chunk + 1 < len(run["starts"]):
+        condition["$lt"] = run["starts"][chunk + 1]
+    return {field: condition}
+
+
+def start_run(db, factors, chunk_users=RECOMPUTE_CHUNK_USERS):
+    """Record a run re-scoring history with `factors`; returns the run document."""
+    starts = chunk_starts(db[USERS_COLLECTION], chunk_users)
+    run = {
+        "_id": uuid.uuid4().hex,
+        "version": factors.version,
+        "factors": factors.to_document(),
+        "status": "running",
+        "started_at": datetime.now(timezone.utc),
+        "starts": starts,
+        "chunks": len(starts),
+        "done": [],
+        "trips": 0,
+        "users": 0,
+        "points_delta": 0
+    }
+    db[RUNS_COLLECTION].insert_one(run)
+    return run
+
+
+def pending_chunks(run):
+    done = set(run["done"])
+    return [chunk for chunk in range(run["chunks"]) if chunk not in done]
+
+
+def run_status(db, run_id):
+    """Progress of a run, or None."""
+    run = db[RUNS_COLLECTION].find_one({"_id": run_id}, {"factors": 0, "starts": 0})
+    if run is None:
+        return None
+    run["done"] = len(run["done"])
+    return run
+
+
+def recompute_chunk(db, run_id, chunk, on_total=None):
+    """Re-score one chunk of a run and apply the differences; returns counts.
+
+    `on_total(username, points)` is called with the new total of every
+    user whose points changed.
+    """
+    runs = db[RUNS_COLLECTION]
+    run = runs.find_one({"_id": run_id})
+    if run is None:
+        raise LookupError(f"No recompute run '{run_id}'")
+    if chunk in run["done"]:
+        return {"chunk": chunk, "trips": 0, "users": 0, "points_delta": 0}
+    factors = FactorSet(run["factors"])
+    query = user_range(run, chunk, "meta.user")
+    query["ts"] = {"$lt": run["started_at"]}
+    query["factors"] = {"$ne": factors.version}
+    trips = list(db[TRIPS_COLLECTION].find(query, TRIP_FIELDS).batch_size(TRIP_BATCH_SIZE))
+
+    user_deltas = {}
+    bucket_deltas = {}
+    trip_updates = []
+    for trip, (legs, trip_points) in zip(trips, rescore(trips, factors)):
+        username = trip["meta"]["user"]
+        user_deltas[username] = user_deltas.get(username, 0) + trip_points - trip["points"]
+        increments = rollup_increments(trip, -1)
+        for field, amount in rollup_increments(dict(trip, legs=legs, points=trip_points)).items():
+            increments[field] = increments.get(field, 0) + amount
+        for bucket_id, _, _ in rollup_buckets(trip):
+            totals = bucket_deltas.setdefault(bucket_id, {})
+            for field, amount in increments.items():
+                totals[field] = totals.get(field, 0) + amount
+        # UpdateMany: time-series collections don't take single-document updates everywhere
+        trip_updates.append(UpdateMany(
+            {"_id": trip["_id"], "meta.user": username},
+            {"$set": {"legs": legs, "points": trip_points, "factors": factors.version}}
+        ))
+
+    bucket_updates = []
+    for bucket_id, totals in bucket_deltas.items():
+        increments = {field: amount for field, amount in totals.items() if amount}
+        if increments:
+            bucket_updates.append(UpdateOne(
+                {"_id": bucket_id, RUN_FIELD: {"$ne": run_id}},
+                {"$inc": increments, "$set": {RUN_FIELD: run_id}}
+            ))
+    if bucket_updates:
+        db[ROLLUPS_COLLECTION].bulk_write(bucket_updates, ordered=False)
+    changed = {username: delta for username, delta in user_deltas.items() if delta}
+    users = db[USERS_COLLECTION]
+    if changed:
+        users.bulk_write([
+            UpdateOne(
+                {"username": username, RUN_FIELD: {"$ne": run_id}},
+                {"$inc": {"sustainability_points": delta}, "$set": {RUN_FIELD: run_id}}
+            )
+            for username, delta in changed.items()
+        ], ordered=False)
+    if trip_updates:
+        db[TRIPS_COLLECTION].bulk_write(trip_updates, ordered=False)
+    if changed and on_total is not None:
+        for user in users.find({"username": {"$in": list(changed)}},
+                               {"username": 1, "sustainability_points": 1, "_id": 0}):
+            on_total(user["username"], user.get("sustainability_points", 0))
+
+    result = {"chunk": chunk, "trips": len(trips), "users": len(changed), "points_delta": sum(changed.values())}
+    run = runs.find_one_and_update(
+        {"_id": run_id, "done": {"$ne": chunk}},
+        {"$push": {"done": chunk}, "$inc": {field: result[field] for field in ("trips", "users", "points_delta")}},
+        projection={"done": 1, "chunks": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if run is not None and len(run["done"]) == run["chunks"]:
+        runs.update_one({"_id": run_id}, {"$set": {"status": "done", "finished_at": datetime.now(timezone.utc)}})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    start = commands.add_parser("start", help="re-score history with the current factor set")
+    start.add_argument("--chunk-users", type=int, default=RECOMPUTE_CHUNK_USERS)
+    resume = commands.add_parser("resume", help="queue a run's unfinished chunks again")
+    resume.add_argument("run_id")
+    for command in (start, resume):
+        command.add_argument("--workers", type=int, default=0,
+                             help="also run chunks here on this many threads, and wait for the run")
+    status = commands.add_parser("status", help="show a run's progress")
+    status.add_argument("run_id")
+    args = parser.parse_args()
+
+    # The app's database, factor source and job queue
+    import newapp
+
+    if args.command == "status":
+        print(json.dumps(run_status(newapp.db, args.run_id), indent=2, default=str))
+        return
+    if args.command == "start":
+        run = start_run(newapp.db, newapp.factor_registry.current(), args.chunk_users)
+        chunks = range(run["chunks"])
+    else:
+        run = newapp.db[RUNS_COLLECTION].find_one({"_id": args.run_id})
+        if run is None:
+            parser.error(f"No recompute run '{args.run_id}'")
+        chunks = pending_chunks(run)
+    job_ids = [
+        newapp.job_queue.enqueue("recompute_chunk", {"run_id": run["_id"], "chunk": chunk},
+                                 max_attempts=newapp.JOB_MAX_ATTEMPTS)
+        for chunk in chunks
+    ]
+    print(f"Run {run['_id']} (factors '{run['version']}'): queued {len(job_ids)} of {run['chunks']} chunks.")
+    if args.workers <= 0:
+        return
+
+    pool = WorkerPool(newapp.job_queue, {"recompute_chunk": newapp.recompute_chunk_job},
+                      workers=args.workers, poll_seconds=0.2).start()
+    pending = set(job_ids)
+    while pending:
+        time.sleep(2)
+        pending = {job_id for job_id in pending if newapp.job_queue.get(job_id)["status"] in (QUEUED, RUNNING)}
+        progress = run_status(newapp.db, run["_id"])
+        print(f"{progress['done']}/{progress['chunks']} chunks, {progress['trips']} trips, "
+              f"{progress['points_delta']:+d} points")
+    pool.stop()
+    print(json.dumps(run_status(newapp.db, run["_id"]), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Concurrent Google Maps lookups shared by newapp.py and app.py."""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+
+from cache import MISSING, make_key
+from local_routing import is_local
+from route_model import RouteOption, RouteSet
+
+# One bounded pool per process; every request's per-mode lookups share it
+MAX_ROUTE_WORKERS = int(os.getenv("MAX_ROUTE_WORKERS", "16"))
+MODE_TIMEOUT_SECONDS = float(os.getenv("MODE_TIMEOUT_SECONDS", "10"))
+
+route_executor = ThreadPoolExecutor(
+    max_workers=MAX_ROUTE_WORKERS,
+    thread_name_prefix="route-fetch"
+)
+
+# Road-graph routes (local_routing.py) are estimates: they are cached only
+# this long and never reused for nearby trips, so a Maps outage doesn't
+# leave them standing in for Maps answers
+LOCAL_DIRECTIONS_CACHE_TTL = int(os.getenv("LOCAL_DIRECTIONS_CACHE_TTL", 300))
+
+# Batches (/calculate_route_points/batch) queue hundreds of lookups at once;
+# they get their own pool so single-route requests never wait behind them
+MAX_BATCH_ROUTE_WORKERS = int(os.getenv("MAX_BATCH_ROUTE_WORKERS", "8"))
+batch_executor = ThreadPoolExecutor(
+    max_workers=MAX_BATCH_ROUTE_WORKERS,
+    thread_name_prefix="route-batch"
+)
+
+
+def run_with_deadlines(executor, calls, timeout):
+    """Run `{key: fn}` on `executor`, giving each call `timeout` seconds once it starts.
+
+    Returns `(futures, timed_out)`: a finished future per key that
+    completed in time, and the keys that didn't. A call still queued is
+    only given up on (and cancelled) if nothing starts or finishes for
+    `timeout` seconds, i.e. the pool is stuck. Running calls can't be
+    cancelled; they finish in the background.
+    """
+    started = {}
+
+    def start(key, fn):
+        started[key] = time.monotonic()
+        return fn()
+
+    futures = {key: executor.submit(start, key, fn) for key, fn in calls.items()}
+    pending = dict(futures)
+    timed_out = set()
+    progress = time.monotonic()
+    seen_started = 0
+    while pending:
+        now = time.monotonic()
+        if len(started) != seen_started:
+            seen_started = len(started)
+            progress = now
+        for key in list(pending):
+            began = started.get(key)
+            if began is not None and now - began >= timeout and not pending[key].done():
+                timed_out.add(key)
+                del pending[key]
+        if pending and now - progress >= timeout:
+            # Nothing moved for a whole timeout: give up on the queued calls
+            for key in list(pending):
+                if key not in started and pending[key].cancel():
+                    timed_out.add(key)
+                    del pending[key]
+        if not pending:
+            break
+        deadlines = [started[key] + timeout for key in pending if key in started]
+        deadlines.append(progress + timeout)
+        done, _ = wait(list(pending.values()), timeout=max(min(deadlines) - now, 0.005),
+                       return_when=FIRST_COMPLETED)
+        if done:
+            progress = time.monotonic()
+            for key in [key for key, future in pending.items() if future in done]:
+                del pending[key]
+    return {key: future for key, future in futures.items() if key not in timed_out}, timed_out
+
+
+def fetch_legs(directions_fn, lookups, timeout=MODE_TIMEOUT_SECONDS,
+               cache=None, nearby=None, executor=route_executor, **directions_kwargs):
+    """Fetch many `(origin, destination, mode)` lookups at once.
+
+    `directions_fn` is called as `directions_fn(origin=..., destination=...,
+    mode=..., **directions_kwargs)`, e.g. `gmaps.directions`, on `executor`.
+    Duplicate lookups are fetched once. Each lookup gets `timeout` seconds
+    from when it starts running (see `run_with_deadlines`); one that errors
+    or times out is left out of `legs`.
+
+    Returns `(legs, no_route, timed_out)` where `legs` maps each lookup to
+    its `route_model.RouteOption`, `no_route` is the set of lookups the
+    API answered with no route and `timed_out` the set that took too long. When `cache` is given, legs are read from
+    it first and only the missing lookups go to the API. `nearby` (a
+    `route_grid.NearbyRoutes`) is asked next for a recent leg between nearby
+    points, and learns every leg fetched.
+    """
+    legs = {}
+    no_route = set()
+    pending = list(dict.fromkeys(lookups))
+    if cache is not None:
+        for lookup in list(pending):
+            leg = cache.get(make_key("directions", *lookup))
+            if leg is not MISSING:
+                legs[lookup] = leg
+                pending.remove(lookup)
+    if nearby is not None:
+        for lookup in list(pending):
+            leg = nearby.lookup(*lookup)
+            if leg is not None:
+                legs[lookup] = leg
+                pending.remove(lookup)
+
+    futures, timed_out = run_with_deadlines(
+        executor,
+        {
+            lookup: partial(directions_fn, origin=lookup[0], destination=lookup[1],
+                            mode=lookup[2], **directions_kwargs)
+            for lookup in pending
+        },
+        timeout
+    )
+    for lookup in timed_out:
+        print(f"Timed out fetching data for mode '{lookup[2]}' after {timeout:g}s.")
+
+    for lookup, future in futures.items():
+        mode = lookup[2]
+        try:
+            directions = future.result()
+            if directions:
+                local = is_local(directions)
+                legs[lookup] = RouteOption.from_directions(directions, mode)
+                if cache is not None:
+                    cache.set(make_key("directions", *lookup), legs[lookup],
+                              ttl=LOCAL_DIRECTIONS_CACHE_TTL if local else None)
+                if nearby is not None and not local:
+                    nearby.add(*lookup, legs[lookup])
+            else:
+                print(f"No route found for mode '{mode}'.")
+                no_route.add(lookup)
+        except Exception as e:
+            print(f"Error fetching data for mode '{mode}': {e}")
+    return legs, no_route, timed_out
+
+
+def fetch_modes(directions_fn, origin, destination, modes,
+                timeout=MODE_TIMEOUT_SECONDS, cache=None, nearby=None, **directions_kwargs):
+    """Fetch directions for every mode of one trip at once.
+
+    Returns `(routes, no_route)` where `routes` is a `route_model.RouteSet`
+    of the modes found, in the order `modes` were given, and `no_route` is
+    the set of modes the API answered with no route.
+    """
+    lookups = [(origin, destination, mode) for mode in dict.fromkeys(modes)]
+    legs, missing, _ = fetch_legs(directions_fn, lookups, timeout, cache, nearby, **directions_kwargs)
+    return RouteSet.from_legs(legs, lookups), {lookup[2] for lookup in missing}
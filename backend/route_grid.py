@@ -0,0 +1,233 @@
+"""Reuse recent routes between nearby endpoints.
+
+Trips often differ only by a few hundred metres at each end, but the
+directions cache is keyed on exact address strings. `RouteGrid` snaps both
+endpoints to a geohash-style grid (cells about `cell_m` wide) and keeps the
+latest route per `(origin cell, destination cell, mode)`. A new trip in the
+same cells reuses that route if its two endpoint offsets from the stored
+route add up to at most `max_error_m`. Those offsets bound how far the
+reused route's length can be from the exact one, and their sum is what
+`stats()` reports as the error introduced.
+
+Storage is array-backed and bounded: endpoint coordinates and expiry times
+live in preallocated numpy arrays of `capacity` slots, reused as a ring, so
+the oldest route is evicted first. Only the slot index is kept per cell key.
+
+`NearbyRoutes` connects the grid to `route_fetch.fetch_legs`, which checks
+it after the exact cache and before calling upstream. With
+`audit_rate > 0`, that fraction of reusable lookups is fetched anyway and
+compared with the route that would have been reused, which measures the
+actual distance error.
+"""
+import math
+import random
+import threading
+import time
+
+import numpy as np
+
+from scoring import MODE_IDS
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = 111320.0
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cell_id(lat, lng, cell_deg):
+    """Integer id of the grid cell holding (lat, lng).
+
+    Rows are `cell_deg` of latitude; each row's columns are widened by
+    1/cos(latitude), so cells stay roughly square away from the equator.
+    """
+    row = math.floor((lat + 90.0) / cell_deg)
+    row_lat = min(max(-90.0 + (row + 0.5) * cell_deg, -89.0), 89.0)
+    column = math.floor((lng + 180.0) / (cell_deg / math.cos(math.radians(row_lat))))
+    return (row << 32) | column
+
+
+class RouteGrid:
+    def __init__(self, cell_m=200, max_error_m=200, capacity=20000, ttl=3600):
+        self.cell_m = cell_m
+        self.max_error_m = max_error_m
+        self.capacity = capacity
+        self.ttl = ttl
+        self._cell_deg = cell_m / METERS_PER_DEGREE
+        # Slot columns: origin lat/lng, destination lat/lng, expiry
+        # float32 keeps positions to about a metre, in 16 bytes a slot
+        self._points = np.zeros((capacity, 4), dtype=np.float32)
+        self._expires = np.zeros(capacity, dtype=np.float64)
+        self._legs = [None] * capacity
+        self._keys = [None] * capacity
+        self._slots = {}  # (origin cell, destination cell, mode id) -> slot
+        self._next = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.reused = 0
+        self.evictions = 0
+        self.error_bound_m_total = 0.0
+        self.error_bound_m_max = 0.0
+
+    def _key(self, origin, destination, mode):
+        return (
+            cell_id(origin[0], origin[1], self._cell_deg),
+            cell_id(destination[0], destination[1], self._cell_deg),
+            MODE_IDS.get(mode, mode)
+        )
+
+    def candidate(self, origin, destination, mode):
+        """`(leg, error_bound_m)` for a reusable route, or None; doesn't count as a lookup."""
+        key = self._key(origin, destination, mode)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return None
+            if self._expires[slot] <= time.monotonic():
+                self._drop(slot)
+                return None
+            o_lat, o_lng, d_lat, d_lng = self._points[slot].tolist()
+            leg = self._legs[slot]
+        error = haversine_m(origin[0], origin[1], o_lat, o_lng) \
+            + haversine_m(destination[0], destination[1], d_lat, d_lng)
+        if error > self.max_error_m:
+            return None
+        return leg, error
+
+    def lookup(self, origin, destination, mode):
+        """A recent leg between points near `origin` and `destination`, or None."""
+        found = self.candidate(origin, destination, mode)
+        self.record(found)
+        return found[0] if found else None
+
+    def record(self, found):
+        """Count one lookup that did (`found` from `candidate`) or didn't (None) reuse a route."""
+        with self._lock:
+            self.lookups += 1
+            if found is not None:
+                self.reused += 1
+                self.error_bound_m_total += found[1]
+                self.error_bound_m_max = max(self.error_bound_m_max, found[1])
+
+    def add(self, origin, destination, mode, leg):
+        """Remember `leg` for its cells, replacing the route stored there."""
+        key = self._key(origin, destination, mode)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._next
+                self._next = (self._next + 1) % self.capacity
+                if self._keys[slot] is not None:
+                    if self._expires[slot] > time.monotonic():
+                        self.evictions += 1
+                    self._drop(slot)
+                self._slots[key] = slot
+                self._keys[slot] = key
+            self._points[slot] = (origin[0], origin[1], destination[0], destination[1])
+            self._expires[slot] = time.monotonic() + self.ttl
+            self._legs[slot] = leg
+
+    def _drop(self, slot):
+        self._slots.pop(self._keys[slot], None)
+        self._keys[slot] = None
+        self._legs[slot] = None
+        self._expires[slot] = 0.0
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+            self._keys = [None] * self.capacity
+            self._legs = [None] * self.capacity
+            self._expires[:] = 0.0
+            self._next = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def stats(self):
+        with self._lock:
+            lookups, reused = self.lookups, self.reused
+            return {
+                "backend": "grid",
+                "hits": reused,
+                "misses": lookups - reused,
+                "hit_ratio": reused / lookups if lookups else 0.0,
+                "size": len(self._slots),
+                "capacity": self.capacity,
+                "evictions": self.evictions,
+                "cell_m": self.cell_m,
+                "max_error_m": self.max_error_m,
+                "mean_error_bound_m": self.error_bound_m_total / reused if reused else 0.0,
+                "max_error_bound_m": self.error_bound_m_max
+            }
+
+
+class NearbyRoutes:
+    """`fetch_legs` hook: reuse grid routes for `(origin, destination, mode)` lookups.
+
+    `locate(address)` returns known `(lat, lng)` coordinates or None; it
+    should not call upstream, since that would cost more than it saves.
+    """
+
+    def __init__(self, grid, locate, audit_rate=0.0, seed=None):
+        self.grid = grid
+        self.name = "route_grid"
+        self.locate = locate
+        self.audit_rate = audit_rate
+        self._random = random.Random(seed)
+        self._audits = {}  # lookup -> leg that would have been reused
+        self.max_pending_audits = 1000
+        self._lock = threading.Lock()
+        self.audited = 0
+        self.audit_error_km_total = 0.0
+        self.audit_error_km_max = 0.0
+
+    def _points(self, origin, destination):
+        origin_point = self.locate(origin)
+        destination_point = self.locate(destination) if origin_point else None
+        return (origin_point, destination_point) if destination_point else None
+
+    def lookup(self, origin, destination, mode):
+        points = self._points(origin, destination)
+        if points is None:
+            return None
+        found = self.grid.candidate(*points, mode)
+        if found is not None and self.audit_rate and self._random.random() < self.audit_rate:
+            # Fetch this one for real and compare in add()
+            with self._lock:
+                if len(self._audits) >= self.max_pending_audits:
+                    self._audits.clear()  # Fetches that failed never reach add()
+                self._audits[(origin, destination, mode)] = found[0]
+            return None
+        self.grid.record(found)
+        return found[0] if found else None
+
+    def add(self, origin, destination, mode, leg):
+        with self._lock:
+            reusable = self._audits.pop((origin, destination, mode), None)
+            if reusable is not None:
+                error_km = abs(reusable.distance_km - leg.distance_km)
+                self.audited += 1
+                self.audit_error_km_total += error_km
+                self.audit_error_km_max = max(self.audit_error_km_max, error_km)
+        points = self._points(origin, destination)
+        if points is not None:
+            self.grid.add(*points, mode, leg)
+
+    def clear(self):
+        self.grid.clear()
+
+    def stats(self):
+        stats = self.grid.stats()
+        with self._lock:
+            stats.update({
+                "audited": self.audited,
+                "mean_audit_error_km": self.audit_error_km_total / self.audited if self.audited else 0.0,
+                "max_audit_error_km": self.audit_error_km_max
+            })
+        return stats
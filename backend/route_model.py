@@ -0,0 +1,263 @@
+"""Compact route results, from the Maps JSON to the response body.
+
+`RouteOption.from_directions` reads a directions result once and keeps only
+what scoring needs: the scored (first) route's distance and duration, and
+per alternative its distance, duration and km per vehicle type. These live
+in flat `array` columns with the mode as a `Mode` and vehicle types as
+`scoring.VEHICLE_IDS`, so a cached option costs a few hundred bytes.
+
+`RouteSet` gathers one trip's options in request order and concatenates
+their columns into NumPy arrays once. Scoring, filtering by time and the
+eco-optimal argmin then index those arrays in place instead of copying
+`{mode: {...}}` dicts.
+
+Responses are encoded by `dumps`, which uses orjson when it's installed.
+"""
+import json
+from array import array
+from enum import IntEnum
+
+import numpy as np
+
+from cache import MISSING
+from scoring import MODE_IDS, UNKNOWN_VEHICLE_ID, VEHICLE_IDS, VEHICLES, eco_optimal_rows
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Mode(IntEnum):
+    # Same ids as scoring.MODE_IDS, so a Mode indexes the scoring tables
+    DRIVING = MODE_IDS["driving"]
+    TRANSIT = MODE_IDS["transit"]
+    WALKING = MODE_IDS["walking"]
+    BICYCLING = MODE_IDS["bicycling"]
+
+    @property
+    def label(self):
+        return self.name.lower()
+
+    @classmethod
+    def parse(cls, mode):
+        return _MODES_BY_NAME[mode]
+
+
+_MODES_BY_NAME = {mode.label: mode for mode in Mode}
+
+# Segment category for a mode's route when the result has no step detail
+MODE_VEHICLES = {
+    Mode.DRIVING: "DRIVING",
+    Mode.WALKING: "WALKING",
+    Mode.BICYCLING: "BICYCLING",
+    Mode.TRANSIT: "TRANSIT"
+}
+
+# Vehicle type per vehicle_id; ids outside scoring.VEHICLES read as "OTHER"
+VEHICLE_NAMES = VEHICLES + ("OTHER",)
+
+# Bumped when the cached document layout changes; older entries are misses
+DOCUMENT_VERSION = 1
+
+
+class RouteOption:
+    """One mode's directions between two points.
+
+    `distance_km`/`duration_min` are the scored route. Alternative `i` (the
+    scored route is alternative 0) has `alt_distance_km[i]`,
+    `alt_duration_min[i]` and `segment_count[i]` consecutive entries in
+    `segment_vehicle`/`segment_km`.
+    """
+
+    __slots__ = ("mode", "distance_km", "duration_min", "alt_distance_km",
+                 "alt_duration_min", "segment_count", "segment_vehicle", "segment_km")
+
+    def __init__(self, mode, distance_km, duration_min, alt_distance_km,
+                 alt_duration_min, segment_count, segment_vehicle, segment_km):
+        self.mode = mode
+        self.distance_km = distance_km
+        self.duration_min = duration_min
+        self.alt_distance_km = alt_distance_km
+        self.alt_duration_min = alt_duration_min
+        self.segment_count = segment_count
+        self.segment_vehicle = segment_vehicle
+        self.segment_km = segment_km
+
+    @classmethod
+    def from_directions(cls, directions, mode):
+        """Parse a non-empty directions result (every route the API returned).
+
+        Transit steps count toward their vehicle type ("BUS", "SUBWAY",
+        ...), other steps toward their travel mode ("WALKING", ...).
+        """
+        mode = Mode.parse(mode) if isinstance(mode, str) else Mode(mode)
+        fallback = MODE_VEHICLES[mode]
+        alt_distance, alt_duration, counts, vehicles, kms = [], [], [], [], []
+        for route in directions:
+            meters = seconds = 0
+            segments = {}  # vehicle -> km, in order of appearance
+            for leg in route["legs"]:
+                meters += leg["distance"]["value"]
+                seconds += leg["duration"]["value"]
+                steps = leg.get("steps")
+                if not steps:
+                    segments[fallback] = segments.get(fallback, 0) + leg["distance"]["value"] / 1000
+                    continue
+                for step in steps:
+                    transit = step.get("transit_details")
+                    if transit is not None:
+                        vehicle = transit.get("line", {}).get("vehicle", {}).get("type", "TRANSIT")
+                    else:
+                        vehicle = step.get("travel_mode") or fallback
+                    segments[vehicle] = segments.get(vehicle, 0) + step["distance"]["value"] / 1000
+            alt_distance.append(meters / 1000)
+            alt_duration.append(seconds / 60)
+            counts.append(len(segments))
+            vehicles += [VEHICLE_IDS.get(vehicle, UNKNOWN_VEHICLE_ID) for vehicle in segments]
+            kms.extend(segments.values())
+        scored = directions[0]["legs"][0]
+        return cls(
+            mode,
+            scored["distance"]["value"] / 1000,  # Convert to km
+            scored["duration"]["value"] / 60,  # Convert to minutes
+            array("d", alt_distance), array("d", alt_duration),
+            array("H", counts), array("B", vehicles), array("d", kms)
+        )
+
+    def alternatives(self):
+        """`{"distance", "duration", "segments": {vehicle: km}}` per alternative."""
+        result = []
+        start = 0
+        vehicles, kms = self.segment_vehicle, self.segment_km
+        for distance, duration, count in zip(self.alt_distance_km, self.alt_duration_min, self.segment_count):
+            result.append({
+                "distance": distance,
+                "duration": duration,
+                "segments": {VEHICLE_NAMES[vehicles[i]]: kms[i] for i in range(start, start + count)}
+            })
+            start += count
+        return result
+
+    def to_document(self):
+        """BSON/JSON-safe form, for shared caches."""
+        return {
+            "v": DOCUMENT_VERSION,
+            "mode": int(self.mode),
+            "km": self.distance_km,
+            "min": self.duration_min,
+            "alt_km": self.alt_distance_km.tolist(),
+            "alt_min": self.alt_duration_min.tolist(),
+            "seg_n": self.segment_count.tolist(),
+            "seg_vehicle": self.segment_vehicle.tolist(),
+            "seg_km": self.segment_km.tolist()
+        }
+
+    @classmethod
+    def from_document(cls, doc):
+        """Inverse of `to_document`; MISSING for documents in another layout."""
+        if not isinstance(doc, dict) or doc.get("v") != DOCUMENT_VERSION:
+            return MISSING
+        return cls(
+            Mode(doc["mode"]), doc["km"], doc["min"],
+            array("d", doc["alt_km"]), array("d", doc["alt_min"]),
+            array("H", doc["seg_n"]), array("B", doc["seg_vehicle"]), array("d", doc["seg_km"])
+        )
+
+    def __repr__(self):
+        return (f"<RouteOption {self.mode.label} {self.distance_km:.2f} km "
+                f"{self.duration_min:.1f} min, {len(self.alt_distance_km)} alternatives>")
+
+
+class RouteSet:
+    """One trip's options, in request order, with their columns side by side.
+
+    Row `r` is `options[r]`. Alternatives of every option are numbered
+    consecutively (`alt_row` maps them back to a row, `primary[r]` is row
+    `r`'s scored alternative) and so are their segments (`segment_alt`).
+    """
+
+    __slots__ = ("options", "mode_id", "distance_km", "duration_min", "alt_row",
+                 "alt_distance_km", "alt_duration_min", "primary",
+                 "segment_alt", "segment_vehicle", "segment_km")
+
+    def __init__(self, options):
+        self.options = list(options)
+        mode_id, distance, duration = array("b"), array("d"), array("d")
+        alt_count, alt_distance, alt_duration = array("H"), array("d"), array("d")
+        segment_count, segment_vehicle, segment_km = array("H"), array("B"), array("d")
+        # Concatenate with array's C loops, then wrap each column once
+        for option in self.options:
+            mode_id.append(option.mode)
+            distance.append(option.distance_km)
+            duration.append(option.duration_min)
+            alt_count.append(len(option.alt_distance_km))
+            alt_distance.extend(option.alt_distance_km)
+            alt_duration.extend(option.alt_duration_min)
+            segment_count.extend(option.segment_count)
+            segment_vehicle.extend(option.segment_vehicle)
+            segment_km.extend(option.segment_km)
+        self.mode_id = np.frombuffer(mode_id, dtype=np.int8)
+        self.distance_km = np.frombuffer(distance, dtype=np.float64)
+        self.duration_min = np.frombuffer(duration, dtype=np.float64)
+        alt_count = np.frombuffer(alt_count, dtype=np.uint16)
+        self.alt_row = np.repeat(np.arange(len(alt_count)), alt_count)
+        self.primary = np.cumsum(alt_count, dtype=np.int64) - alt_count
+        self.alt_distance_km = np.frombuffer(alt_distance, dtype=np.float64)
+        self.alt_duration_min = np.frombuffer(alt_duration, dtype=np.float64)
+        self.segment_alt = np.repeat(np.arange(len(segment_count)), np.frombuffer(segment_count, dtype=np.uint16))
+        self.segment_vehicle = np.frombuffer(segment_vehicle, dtype=np.uint8)
+        self.segment_km = np.frombuffer(segment_km, dtype=np.float64)
+
+    @classmethod
+    def from_legs(cls, legs, lookups):
+        """Options for the `lookups` found in `legs` (see route_fetch.fetch_legs), in order."""
+        return cls(legs[lookup] for lookup in dict.fromkeys(lookups) if lookup in legs)
+
+    def __len__(self):
+        return len(self.options)
+
+    def __iter__(self):
+        return iter(self.options)
+
+    @property
+    def modes(self):
+        return [option.mode.label for option in self.options]
+
+    def get(self, mode):
+        """The option for `mode` (a name or `Mode`), or None."""
+        mode = Mode.parse(mode) if isinstance(mode, str) else mode
+        for option in self.options:
+            if option.mode == mode:
+                return option
+        return None
+
+    def alternative_footprints(self, vehicle_table):
+        """CO₂ in grams for every alternative, summed over its segments."""
+        return np.bincount(
+            self.segment_alt,
+            weights=self.segment_km * vehicle_table[self.segment_vehicle],
+            minlength=len(self.alt_row)
+        )
+
+    def eco_row(self, footprints, max_duration=None):
+        """Row of the lowest-footprint option within `max_duration`, or -1.
+
+        Ties go to the earlier row (see `scoring.eco_optimal_rows`).
+        """
+        if not len(footprints):
+            return -1
+        return int(eco_optimal_rows(footprints, self.duration_min, max_duration=max_duration)[0])
+
+
+def _default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload):
+    """Encode a response body to UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, separators=(",", ":"), default=_default).encode("utf-8")
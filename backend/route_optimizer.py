@@ -0,0 +1,280 @@
+"""Multi-stop route optimization over a Distance Matrix.
+
+`optimize_route` orders the waypoints between a fixed start and end:
+
+- travel costs come from `fetch_matrix`, which splits the matrix into
+  chunks within the Distance Matrix API's per-request limits, fetches them
+  concurrently and caches every origin/destination pair
+- up to `EXACT_MAX_WAYPOINTS` waypoints are solved exactly (Held-Karp DP)
+- larger sets start from nearest-neighbour and improve with 2-opt and
+  Or-opt moves until no move helps or `time_budget` seconds pass
+
+The objective is "time", "distance" or "co2" (distance weighted by the
+mode's emission factor).
+"""
+import math
+import time
+from concurrent.futures import wait
+
+import numpy as np
+
+from cache import MISSING, make_key
+from route_fetch import MODE_TIMEOUT_SECONDS, route_executor
+
+# Distance Matrix API limits: 25 origins or destinations, 100 elements
+MATRIX_MAX_SIDE = 25
+MATRIX_MAX_ELEMENTS = 100
+
+EXACT_MAX_WAYPOINTS = 12
+DEFAULT_TIME_BUDGET = 2.0
+OBJECTIVES = ("time", "distance", "co2")
+
+
+def matrix_chunks(n, max_side=MATRIX_MAX_SIDE, max_elements=MATRIX_MAX_ELEMENTS):
+    """Split an n x n matrix into (row range, column range) blocks within the limits."""
+    side = min(max_side, n)
+    rows = max(1, min(side, max_elements // side))
+    return [
+        (range(r, min(r + rows, n)), range(c, min(c + side, n)))
+        for r in range(0, n, rows)
+        for c in range(0, n, side)
+    ]
+
+
+def fetch_matrix(matrix_fn, points, mode="driving", cache=None, timeout=MODE_TIMEOUT_SECONDS):
+    """Distance (m) and duration (s) between every pair of `points`.
+
+    `matrix_fn` is called like `gmaps.distance_matrix(origins, destinations,
+    mode=...)`. Only pairs missing from `cache` are requested; a block is
+    fetched only if it contains at least one missing pair. Pairs without a
+    route are `inf`.
+    """
+    n = len(points)
+    distance = np.full((n, n), np.inf)
+    duration = np.full((n, n), np.inf)
+    np.fill_diagonal(distance, 0)
+    np.fill_diagonal(duration, 0)
+
+    def pair_key(i, j):
+        return make_key("matrix", points[i], points[j], mode)
+
+    missing = set()
+    for i in range(n):
+        for j in range(n):
+            if i == j:
+                continue
+            cached = cache.get(pair_key(i, j)) if cache is not None else MISSING
+            if cached is MISSING:
+                missing.add((i, j))
+            elif cached is not None:
+                distance[i, j], duration[i, j] = cached
+
+    blocks = [
+        (rows, cols) for rows, cols in matrix_chunks(n)
+        if any((i, j) in missing for i in rows for j in cols)
+    ]
+    futures = {
+        route_executor.submit(
+            matrix_fn,
+            [points[i] for i in rows],
+            [points[j] for j in cols],
+            mode=mode
+        ): (rows, cols)
+        for rows, cols in blocks
+    }
+    if futures:
+        wait(futures, timeout=timeout)
+
+    for future, (rows, cols) in futures.items():
+        if not future.done():
+            future.cancel()
+            print(f"Timed out fetching a {len(rows)}x{len(cols)} distance matrix block.")
+            continue
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Error fetching distance matrix block: {e}")
+            continue
+        for i, row in zip(rows, result["rows"]):
+            for j, element in zip(cols, row["elements"]):
+                if i == j:
+                    continue
+                if element.get("status") == "OK":
+                    value = [element["distance"]["value"], element["duration"]["value"]]
+                    distance[i, j], duration[i, j] = value
+                else:
+                    value = None
+                if cache is not None:
+                    cache.set(pair_key(i, j), value)
+    return distance, duration
+
+
+def objective_costs(distance_m, duration_s, objective, emission_factor=0):
+    """Cost matrix to minimize: seconds, meters or grams of CO₂."""
+    if objective == "time":
+        return duration_s
+    if objective == "distance":
+        return distance_m
+    if objective == "co2":
+        # With a zero-emission mode every order ties; break ties on distance
+        return distance_m / 1000 * emission_factor + distance_m * 1e-9
+    raise ValueError(f"Unknown objective '{objective}', expected one of {OBJECTIVES}")
+
+
+def path_cost(costs, order):
+    return float(sum(costs[a, b] for a, b in zip(order, order[1:])))
+
+
+def held_karp(costs, start, end, waypoints):
+    """Exact best order of `waypoints` between `start` and `end`."""
+    k = len(waypoints)
+    if k == 0:
+        return [start, end]
+    nodes = np.asarray(waypoints)
+    inner = costs[np.ix_(nodes, nodes)]  # inner[i, j]: waypoint i -> waypoint j
+    full = 1 << k
+    dp = np.full((full, k), np.inf)
+    parent = np.full((full, k), -1, dtype=np.int64)
+    for j in range(k):
+        dp[1 << j, j] = costs[start, nodes[j]]
+
+    for mask in range(1, full):
+        members = [i for i in range(k) if mask >> i & 1]
+        if len(members) < 2:
+            continue
+        for j in members:
+            previous = mask ^ (1 << j)
+            candidates = dp[previous] + inner[:, j]
+            i = int(np.argmin(candidates))
+            dp[mask, j] = candidates[i]
+            parent[mask, j] = i
+
+    finish = dp[full - 1] + costs[nodes, end]
+    j = int(np.argmin(finish))
+    mask = full - 1
+    order = []
+    while j >= 0:
+        order.append(int(nodes[j]))
+        mask, j = mask ^ (1 << j), int(parent[mask, j])
+    return [start] + order[::-1] + [end]
+
+
+def nearest_neighbour(costs, start, end, waypoints):
+    order = [start]
+    remaining = set(waypoints)
+    while remaining:
+        current = order[-1]
+        following = min(remaining, key=lambda node: costs[current, node])
+        order.append(following)
+        remaining.remove(following)
+    return order + [end]
+
+
+def two_opt_pass(costs, order, deadline):
+    """First improving segment reversal, or None. Handles asymmetric costs."""
+    n = len(order)
+    # Prefix sums of edge costs along the path, forwards and backwards
+    forward = np.concatenate(([0.0], np.cumsum(costs[order[:-1], order[1:]])))
+    backward = np.concatenate(([0.0], np.cumsum(costs[order[1:], order[:-1]])))
+    for i in range(1, n - 2):
+        if time.monotonic() > deadline:
+            return None
+        a = order[i - 1]
+        for j in range(i + 1, n - 1):
+            b, c, d = order[i], order[j], order[j + 1]
+            old = costs[a, b] + (forward[j] - forward[i]) + costs[c, d]
+            new = costs[a, c] + (backward[j] - backward[i]) + costs[b, d]
+            if new < old - 1e-9:
+                return order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+    return None
+
+
+def or_opt_pass(costs, order, deadline, max_segment=3):
+    """First improving move of a 1-3 stop segment elsewhere, or None."""
+    n = len(order)
+    for length in range(1, max_segment + 1):
+        for i in range(1, n - length):
+            if time.monotonic() > deadline:
+                return None
+            j = i + length - 1  # segment order[i..j]
+            a, first, last, b = order[i - 1], order[i], order[j], order[j + 1]
+            removed_gain = costs[a, first] + costs[last, b] - costs[a, b]
+            rest = order[:i] + order[j + 1:]
+            for k in range(len(rest) - 1):
+                p, q = rest[k], rest[k + 1]
+                if p == a:
+                    continue
+                added = costs[p, first] + costs[last, q] - costs[p, q]
+                if added < removed_gain - 1e-9:
+                    return rest[:k + 1] + order[i:j + 1] + rest[k + 1:]
+    return None
+
+
+def local_search(costs, order, time_budget):
+    """Apply 2-opt and Or-opt moves until neither helps or the budget runs out."""
+    deadline = time.monotonic() + time_budget
+    while time.monotonic() < deadline:
+        improved = two_opt_pass(costs, order, deadline) or or_opt_pass(costs, order, deadline)
+        if improved is None:
+            break
+        order = improved
+    return order
+
+
+def solve_order(costs, start, end, waypoints, time_budget=DEFAULT_TIME_BUDGET):
+    """Visit order as a list of point indices, plus the solver used."""
+    if len(waypoints) <= EXACT_MAX_WAYPOINTS:
+        return held_karp(costs, start, end, waypoints), "held-karp"
+    order = nearest_neighbour(costs, start, end, waypoints)
+    return local_search(costs, order, time_budget), "2-opt/or-opt"
+
+
+def optimize_route(matrix_fn, start, end, waypoints, mode="driving", objective="time",
+                   emission_factors=None, cache=None, time_budget=DEFAULT_TIME_BUDGET):
+    """Best order to visit `waypoints` between `start` and `end`.
+
+    Returns a plan dict with the visit order, per-leg and total distance,
+    duration and CO₂, or `{"error": ..., "order": None}` when no complete
+    route exists.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective '{objective}', expected one of {OBJECTIVES}")
+    emission_factor = (emission_factors or {}).get(mode, 0)
+    points = [start] + list(waypoints) + [end]
+    n = len(points)
+
+    distance_m, duration_s = fetch_matrix(matrix_fn, points, mode, cache)
+    costs = objective_costs(distance_m, duration_s, objective, emission_factor)
+
+    started = time.perf_counter()
+    order, solver = solve_order(costs, 0, n - 1, list(range(1, n - 1)), time_budget)
+    solve_seconds = time.perf_counter() - started
+
+    legs = []
+    for a, b in zip(order, order[1:]):
+        distance_km = distance_m[a, b] / 1000
+        legs.append({
+            "from": points[a],
+            "to": points[b],
+            "distance_km": distance_km,
+            "duration_min": duration_s[a, b] / 60,
+            "co2_g": distance_km * emission_factor
+        })
+    if not all(math.isfinite(leg["distance_km"]) for leg in legs):
+        return {"error": "No route connects every stop", "order": None}
+
+    return {
+        "mode": mode,
+        "objective": objective,
+        "solver": solver,
+        "optimal": solver == "held-karp",
+        "solve_seconds": solve_seconds,
+        "order": [points[i] for i in order],
+        # Positions in the `waypoints` argument, in visiting order
+        "waypoint_order": [i - 1 for i in order[1:-1]],
+        "legs": legs,
+        "total_distance_km": sum(leg["distance_km"] for leg in legs),
+        "total_duration_min": sum(leg["duration_min"] for leg in legs),
+        "total_co2_g": sum(leg["co2_g"] for leg in legs),
+        "objective_value": path_cost(costs, order)
+    }
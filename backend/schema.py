@@ -0,0 +1,53 @@
+"""Collections and indexes the backend's hot queries rely on.
+
+`ensure_indexes` is idempotent and runs at startup. Each entry in `INDEXES`
+lists the queries it serves, so a new query pattern should come with an
+index here. Collections that need creation options (time-series) are listed
+in `COLLECTIONS` and created before their indexes.
+"""
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from factors import FACTORS_COLLECTION
+from trips import ROLLUPS_COLLECTION, TRIPS_COLLECTION, TRIPS_TIMESERIES
+
+COLLECTIONS = {
+    TRIPS_COLLECTION: {"timeseries": TRIPS_TIMESERIES},
+}
+
+INDEXES = {
+    "Users": [
+        # signup, login, get_user_points, calculate_route_points,
+        # updatepassword and the leaderboard's rank lookups
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        # get_leaderboard's top-N sort and index-only rank counts
+        IndexModel([("sustainability_points", DESCENDING)], name="sustainability_points_desc"),
+    ],
+    TRIPS_COLLECTION: [
+        # /users/<name>/trips export, oldest first
+        IndexModel([("meta.user", ASCENDING), ("ts", ASCENDING)], name="user_ts"),
+    ],
+    ROLLUPS_COLLECTION: [
+        # /users/<name>/trip_stats, newest bucket first
+        IndexModel([("user", ASCENDING), ("period", ASCENDING), ("start", DESCENDING)],
+                   name="user_period_start"),
+    ],
+    FACTORS_COLLECTION: [
+        # factors.MongoSource, newest published set first
+        IndexModel([("published_at", DESCENDING)], name="published_at_desc"),
+    ],
+}
+
+
+def ensure_collections(db):
+    """Create collections in `COLLECTIONS` that don't exist yet."""
+    existing = set(db.list_collection_names())
+    for collection_name, options in COLLECTIONS.items():
+        if collection_name not in existing:
+            db.create_collection(collection_name, **options)
+
+
+def ensure_indexes(db):
+    """Create any missing collections and indexes; existing ones are left untouched."""
+    ensure_collections(db)
+    for collection_name, indexes in INDEXES.items():
+        db[collection_name].create_indexes(indexes)
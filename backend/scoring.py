@@ -0,0 +1,144 @@
+"""Vectorized carbon footprint and points scoring over columnar trip data.
+
+Trips are described by parallel NumPy arrays: `distance_km`, `duration_min`
+and `mode_id` (an index into `MODES`), plus an optional `trip_index` that
+groups rows (one row per mode) into trips. Emission factors and points
+multipliers become lookup tables indexed by `mode_id`, so scoring millions
+of rows is a handful of array operations.
+
+Segment-level scoring works the same way one level down: every step of
+every alternative route becomes a `(alternative, vehicle_id, km)` row, and
+per-vehicle emission factors are a lookup table indexed by `vehicle_id`.
+"""
+import numpy as np
+
+MODES = ("driving", "transit", "walking", "bicycling")
+MODE_IDS = {mode: mode_id for mode_id, mode in enumerate(MODES)}
+# Any mode outside MODES is scored with this id (no emissions, no points)
+UNKNOWN_MODE_ID = len(MODES)
+
+
+# Vehicle types in directions steps (transit vehicle types plus the
+# non-transit travel modes); see route_model.RouteOption.from_directions
+VEHICLES = (
+    "DRIVING", "WALKING", "BICYCLING", "TRANSIT",
+    "BUS", "INTERCITY_BUS", "TROLLEYBUS", "SHARE_TAXI",
+    "RAIL", "HEAVY_RAIL", "COMMUTER_TRAIN", "HIGH_SPEED_TRAIN",
+    "SUBWAY", "METRO_RAIL", "TRAM", "MONORAIL",
+    "FERRY", "CABLE_CAR", "GONDOLA_LIFT", "FUNICULAR", "OTHER"
+)
+VEHICLE_IDS = {vehicle: vehicle_id for vehicle_id, vehicle in enumerate(VEHICLES)}
+UNKNOWN_VEHICLE_ID = len(VEHICLES)
+
+
+def encode_modes(modes):
+    """Map mode names to an int8 `mode_id` array."""
+    return np.fromiter(
+        (MODE_IDS.get(mode, UNKNOWN_MODE_ID) for mode in modes),
+        dtype=np.int8,
+        count=len(modes)
+    )
+
+
+def build_table(factors, default=0):
+    """Turn a `{mode: factor}` dict into a lookup table indexed by mode_id."""
+    table = np.full(len(MODES) + 1, default, dtype=np.float64)
+    for mode, factor in factors.items():
+        if mode in MODE_IDS:
+            table[MODE_IDS[mode]] = factor
+    return table
+
+
+def build_vehicle_table(factors, default=0):
+    """Turn a `{vehicle: factor}` dict into a lookup table indexed by vehicle_id.
+
+    Vehicle types missing from `factors`, including ones outside
+    `VEHICLES`, get `default`.
+    """
+    table = np.full(len(VEHICLES) + 1, default, dtype=np.float64)
+    for vehicle, factor in factors.items():
+        if vehicle in VEHICLE_IDS:
+            table[VEHICLE_IDS[vehicle]] = factor
+    return table
+
+
+def carbon_footprints(distance_km, mode_id, emission_table):
+    """CO₂ in grams for every row."""
+    return np.asarray(distance_km, dtype=np.float64) * emission_table[mode_id]
+
+
+def points(distance_km, mode_id, points_table):
+    """Points earned for every row, truncated to whole points."""
+    return np.trunc(
+        np.asarray(distance_km, dtype=np.float64) * points_table[mode_id]
+    ).astype(np.int64)
+
+
+def eco_optimal_rows(footprints, duration_min, trip_index=None, max_duration=None):
+    """Row of the lowest-footprint mode within `max_duration` for each trip.
+
+    Returns an array with one entry per trip (`trip_index` values are
+    0..n_trips-1); trips where no mode fits the time limit get -1. Ties go
+    to the earlier row, matching `min()` over a mode dict.
+    """
+    footprints = np.asarray(footprints, dtype=np.float64)
+    if trip_index is None:
+        trip_index = np.zeros(len(footprints), dtype=np.int64)
+    n_trips = int(trip_index.max()) + 1 if len(trip_index) else 0
+
+    feasible = np.ones(len(footprints), dtype=bool)
+    if max_duration is not None:
+        feasible = np.asarray(duration_min, dtype=np.float64) <= max_duration
+    masked = np.where(feasible, footprints, np.inf)
+
+    # Stable sort by (trip, footprint); the first row of each trip wins
+    order = np.lexsort((masked, trip_index))
+    trips_sorted = trip_index[order]
+    first = np.flatnonzero(np.r_[True, trips_sorted[1:] != trips_sorted[:-1]]) if len(order) else order
+
+    best = np.full(n_trips, -1, dtype=np.int64)
+    winners = order[first]
+    best[trips_sorted[first]] = np.where(feasible[winners], winners, -1)
+    return best
+
+
+def pareto_front(duration_min, footprints):
+    """Rows not beaten on both duration and CO₂ by another row, fastest first.
+
+    Of rows with identical duration and footprint only the first is kept.
+    """
+    duration_min = np.asarray(duration_min, dtype=np.float64)
+    footprints = np.asarray(footprints, dtype=np.float64)
+    if not len(duration_min):
+        return np.empty(0, dtype=np.int64)
+    order = np.lexsort((footprints, duration_min))
+    sorted_footprints = footprints[order]
+    # A row is on the front if it emits less than every faster row
+    best_before = np.r_[np.inf, np.minimum.accumulate(sorted_footprints)[:-1]]
+    return order[sorted_footprints < best_before]
+
+
+def segment_footprints(segment_alt, segment_vehicle_id, segment_km, vehicle_table, n_alternatives):
+    """CO₂ in grams for every alternative, summed over its segments."""
+    return np.bincount(
+        segment_alt,
+        weights=segment_km * vehicle_table[segment_vehicle_id],
+        minlength=n_alternatives
+    )
+
+
+def score_trips(distance_km, duration_min, mode_id, emission_table, points_table,
+                trip_index=None, max_duration=None, footprints=None):
+    """Score every row in one pass.
+
+    Returns `(footprints, points, eco_rows)`: grams of CO₂ and points per
+    row, and the eco-optimal row per trip from `eco_optimal_rows`. Pass
+    `footprints` (e.g. from `segment_footprints`) to use them instead of
+    the flat per-mode factors.
+    """
+    mode_id = np.asarray(mode_id, dtype=np.int64)
+    if footprints is None:
+        footprints = carbon_footprints(distance_km, mode_id, emission_table)
+    earned = points(distance_km, mode_id, points_table)
+    eco_rows = eco_optimal_rows(footprints, duration_min, trip_index, max_duration)
+    return footprints, earned, eco_rows
@@ -0,0 +1,126 @@
+"""Single-flight coalescing of identical in-flight lookups.
+
+When several requests ask for the same key at the same time, only the first
+(the leader) calls upstream; the others wait for its result, or its
+exception. Nothing is remembered once the call finishes, which is the
+caches' job. Each waiter that didn't call upstream increments
+`ecotrail_coalesced_calls_total{call=<name>}`.
+
+    geocode_flight = SingleFlight("geocode")
+    geocode_flight.do(key, fetch, address)              # threads
+    await geocode_flight.do_async(key, fetch, address)  # asyncio
+
+Threaded and asyncio callers of the same key share one call too, e.g.
+Flask routes run on asgi_app's executor and the ASGI routes on its loop.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from cache import make_key
+from metrics import coalesced_calls
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}   # key -> concurrent.futures.Future, for every call in flight
+        self._tasks = {}   # key -> [asyncio.Task, waiters], for calls started by do_async
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return `fn(*args, **kwargs)`, sharing one call among concurrent callers of `key`.
+
+        Never call it on an event loop: joining a `do_async` call blocks.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            coalesced_calls.inc(call=self.name)
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """Await `fn(*args, **kwargs)`, sharing one call among concurrent awaiters of `key`.
+
+        The call runs as its own task. A caller that is cancelled (e.g. its
+        `wait_for` timed out) only stops waiting, whether or not it started
+        the call; the call is cancelled once no awaiter waits for it, and
+        threaded callers that joined it get a CancelledError.
+        """
+        entry = self._tasks.get(key)
+        if entry is None:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    # Lets threaded callers (`do`) of `key` join this call
+                    future = self._calls[key] = Future()
+            if not leader:
+                # A threaded caller is making the call; shield it from our cancellation
+                coalesced_calls.inc(call=self.name)
+                return await asyncio.shield(asyncio.wrap_future(future))
+            try:
+                entry = self._tasks[key] = [asyncio.ensure_future(fn(*args, **kwargs)), 0]
+            except BaseException as e:
+                with self._lock:
+                    del self._calls[key]
+                future.set_exception(e)
+                raise
+
+            def finished(task):
+                if self._tasks.get(key) is entry:
+                    del self._tasks[key]
+                with self._lock:
+                    del self._calls[key]
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:  # Also marks it retrieved, so it isn't logged
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+
+            entry[0].add_done_callback(finished)
+        else:
+            coalesced_calls.inc(call=self.name)
+        task = entry[0]
+        entry[1] += 1
+        try:
+            # shield: a cancelled waiter mustn't cancel the shared call
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if entry[1] == 1 and not task.done():
+                task.cancel()  # The last waiter gave up
+            raise
+        finally:
+            entry[1] -= 1
+
+    def wrap(self, fn, key=None):
+        """`fn` coalesced on its arguments, or on `key(*args, **kwargs)` if given."""
+
+        def wrapper(*args, **kwargs):
+            if key is not None:
+                call_key = key(*args, **kwargs)
+            else:
+                call_key = make_key(*args, *(f"{name}={kwargs[name]}" for name in sorted(kwargs)))
+            return self.do(call_key, fn, *args, **kwargs)
+
+        return wrapper
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
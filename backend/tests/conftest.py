@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend is a flat set of modules imported by name (see newapp.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,81 @@
+import mongomock
+import pytest
+from pymongo.errors import BulkWriteError
+
+import newapp
+from cache import TTLCache
+
+
+def directions(origin, destination, mode, **kwargs):
+    return [{"legs": [{"distance": {"value": 2000}, "duration": {"value": 900}, "steps": []}]}]
+
+
+class FailingUsers:
+    """Users collection whose bulk_write fails the awards for `broken` users.
+
+    Applies each UpdateOne itself: mongomock's bulk_write doesn't accept
+    the operations of current pymongo releases.
+    """
+
+    def __init__(self, collection, broken):
+        self.collection = collection
+        self.broken = broken
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, requests, ordered=True):
+        errors = []
+        for index, request in enumerate(requests):
+            if request._filter["username"] in self.broken:
+                errors.append({"index": index, "code": 2, "errmsg": "failed"})
+            else:
+                self.collection.update_one(request._filter, request._doc, upsert=request._upsert)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": 0})
+
+
+@pytest.fixture
+def batch_app(monkeypatch):
+    users = mongomock.MongoClient().db["Users"]
+    users.insert_many([
+        {"username": name, "sustainability_points": 0, "trip_ids": []} for name in ("ann", "bob", "cid")
+    ])
+    recorded = []
+    monkeypatch.setattr(newapp, "users_collection", FailingUsers(users, {"bob"}))
+    monkeypatch.setattr(newapp, "geocode_address", lambda address: address)
+    monkeypatch.setattr(newapp, "coalesced_directions", directions)
+    monkeypatch.setattr(newapp, "directions_cache", TTLCache("directions"))
+    monkeypatch.setattr(newapp, "nearby_routes", None)
+    monkeypatch.setattr(newapp, "record_trips", lambda trips, owner=None: recorded.extend(trips))
+    return newapp.app.test_client(), users, recorded
+
+
+def test_failed_award_only_fails_its_own_trip(batch_app):
+    client, users, recorded = batch_app
+    trips = [
+        {"username": name, "origin": "A", "destination": "B", "modes": ["walking"], "trip_id": f"t-{name}"}
+        for name in ("ann", "bob", "cid")
+    ]
+    response = client.post("/calculate_route_points/batch", json={"trips": trips})
+
+    assert response.status_code == 207
+    results = response.get_json()["results"]
+    assert [result["status"] for result in results] == ["ok", "error", "ok"]
+    assert results[1]["error"] == "Unable to update points"
+    assert sorted(trip["meta"]["user"] for trip in recorded) == ["ann", "cid"]
+    points = {user["username"]: user["sustainability_points"] for user in users.find()}
+    assert points["ann"] == points["cid"] > 0
+    assert points["bob"] == 0
+
+
+def test_repeated_trip_id_is_not_awarded_twice(batch_app):
+    client, users, recorded = batch_app
+    trip = {"username": "ann", "origin": "A", "destination": "B", "modes": ["walking"], "trip_id": "t1"}
+    first = client.post("/calculate_route_points/batch", json={"trips": [trip]}).get_json()["results"][0]
+    again = client.post("/calculate_route_points/batch", json={"trips": [trip, trip]}).get_json()["results"]
+
+    assert first["duplicate_trip"] is False
+    assert [result["duplicate_trip"] for result in again] == [True, True]
+    assert users.find_one({"username": "ann"})["sustainability_points"] == first["total_points_earned"]
+    assert len(recorded) == 1
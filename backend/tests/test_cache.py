@@ -0,0 +1,39 @@
+import time
+
+import mongomock
+
+from cache import MISSING, MongoCache, TieredCache, TTLCache
+
+
+def tiered(collection, ttl=3600):
+    """One worker's view of a shared cache: its own local tier over `collection`."""
+    return TieredCache(TTLCache("geocode", ttl=ttl), MongoCache("geocode", collection, ttl=ttl))
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache("t", ttl=3600)
+    cache.set("a", 1, ttl=0.05)
+    assert cache.get("a") == 1
+    time.sleep(0.06)
+    assert cache.get("a") is MISSING
+
+
+def test_shared_hit_keeps_the_writers_ttl():
+    collection = mongomock.MongoClient().db["Cache_geocode"]
+    worker_a, worker_b = tiered(collection), tiered(collection)
+
+    # A short negative entry, like GEOCODE_NEGATIVE_TTL
+    worker_a.set("nowhere", None, ttl=0.3)
+    assert worker_b.get("nowhere") is None  # Promoted into B's local tier
+    time.sleep(0.4)
+    assert worker_a.get("nowhere") is MISSING
+    assert worker_b.get("nowhere") is MISSING
+
+
+def test_shared_hit_is_served_locally_afterwards():
+    collection = mongomock.MongoClient().db["Cache_geocode"]
+    worker_a, worker_b = tiered(collection), tiered(collection)
+    worker_a.set("paris", "Paris, France")
+    assert worker_b.get("paris") == "Paris, France"
+    collection.delete_many({})
+    assert worker_b.get("paris") == "Paris, France"
@@ -0,0 +1,33 @@
+import clients
+from clients import ProcessLocal
+
+
+def test_built_on_first_use_only():
+    built = []
+
+    def factory():
+        built.append(1)
+        return {"test": {"Users": "users"}}
+
+    client = ProcessLocal(factory)
+    users = client["test"]["Users"]
+    assert not client.is_built
+    assert users.instance() == "users"
+    assert client.get("test") == {"Users": "users"}
+    assert built == [1]
+
+
+def test_a_forked_child_builds_its_own_client():
+    client = ProcessLocal(object)
+    parent = client.instance()
+    clients._reset_after_fork()
+    assert not client.is_built
+    assert client.instance() is not parent
+
+
+def test_override_replaces_the_built_value():
+    client = ProcessLocal(lambda: "real")
+    client.override("stand-in")
+    assert client.instance() == "stand-in"
+    client.reset()
+    assert client.instance() == "real"
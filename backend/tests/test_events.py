@@ -0,0 +1,45 @@
+import json
+
+from events import LEADERBOARD_TOPIC, EventBus, StreamState, user_topic
+
+
+def test_subscribers_get_only_their_topics():
+    bus = EventBus()
+    ann = bus.subscribe([LEADERBOARD_TOPIC, user_topic("ann")])
+    bob = bus.subscribe([user_topic("bob")])
+    bus.publish(user_topic("ann"), {"username": "ann", "total_points": 10})
+
+    assert ann.wait(0)
+    assert ann.drain() == ([(user_topic("ann"), {"username": "ann", "total_points": 10})], False)
+    assert not bob.wait(0)
+
+    bus.unsubscribe(ann)
+    assert bus.subscriber_count() == 1
+
+
+def test_a_client_that_falls_behind_is_told_to_resync():
+    bus = EventBus(maxsize=2)
+    subscription = bus.subscribe([LEADERBOARD_TOPIC])
+    for version in range(3):
+        bus.publish(LEADERBOARD_TOPIC, {"type": "reload", "version": version})
+    events, overflowed = subscription.drain()
+    assert overflowed
+    assert len(events) < 3
+    assert subscription.drain() == ([], False)
+
+
+def test_streams_skip_what_the_snapshot_already_has():
+    state = StreamState(username="ann", limit=3)
+    state.version = 5
+    state.total_points = 10
+    update = {"type": "update", "username": "bob", "sustainability_points": 7}
+    frames = state.frames([
+        (LEADERBOARD_TOPIC, dict(update, version=5, rank=1, previous_rank=2)),
+        (LEADERBOARD_TOPIC, dict(update, version=6, rank=9, previous_rank=None)),
+        (LEADERBOARD_TOPIC, dict(update, version=7, rank=2, previous_rank=4)),
+        (user_topic("ann"), {"username": "ann", "total_points": 10}),
+        (user_topic("ann"), {"username": "ann", "total_points": 25}),
+    ])
+    assert [frame.splitlines()[0] for frame in frames] == ["event: leaderboard", "event: points"]
+    assert json.loads(frames[1].split("data: ", 1)[1])["delta"] == 15
+    assert state.frames([(LEADERBOARD_TOPIC, {"type": "reload", "version": 8})]) is None
@@ -0,0 +1,70 @@
+import copy
+import json
+import time
+
+import mongomock
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from factors import DEFAULT_FACTORS, FactorRegistry, FactorSet, FileSource, MongoSource, publish
+from scoring import MODE_IDS, VEHICLE_IDS
+
+
+def factors(version="v1", **changes):
+    doc = copy.deepcopy(DEFAULT_FACTORS)
+    doc.update(changes, version=version)
+    return doc
+
+
+def test_bad_documents_are_rejected():
+    with pytest.raises(ValueError):
+        FactorSet(factors(version=""))
+    with pytest.raises(ValueError):
+        FactorSet(factors(emission={"driving": 180}))
+    with pytest.raises(ValueError):
+        FactorSet(factors(vehicles={"BUS": -1}))
+    with pytest.raises(ValueError):
+        FactorSet(factors(regions={"eu": {"speed": {}}}))
+
+
+def test_regions_override_only_what_they_list():
+    factor_set = FactorSet(factors(regions={"fr": {"vehicles": {"RAIL": 5}, "emission": {"driving": 150}}}))
+    fr, default = factor_set.tables("fr"), factor_set.tables(factor_set.region_of("mars"))
+    assert fr.vehicle[VEHICLE_IDS["RAIL"]] == 5
+    assert fr.vehicle[VEHICLE_IDS["DRIVING"]] == fr.driving == 150
+    assert fr.vehicle[VEHICLE_IDS["BUS"]] == default.vehicle[VEHICLE_IDS["BUS"]] == 80
+    assert fr.points[MODE_IDS["walking"]] == default.points[MODE_IDS["walking"]] == 12
+    assert default.driving == 180
+
+
+def test_registry_swaps_in_new_versions_only(tmp_path):
+    path = tmp_path / "factors.json"
+    path.write_text(json.dumps(factors("v1")))
+    registry = FactorRegistry(FileSource(str(path)), reload_seconds=0)
+    first = registry.current()
+    assert first.version == "v1"
+
+    # Changed numbers under a loaded version are ignored
+    path.write_text(json.dumps(factors("v1", points=dict(DEFAULT_FACTORS["points"], walking=99))))
+    assert registry.reload() is first
+
+    path.write_text(json.dumps(factors("v2")))
+    assert registry.reload().version == "v2"
+    assert first.version == "v1"
+
+
+def test_broken_source_falls_back_to_builtin_factors(tmp_path):
+    registry = FactorRegistry(FileSource(str(tmp_path / "missing.json")))
+    assert registry.current().version == DEFAULT_FACTORS["version"]
+
+
+def test_published_versions_are_immutable():
+    db = mongomock.MongoClient().db
+    publish(db, factors("v1"))
+    time.sleep(0.01)  # published_at is stored to the millisecond
+    publish(db, factors("v2"))
+    with pytest.raises(DuplicateKeyError):
+        publish(db, factors("v1"))
+    source = MongoSource(db)
+    assert FactorSet(source.load()).version == "v2"
+    assert source.get("v1") == FactorSet(factors("v1"))
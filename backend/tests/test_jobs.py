@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue, WorkerPool
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"), lease_seconds=0.3, retry_base_seconds=0.01)
+
+
+def test_expired_lease_is_claimed_again(queue):
+    job_id = queue.enqueue("work", {})
+    assert queue.claim()["attempts"] == 1
+    assert queue.claim() is None
+    time.sleep(0.35)
+    assert queue.claim()["id"] == job_id
+
+
+def test_renewed_lease_is_not_claimed_again(queue):
+    queue.enqueue("work", {})
+    job = queue.claim()
+    for _ in range(3):
+        time.sleep(0.15)
+        assert queue.renew(job)
+        assert queue.claim() is None
+
+
+def test_stale_claim_cannot_finish_a_reclaimed_job(queue):
+    job_id = queue.enqueue("work", {})
+    stale = queue.claim()
+    time.sleep(0.35)
+    current = queue.claim()
+
+    assert not queue.renew(stale)
+    assert not queue.complete(stale, "stale")
+    assert queue.fail(stale, "stale") is None
+    assert queue.get(job_id)["status"] == RUNNING
+
+    assert queue.complete(current, "ok")
+    job = queue.get(job_id)
+    assert (job["status"], job["result"]) == (DONE, "ok")
+
+
+def test_fail_retries_then_gives_up(queue):
+    job_id = queue.enqueue("work", {}, max_attempts=2)
+    assert queue.fail(queue.claim(), "boom") == QUEUED
+    time.sleep(0.02)
+    assert queue.fail(queue.claim(), "boom") == FAILED
+    assert queue.get(job_id)["error"] == "boom"
+
+
+def test_heartbeat_keeps_a_slow_job_leased(queue):
+    release = threading.Event()
+    runs = []
+    finished = []
+
+    def slow(job):
+        runs.append(job["attempts"])
+        release.wait(5)
+        return "ok"
+
+    pool = WorkerPool(queue, {"work": slow}, workers=2, poll_seconds=0.02,
+                      on_finish=finished.append).start()
+    try:
+        job_id = queue.enqueue("work", {})
+        time.sleep(1.0)  # Over three leases
+        release.set()
+        deadline = time.monotonic() + 5
+        while not finished and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        pool.stop()
+    assert runs == [1]
+    assert queue.get(job_id)["status"] == DONE
+
+
+def test_worker_drops_the_outcome_of_a_lost_lease(queue):
+    job_id = queue.enqueue("work", {})
+    stale = queue.claim()
+    time.sleep(0.35)
+    current = queue.claim()
+    finished = []
+    pool = WorkerPool(queue, {"work": lambda job: "stale"}, on_finish=finished.append)
+
+    pool.run_job(stale)
+    assert finished == []
+    assert queue.get(job_id)["status"] == RUNNING
+
+    assert queue.complete(current, "ok")
+    assert queue.get(job_id)["result"] == "ok"
@@ -0,0 +1,149 @@
+import threading
+import time
+
+import mongomock
+
+from leaderboard import Leaderboard
+
+
+def users(*entries):
+    collection = mongomock.MongoClient().db["Users"]
+    collection.insert_many([
+        {"username": name, "sustainability_points": points} for name, points in entries
+    ])
+    return collection
+
+
+class SlowFind:
+    """Wraps a collection so `find` blocks until `release` is set."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def find(self, *args, **kwargs):
+        self.started.set()
+        self.release.wait(5)
+        return self.collection.find(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def test_refresh_picks_up_other_workers_awards():
+    collection = users(("ann", 10), ("bob", 5))
+    board = Leaderboard(collection, refresh_seconds=0.05)
+    assert board.rank_of("bob") == (2, 5)
+
+    # Awarded by another worker; this board never hears about it
+    collection.update_one({"username": "bob"}, {"$set": {"sustainability_points": 20}})
+    assert board.rank_of("bob") == (2, 5)
+    time.sleep(0.06)
+    assert board.rank_of("bob") == (1, 20)
+
+
+def test_unchanged_reload_keeps_the_version():
+    board = Leaderboard(users(("ann", 10)))
+    board.load()
+    version = board.version
+    board.load()
+    assert board.version == version
+
+
+def test_record_is_not_blocked_by_a_reload():
+    collection = users(("ann", 10), ("bob", 5))
+    board = Leaderboard(SlowFind(collection), refresh_seconds=0)
+    board.collection.release.set()
+    board.load()
+
+    board.collection.release.clear()
+    board.collection.started.clear()
+    reader = threading.Thread(target=board.page)
+    reader.start()
+    try:
+        assert board.collection.started.wait(5)
+        # The reload is stuck in `find`; the board lock must still be free
+        done = threading.Event()
+        writer = threading.Thread(target=lambda: (board.record("cid", 7), done.set()))
+        writer.start()
+        assert done.wait(1)
+    finally:
+        board.collection.release.set()
+        reader.join()
+        writer.join()
+
+
+def test_on_change_runs_outside_the_board_lock():
+    lock_free = []
+
+    def probe():
+        acquired = board._lock.acquire(timeout=1)
+        lock_free.append(acquired)
+        if acquired:
+            board._lock.release()
+
+    def on_change(event):
+        # From another thread, since the board lock is reentrant
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+
+    board = Leaderboard(users(("ann", 10)), on_change=on_change)
+    board.load()
+    board.record("bob", 3)
+    assert lock_free == [True, True]
+
+
+def test_changes_are_published_in_version_order():
+    events = []
+    board = Leaderboard(users(("ann", 10)), on_change=events.append)
+    board.load()
+    threads = [
+        threading.Thread(target=board.record, args=(f"user{i}", i)) for i in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    versions = [event["version"] for event in events]
+    assert versions == sorted(versions) and len(versions) == 21
+
+
+def test_record_moves_users_and_breaks_ties_by_name():
+    board = Leaderboard(users(("ann", 10), ("bob", 5), ("cid", 1)))
+    board.load()
+    board.record("cid", 10)
+    entries, _, _ = board.page(0, 3)
+    assert [(e["rank"], e["username"]) for e in entries] == [(1, "ann"), (1, "cid"), (3, "bob")]
+    assert board.rank_of("bob") == (3, 5)
+
+
+def test_users_below_a_full_board_are_ranked_from_mongo():
+    collection = users(("ann", 30), ("bob", 20), ("cid", 10))
+    board = Leaderboard(collection, capacity=2)
+    board.load()
+    assert len(board) == 2
+    assert board.rank_of("cid") == (3, 10)
+    assert board.rank_of("nobody") is None
+
+
+def test_losing_points_on_a_full_board_rebuilds_it():
+    collection = users(("ann", 30), ("bob", 20), ("cid", 10))
+    board = Leaderboard(collection, capacity=2)
+    board.load()
+    collection.update_one({"username": "bob"}, {"$set": {"sustainability_points": 5}})
+    board.record("bob", 5)
+    # cid now outranks bob, which only a reload can find out
+    entries, _, _ = board.page(0, 2)
+    assert [e["username"] for e in entries] == ["ann", "cid"]
+
+
+def test_page_etag_follows_the_content():
+    board = Leaderboard(users(("ann", 10), ("bob", 5)))
+    _, version, etag = board.page(0, 1)
+    board.record("bob", 6)
+    _, new_version, same_etag = board.page(0, 1)
+    assert new_version > version and same_etag == etag
+    board.record("bob", 11)
+    assert board.page(0, 1)[2] != etag
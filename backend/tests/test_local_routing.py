@@ -0,0 +1,74 @@
+import os
+import time
+
+import pytest
+
+from cache import TTLCache, make_key
+from local_routing import FallbackDirections, LocalRouter, is_local, load_road_graph, way_directions
+from route_fetch import LOCAL_DIRECTIONS_CACHE_TTL, fetch_legs
+
+# Three nodes ~1.1 km apart on a line: a one-way residential street from 1
+# to 2, then a footway from 2 to 3
+OSM = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="52.5000" lon="13.4000"/>
+  <node id="2" lat="52.5100" lon="13.4000"/>
+  <node id="3" lat="52.5200" lon="13.4000"/>
+  <way id="10"><nd ref="1"/><nd ref="2"/>
+    <tag k="highway" v="residential"/><tag k="oneway" v="yes"/></way>
+  <way id="11"><nd ref="2"/><nd ref="3"/><tag k="highway" v="footway"/></way>
+</osm>
+"""
+
+
+@pytest.fixture
+def router(tmp_path):
+    path = tmp_path / "city.osm"
+    path.write_text(OSM)
+    graph = load_road_graph(str(path))
+    assert os.path.exists(f"{path}.npz")
+    return LocalRouter(graph)
+
+
+def test_walking_follows_the_graph(router):
+    leg = router.route("52.5000,13.4000", "52.5200,13.4000", "walking")
+    assert leg["distance_km"] == pytest.approx(2.22, abs=0.01)
+    assert leg["duration_min"] == pytest.approx(2.22 / 5 * 60, rel=0.01)
+
+
+def test_one_way_streets_are_one_way_only_for_vehicles():
+    street = {"highway": "residential", "oneway": "yes"}
+    assert way_directions(street, "driving") == (True, False)
+    assert way_directions(street, "walking") == (True, True)
+    assert way_directions({"highway": "footway"}, "driving") is None
+
+
+def test_directions_are_marked_local(router):
+    directions = router.directions("52.5000,13.4000", "52.5100,13.4000", mode="walking")
+    assert is_local(directions)
+    assert router.directions("nowhere", "52.5100,13.4000", mode="walking") == []
+
+
+def test_local_legs_are_cached_briefly(router):
+    cache = TTLCache("directions", ttl=3600)
+    lookup = ("52.5000,13.4000", "52.5100,13.4000", "walking")
+    fetch_legs(router.directions, [lookup], cache=cache)
+    expires_at, _ = cache._entries[make_key("directions", *lookup)]
+    assert expires_at - time.monotonic() <= LOCAL_DIRECTIONS_CACHE_TTL < 3600
+
+
+def test_fallback_takes_over_while_the_primary_fails():
+    calls = []
+
+    def primary(*args, **kwargs):
+        calls.append("primary")
+        raise ConnectionError("down")
+
+    def fallback(*args, **kwargs):
+        calls.append("fallback")
+        return "local"
+
+    directions = FallbackDirections(primary, fallback, cooldown=60)
+    assert directions("A", "B") == "local"
+    assert directions("A", "B") == "local"
+    assert calls == ["primary", "fallback", "fallback"]
@@ -0,0 +1,78 @@
+import os
+import time
+from types import SimpleNamespace
+
+import newapp
+from map_cache import MapImageCache, map_key
+
+
+class Session:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append(params)
+        return SimpleNamespace(status_code=self.status_code, content=b"png")
+
+
+def cache(tmp_path, session=None, **kwargs):
+    return MapImageCache(str(tmp_path), "key", session or Session(), "secret", **kwargs)
+
+
+def test_signature_is_bound_to_the_key(tmp_path):
+    images = cache(tmp_path)
+    key = map_key("A", "B")
+    assert images.verify(key, images.signature(key))
+    assert not images.verify(map_key("A", "C"), images.signature(key))
+    assert not images.verify(key, None)
+    assert not MapImageCache(str(tmp_path), "key", None, "other").verify(key, images.signature(key))
+
+
+def test_fetch_downloads_once(tmp_path):
+    session = Session()
+    images = cache(tmp_path, session)
+    assert images.fetch("A", "B") == (map_key("A", "B"), b"png")
+    assert images.fetch("A", "B") == (map_key("A", "B"), b"png")
+    assert len(session.requests) == 1
+
+
+def test_failed_download_is_not_cached(tmp_path):
+    images = cache(tmp_path, Session(status_code=500))
+    assert images.fetch("A", "B") == (map_key("A", "B"), None)
+    assert images.get(map_key("A", "B")) is None
+
+
+def test_prune_evicts_least_recently_used_first(tmp_path):
+    images = cache(tmp_path)
+    keys = [map_key("A", str(i)) for i in range(3)]
+    for age, key in zip((30, 20, 10), keys):
+        images.put(key, b"12345")
+        path = images.path_for(key)
+        os.utime(path, (time.time() - age, time.time() - age))
+    images.get(keys[0])  # Used again: now the newest
+
+    images.max_bytes = 10
+    assert images.prune() == 1
+    assert [images.get(key) is not None for key in keys] == [True, False, True]
+
+
+def test_prune_deletes_expired_images(tmp_path):
+    images = cache(tmp_path, max_age_seconds=60)
+    images.put(map_key("A", "B"), b"png")
+    old = time.time() - 120
+    os.utime(images.path_for(map_key("A", "B")), (old, old))
+    assert images.prune() == 1
+
+
+def test_endpoint_serves_only_signed_routes(tmp_path, monkeypatch):
+    images = cache(tmp_path)
+    monkeypatch.setattr(newapp, "map_image_cache", images)
+    client = newapp.app.test_client()
+    _, params = newapp.map_image_params("A", "B")
+
+    assert client.get("/map_image", query_string=dict(params, sig="forged")).status_code == 403
+    response = client.get("/map_image", query_string=params)
+    assert (response.status_code, response.data) == (200, b"png")
+    etag = response.headers["ETag"]
+    assert client.get("/map_image", query_string=params, headers={"If-None-Match": etag}).status_code == 304
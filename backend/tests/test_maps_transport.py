@@ -0,0 +1,60 @@
+import time
+
+import requests
+from requests.adapters import BaseAdapter
+
+from maps_transport import MapsSession, RateLimiter
+
+
+class ScriptedAdapter(BaseAdapter):
+    """Answers requests with the next status code in `statuses`."""
+
+    def __init__(self, statuses):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response.request = request
+        response._content = b"{}"
+        return response
+
+    def close(self):
+        pass
+
+
+def session(statuses, **kwargs):
+    maps = MapsSession(qps=0, backoff_base=0.001, backoff_max=0.001, **kwargs)
+    adapter = ScriptedAdapter(statuses)
+    maps.mount("https://", adapter)
+    return maps, adapter
+
+
+def test_rate_limiter_paces_after_the_burst():
+    limiter = RateLimiter(rate=50, burst=2)
+    started = time.monotonic()
+    for _ in range(7):
+        limiter.acquire()
+    # Two free tokens, then five at 50/s
+    assert 0.08 <= time.monotonic() - started < 0.3
+
+
+def test_retryable_statuses_are_retried():
+    maps, adapter = session([503, 429, 200], max_retries=3)
+    assert maps.get("https://maps.example/api").status_code == 200
+    assert adapter.calls == 3
+
+
+def test_last_attempt_returns_the_error_response():
+    maps, adapter = session([503, 503], max_retries=1)
+    assert maps.get("https://maps.example/api").status_code == 503
+    assert adapter.calls == 2
+
+
+def test_client_errors_are_not_retried():
+    maps, adapter = session([400], max_retries=3)
+    assert maps.get("https://maps.example/api").status_code == 400
+    assert adapter.calls == 1
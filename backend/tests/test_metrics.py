@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import Flask
+
+import metrics
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    metrics.init_app(app)
+    executor = ThreadPoolExecutor(1)
+
+    def lookup():
+        with metrics.timed("directions", mode="walking"):
+            return "ok"
+
+    @app.route("/route")
+    def route():
+        # Run on another thread, as route_fetch does
+        return executor.submit(metrics.propagate(lookup)).result()
+
+    yield app.test_client()
+    executor.shutdown()
+
+
+def test_server_timing_is_opt_in(client):
+    assert "Server-Timing" not in client.get("/route").headers
+    timing = client.get("/route", headers={metrics.TIMING_REQUEST_HEADER: "1"}).headers["Server-Timing"]
+    names = [entry.split(";")[0] for entry in timing.split(", ")]
+    assert names == ["directions-walking", "total"]
+
+
+def test_breakdown_does_not_leak_into_the_pool_thread():
+    token = metrics.start_breakdown()
+    try:
+        with ThreadPoolExecutor(1) as executor:
+            assert executor.submit(metrics.propagate(metrics.current_breakdown)).result() == []
+            assert executor.submit(metrics.current_breakdown).result() is None
+    finally:
+        metrics.end_breakdown(token)
+
+
+def test_metrics_endpoint_reports_routes_and_calls(client):
+    client.get("/route")
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'ecotrail_http_request_duration_seconds_count{method="GET",route="/route",status="200"}' in body
+    assert 'ecotrail_external_call_duration_seconds_count{call="directions",mode="walking"}' in body
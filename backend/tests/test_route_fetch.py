@@ -0,0 +1,62 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+from route_fetch import fetch_legs, fetch_modes, run_with_deadlines
+
+
+def directions_for(km):
+    return [{"legs": [{"distance": {"value": km * 1000}, "duration": {"value": 600}, "steps": []}]}]
+
+
+def test_modes_are_fetched_concurrently():
+    calls = []
+    lock = threading.Lock()
+
+    def directions(origin, destination, mode, **kwargs):
+        with lock:
+            calls.append(mode)
+        time.sleep(0.1)
+        if mode == "transit":
+            return []
+        if mode == "bicycling":
+            raise RuntimeError("quota")
+        return directions_for(3)
+
+    started = time.monotonic()
+    routes, no_route = fetch_modes(
+        directions, "A", "B", ["driving", "walking", "driving", "transit", "bicycling"], timeout=5
+    )
+    assert time.monotonic() - started < 0.25
+    assert sorted(calls) == ["bicycling", "driving", "transit", "walking"]
+    assert routes.modes == ["driving", "walking"]
+    assert no_route == {"transit"}
+
+
+def test_cached_legs_skip_the_api():
+    cache = TTLCache("directions")
+    calls = []
+
+    def directions(origin, destination, mode, **kwargs):
+        calls.append(mode)
+        return directions_for(3)
+
+    fetch_legs(directions, [("A", "B", "driving")], cache=cache)
+    legs, _, _ = fetch_legs(directions, [("A", "B", "driving")], cache=cache)
+    assert calls == ["driving"]
+    assert legs[("A", "B", "driving")].distance_km == 3
+
+
+def test_each_call_gets_the_timeout_once_it_starts():
+    executor = ThreadPoolExecutor(1)
+    calls = {
+        "a": lambda: time.sleep(0.06) or "a",
+        "b": lambda: time.sleep(0.06) or "b",
+        "slow": lambda: time.sleep(0.3) or "slow",
+    }
+    futures, timed_out = run_with_deadlines(executor, calls, 0.1)
+    # Queued behind "a", "b" still had its own 0.1 s once it started
+    assert {key: future.result() for key, future in futures.items()} == {"a": "a", "b": "b"}
+    assert timed_out == {"slow"}
+    executor.shutdown()
@@ -0,0 +1,50 @@
+import time
+
+import pytest
+
+from route_grid import NearbyRoutes, RouteGrid
+
+ORIGIN = (52.5200, 13.4050)
+DESTINATION = (52.5000, 13.3800)
+
+
+def shifted(point, metres):
+    """`point` moved `metres` north."""
+    return point[0] + metres / 111320.0, point[1]
+
+
+def test_nearby_trip_reuses_the_route():
+    grid = RouteGrid(cell_m=500, max_error_m=200)
+    grid.add(ORIGIN, DESTINATION, "driving", "leg")
+    assert grid.lookup(shifted(ORIGIN, 50), shifted(DESTINATION, 50), "driving") == "leg"
+    assert grid.lookup(ORIGIN, DESTINATION, "walking") is None
+    stats = grid.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    assert stats["max_error_bound_m"] == pytest.approx(100, abs=1)
+
+
+def test_reuse_stays_within_the_error_bound():
+    grid = RouteGrid(cell_m=2000, max_error_m=200)
+    grid.add(ORIGIN, DESTINATION, "driving", "leg")
+    # Same cells, but 150 m + 150 m off
+    assert grid.lookup(shifted(ORIGIN, 150), shifted(DESTINATION, 150), "driving") is None
+
+
+def test_routes_expire_and_the_oldest_is_evicted():
+    grid = RouteGrid(capacity=2, ttl=0.05)
+    grid.add(ORIGIN, DESTINATION, "driving", "first")
+    grid.add(ORIGIN, DESTINATION, "walking", "second")
+    grid.add(ORIGIN, DESTINATION, "bicycling", "third")
+    assert grid.lookup(ORIGIN, DESTINATION, "driving") is None
+    assert grid.stats()["evictions"] == 1
+    assert grid.lookup(ORIGIN, DESTINATION, "bicycling") == "third"
+    time.sleep(0.06)
+    assert grid.lookup(ORIGIN, DESTINATION, "bicycling") is None
+
+
+def test_nearby_routes_only_use_known_coordinates():
+    points = {"a": ORIGIN, "b": DESTINATION}
+    nearby = NearbyRoutes(RouteGrid(), points.get)
+    nearby.add("a", "b", "driving", "leg")
+    assert nearby.lookup("a", "b", "driving") == "leg"
+    assert nearby.lookup("a", "unknown", "driving") is None
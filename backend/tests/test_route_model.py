@@ -0,0 +1,79 @@
+import pytest
+
+import newapp
+from cache import MISSING
+from factors import DEFAULT_FACTORS, FactorSet
+from route_model import DOCUMENT_VERSION, RouteOption, RouteSet
+
+
+def step(km, travel_mode, vehicle=None):
+    step = {"distance": {"value": km * 1000}, "travel_mode": travel_mode}
+    if vehicle is not None:
+        step["transit_details"] = {"line": {"vehicle": {"type": vehicle}}}
+    return step
+
+
+def route(minutes, *steps):
+    meters = sum(step["distance"]["value"] for step in steps)
+    return {"legs": [{"distance": {"value": meters}, "duration": {"value": minutes * 60},
+                      "steps": list(steps)}]}
+
+
+# A bus route and a faster, cleaner subway alternative
+TRANSIT = [
+    route(30, step(0.5, "WALKING"), step(5, "TRANSIT", "BUS"), step(0.5, "WALKING")),
+    route(25, step(1, "WALKING"), step(6, "TRANSIT", "SUBWAY")),
+]
+DRIVING = [route(15, step(10, "DRIVING"))]
+
+
+@pytest.fixture
+def routes():
+    return RouteSet([
+        RouteOption.from_directions(DRIVING, "driving"),
+        RouteOption.from_directions(TRANSIT, "transit"),
+    ])
+
+
+def test_transit_steps_count_toward_their_vehicle():
+    option = RouteOption.from_directions(TRANSIT, "transit")
+    assert (option.distance_km, option.duration_min) == (6, 30)
+    assert option.alternatives() == [
+        {"distance": 6, "duration": 30, "segments": {"WALKING": 1.0, "BUS": 5.0}},
+        {"distance": 7, "duration": 25, "segments": {"WALKING": 1.0, "SUBWAY": 6.0}},
+    ]
+
+
+def test_legs_without_steps_count_toward_the_mode():
+    option = RouteOption.from_directions(
+        [{"legs": [{"distance": {"value": 4000}, "duration": {"value": 600}}]}], "bicycling")
+    assert option.alternatives()[0]["segments"] == {"BICYCLING": 4.0}
+
+
+def test_alternatives_are_scored_per_segment(routes):
+    route_details, _, _, _ = newapp.score_routes(routes, FactorSet(DEFAULT_FACTORS))
+    transit = route_details[1]
+    vehicles = DEFAULT_FACTORS["vehicles"]
+    assert transit["carbon_footprint"] == pytest.approx(5 * vehicles["BUS"] / 1000)
+    assert [alternative["carbon_footprint"] for alternative in transit["alternatives"]] == [
+        pytest.approx(5 * vehicles["BUS"] / 1000),
+        pytest.approx(6 * vehicles["SUBWAY"] / 1000),
+    ]
+
+
+def test_pareto_routes_drop_dominated_alternatives(routes):
+    _, _, _, pareto_routes = newapp.score_routes(routes, FactorSet(DEFAULT_FACTORS))
+    assert [(route["mode"], route["alternative"]) for route in pareto_routes] == [
+        ("driving", 0), ("transit", 1)
+    ]
+
+
+def test_documents_round_trip_and_older_layouts_miss():
+    option = RouteOption.from_directions(TRANSIT, "transit")
+    doc = option.to_document()
+    restored = RouteOption.from_document(doc)
+    assert restored.mode == option.mode
+    assert restored.alternatives() == option.alternatives()
+
+    assert RouteOption.from_document(dict(doc, v=DOCUMENT_VERSION + 1)) is MISSING
+    assert RouteOption.from_document({"distance": 6}) is MISSING
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import app
+from cache import TTLCache
+from route_optimizer import optimize_route
+
+
+def line_matrix(positions):
+    """distance_matrix stand-in for points on a line, `positions` km apart; counts calls."""
+    calls = []
+
+    def matrix(origins, destinations, mode="driving"):
+        calls.append((len(origins), len(destinations)))
+        return {"rows": [
+            {"elements": [
+                {
+                    "status": "OK",
+                    "distance": {"value": abs(positions[a] - positions[b]) * 1000},
+                    "duration": {"value": abs(positions[a] - positions[b]) * 60}
+                }
+                for b in destinations
+            ]}
+            for a in origins
+        ]}
+
+    return matrix, calls
+
+
+def test_exact_order_visits_stops_along_the_way():
+    positions = {"start": 0, "a": 3, "b": 1, "c": 2, "end": 4}
+    matrix, _ = line_matrix(positions)
+    plan = optimize_route(matrix, "start", "end", ["a", "b", "c"])
+    assert plan["optimal"]
+    assert plan["order"] == ["start", "b", "c", "a", "end"]
+
+
+def test_heuristic_order_is_as_good_as_visiting_in_line():
+    names = [f"p{i}" for i in range(14)]
+    positions = {name: (i * 5) % 14 for i, name in enumerate(names)}
+    positions.update(start=-1, end=15)
+    matrix, _ = line_matrix(positions)
+    plan = optimize_route(matrix, "start", "end", names, objective="distance")
+    assert not plan["optimal"]
+    assert [positions[point] for point in plan["order"]] == list(range(-1, 14)) + [15]
+
+
+def test_cached_pairs_are_not_fetched_again():
+    positions = {"start": 0, "a": 1, "end": 2}
+    matrix, calls = line_matrix(positions)
+    cache = TTLCache("matrix")
+    optimize_route(matrix, "start", "end", ["a"], cache=cache)
+    optimize_route(matrix, "start", "end", ["a"], cache=cache)
+    assert len(calls) == 1
+
+
+def test_cli_optimization_visits_the_destination_waypoints(monkeypatch):
+    seen = {}
+
+    def fake_optimize(matrix_fn, start, end, waypoints, **kwargs):
+        seen.update(start=start, end=end, waypoints=waypoints)
+        return {"order": [start, *waypoints, end]}
+
+    monkeypatch.setattr(app, "optimize_route", fake_optimize)
+    monkeypatch.setattr(app, "gmaps", SimpleNamespace(distance_matrix=None))
+    places = ["home", "bakery", "school", "office"]
+    app.get_route_optimization(places, places)
+    assert seen == {"start": "home", "end": "office", "waypoints": ["bakery", "school"]}
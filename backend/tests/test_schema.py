@@ -0,0 +1,41 @@
+import mongomock
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import schema
+
+
+class Database:
+    """Records create_collection calls; mongomock rejects time-series options."""
+
+    def __init__(self, existing):
+        self.existing = existing
+        self.created = []
+
+    def list_collection_names(self):
+        return list(self.existing)
+
+    def create_collection(self, name, **options):
+        self.created.append((name, options))
+
+
+def test_only_missing_collections_are_created():
+    db = Database(existing=[])
+    schema.ensure_collections(db)
+    assert db.created == [(schema.TRIPS_COLLECTION, {"timeseries": schema.TRIPS_TIMESERIES})]
+
+    db = Database(existing=[schema.TRIPS_COLLECTION])
+    schema.ensure_collections(db)
+    assert db.created == []
+
+
+def test_indexes_are_created_once_and_usernames_are_unique(monkeypatch):
+    monkeypatch.setattr(schema, "COLLECTIONS", {})
+    db = mongomock.MongoClient().db
+    schema.ensure_indexes(db)
+    schema.ensure_indexes(db)
+
+    assert {"username_unique", "sustainability_points_desc"} <= set(db["Users"].index_information())
+    db["Users"].insert_one({"username": "ann"})
+    with pytest.raises(DuplicateKeyError):
+        db["Users"].insert_one({"username": "ann"})
@@ -0,0 +1,35 @@
+import pytest
+
+import newapp
+from route_model import RouteOption, RouteSet
+
+
+def directions(km, minutes, travel_mode):
+    step = {"distance": {"value": km * 1000}, "travel_mode": travel_mode}
+    return [{"legs": [{"distance": {"value": km * 1000}, "duration": {"value": minutes * 60},
+                       "steps": [step]}]}]
+
+
+@pytest.fixture
+def routes():
+    return RouteSet([
+        RouteOption.from_directions(directions(10, 15, "DRIVING"), "driving"),
+        RouteOption.from_directions(directions(8, 100, "WALKING"), "walking"),
+    ])
+
+
+def test_carbon_footprint_matches_score_routes(routes):
+    footprints = newapp.calculate_carbon_footprint(routes)
+    route_details = newapp.score_routes(routes)[0]
+    assert footprints == {
+        detail["mode"]: pytest.approx(detail["carbon_footprint"] * 1000) for detail in route_details
+    }
+    assert footprints["driving"] > footprints["walking"] == 0
+
+
+def test_eco_route_respects_the_time_limit(routes):
+    footprints = newapp.calculate_carbon_footprint(routes)
+    assert newapp.suggest_eco_friendly_route(footprints, routes)[0] == "walking"
+    mode, option = newapp.suggest_eco_friendly_route(footprints, routes, max_duration=30)
+    assert (mode, option.distance_km) == ("driving", 10)
+    assert newapp.suggest_eco_friendly_route(footprints, routes, max_duration=5) == (None, None)
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import newapp
+from singleflight import SingleFlight
+
+
+def test_threaded_callers_share_one_call():
+    flight = SingleFlight("test")
+    calls = []
+
+    def fetch(value):
+        calls.append(value)
+        time.sleep(0.1)
+        return value * 2
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: flight.do("k", fetch, 21), range(4)))
+    assert results == [42] * 4
+    assert calls == [21]
+    assert flight.in_flight() == 0
+
+
+def test_timed_out_follower_leaves_the_call_running():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "ok"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async("k", fetch))
+        await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(flight.do_async("k", fetch), 0.01)
+        except asyncio.TimeoutError:
+            pass
+        return await leader
+
+    assert asyncio.run(main()) == "ok"
+    assert calls == [1]
+
+
+def test_call_is_cancelled_when_the_last_waiter_gives_up():
+    flight = SingleFlight("test")
+    cancelled = []
+
+    async def fetch():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        for _ in range(2):
+            try:
+                await asyncio.wait_for(flight.do_async("k", fetch), 0.01)
+            except asyncio.TimeoutError:
+                pass
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert cancelled == [True, True]
+    assert flight.in_flight() == 0
+
+
+def test_awaiter_joins_a_threaded_call():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append("thread")
+        started.set()
+        time.sleep(0.1)
+        return "from thread"
+
+    async def fetch_async():
+        calls.append("loop")
+        return "from loop"
+
+    async def main():
+        thread = asyncio.get_running_loop().run_in_executor(None, flight.do, "k", fetch)
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        joined = await flight.do_async("k", fetch_async)
+        return joined, await thread
+
+    assert asyncio.run(main()) == ("from thread", "from thread")
+    assert calls == ["thread"]
+
+
+def test_thread_joins_an_awaited_call():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fetch_async():
+        calls.append("loop")
+        await asyncio.sleep(0.1)
+        return "from loop"
+
+    def fetch():
+        calls.append("thread")
+        return "from thread"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async("k", fetch_async))
+        await asyncio.sleep(0)
+        joined = await asyncio.get_running_loop().run_in_executor(None, flight.do, "k", fetch)
+        return await leader, joined
+
+    assert asyncio.run(main()) == ("from loop", "from loop")
+    assert calls == ["loop"]
+    assert flight.in_flight() == 0
+
+
+def test_flask_and_asgi_directions_share_a_key(monkeypatch):
+    keys = []
+    monkeypatch.setattr(newapp, "directions", lambda *args, **kwargs: [])
+    monkeypatch.setattr(newapp.directions_flight, "do", lambda key, fn, *args, **kwargs: keys.append(key))
+
+    # As route_fetch.fetch_legs calls it; asgi_app keys do_async with directions_key
+    newapp.coalesced_directions(origin="A", destination="B", mode="walking", alternatives=True)
+    assert keys == [newapp.directions_key("A", "B", "walking")]
@@ -0,0 +1,33 @@
+from datetime import datetime, timezone
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from benchmarks.standins import memory_database
+from trips import TripStore, trip_document
+
+
+def trip():
+    detail = {"mode": "walking", "distance": 2.0, "duration": 30, "carbon_footprint": 0,
+              "points_earned": 10}
+    return trip_document("ann", "A", "B", [detail], False, 0.17,
+                         ts=datetime(2024, 5, 8, 12, tzinfo=timezone.utc))
+
+
+def test_rollups_on_the_stand_in_match_mongo():
+    store = TripStore(memory_database())
+    trips = [trip(), trip()]
+    store.record(trips)
+    store.record(trips, resume=True)
+    assert store.trips.count_documents({}) == 2
+    bucket = store.stats("ann", "week")[0]
+    assert (bucket["trips"], bucket["points"]) == (2, 20)
+    assert "trip_ids" not in bucket
+
+
+def test_stand_in_rejects_duplicate_ids():
+    users = memory_database()["Users"]
+    users.insert_one({"_id": 1, "username": "ann"})
+    with pytest.raises(DuplicateKeyError):
+        users.insert_one({"_id": 1, "username": "bob"})
+    assert users.find_one({"username": {"$ne": "bob"}})["username"] == "ann"
@@ -0,0 +1,109 @@
+import json
+from datetime import datetime, timezone
+
+import mongomock
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from trips import ROLLUPS_COLLECTION, TripStore, from_payload, to_json_line, to_payload, trip_document
+
+TS = datetime(2024, 5, 8, 12, tzinfo=timezone.utc)
+
+
+class Rollups:
+    """Rollups collection with an unordered bulk_write mongomock can run.
+
+    Applies each UpdateOne itself (mongomock's bulk_write doesn't accept
+    the operations of current pymongo releases); `fail_next` makes the
+    next call fail before writing anything.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.fail_next = False
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, requests, ordered=True):
+        if self.fail_next:
+            self.fail_next = False
+            raise PyMongoError("connection reset")
+        errors = []
+        for index, request in enumerate(requests):
+            try:
+                self.collection.update_one(request._filter, request._doc, upsert=request._upsert)
+            except DuplicateKeyError:
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": 0})
+
+
+@pytest.fixture
+def store():
+    db = mongomock.MongoClient().db
+    store = TripStore(db)
+    store.rollups = Rollups(db[ROLLUPS_COLLECTION])
+    return store
+
+
+def trip(username="ann", km=2.0, trip_id=None):
+    detail = {"mode": "walking", "distance": km, "duration": 30, "carbon_footprint": 0,
+              "points_earned": 10}
+    return trip_document(username, "A", "B", [detail], False, 0.17, trip_id=trip_id, ts=TS)
+
+
+def week(store, username="ann"):
+    return store.stats(username, "week")[0]
+
+
+def test_trips_roll_up_into_day_and_week_buckets(store):
+    store.record([trip(), trip(km=3.0)])
+    bucket = week(store)
+    assert bucket["trips"] == 2
+    assert bucket["points"] == 20
+    assert bucket["modes"]["walking"]["km"] == 5.0
+    assert "trip_ids" not in bucket
+    assert store.stats("ann", "day")[0]["trips"] == 2
+
+
+def test_resumed_record_counts_each_trip_once(store):
+    trips = [trip(), trip()]
+    store.record(trips)
+    store.record(trips, resume=True)
+    assert store.trips.count_documents({}) == 2
+    assert week(store)["trips"] == 2
+
+
+def test_resume_applies_rollups_a_failed_attempt_missed(store):
+    trips = [trip(), trip()]
+    store.rollups.fail_next = True
+    with pytest.raises(PyMongoError):
+        store.record(trips)
+    assert store.trips.count_documents({}) == 2
+    assert store.stats("ann", "week") == []
+
+    store.record(trips, resume=True)
+    assert week(store)["trips"] == 2
+    store.record(trips, resume=True)
+    assert week(store)["trips"] == 2
+
+
+def test_export_streams_a_users_trips_oldest_first(store):
+    late = dict(trip(trip_id="late"), ts=datetime(2024, 5, 9, tzinfo=timezone.utc))
+    early = dict(trip(trip_id="early"), ts=datetime(2024, 5, 7, tzinfo=timezone.utc))
+    store.record([late, early, trip(username="bob")])
+
+    lines = [to_json_line(doc) for doc in store.export("ann")]
+    assert [json.loads(line)["trip_id"] for line in lines] == ["early", "late"]
+    assert json.loads(lines[0])["username"] == "ann"
+    assert json.loads(lines[0])["ts"] == "2024-05-07T00:00:00+00:00"
+
+    since = datetime(2024, 5, 8, tzinfo=timezone.utc)
+    assert [doc["trip_id"] for doc in store.export("ann", since=since)] == ["late"]
+
+
+def test_job_payload_round_trips():
+    original = trip()
+    payload = json.loads(json.dumps(to_payload(original)))
+    assert from_payload(payload) == original
@@ -0,0 +1,62 @@
+import mongomock
+import pytest
+from pymongo import ReturnDocument
+
+import user_points
+from user_points import award_points
+
+
+class Users:
+    """mongomock collection whose find_one_and_update returns the updated document.
+
+    mongomock looks the document up again with the original filter, which
+    an award's `trip_ids` condition no longer matches.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def find_one_and_update(self, filter, update, projection=None, return_document=ReturnDocument.BEFORE):
+        assert return_document == ReturnDocument.AFTER
+        found = self.collection.find_one(filter, {"_id": 1})
+        if found is None:
+            return None
+        self.collection.update_one({"_id": found["_id"]}, update)
+        return self.collection.find_one({"_id": found["_id"]}, projection)
+
+
+@pytest.fixture
+def users():
+    collection = mongomock.MongoClient().db["Users"]
+    collection.insert_one({"username": "ann", "password": "x", "sustainability_points": 0})
+    return Users(collection)
+
+
+def test_award_adds_points_and_trip_counters(users):
+    user, duplicate = award_points(users, "ann", {"walking": 30, "bicycling": 20})
+    assert not duplicate
+    assert user == {"username": "ann", "sustainability_points": 50, "walking_trips": 1, "bicycling_trips": 1}
+
+
+def test_retried_trip_is_awarded_once(users):
+    first, duplicate = award_points(users, "ann", {"walking": 30}, trip_id="t1")
+    assert not duplicate
+    again, duplicate = award_points(users, "ann", {"walking": 30}, trip_id="t1")
+    assert duplicate
+    assert again == first
+    assert "trip_ids" not in again
+
+
+def test_missing_user_is_not_a_duplicate(users):
+    assert award_points(users, "nobody", {"walking": 30}, trip_id="t1") == (None, False)
+    assert users.count_documents({}) == 1
+
+
+def test_trip_id_history_is_bounded(users, monkeypatch):
+    monkeypatch.setattr(user_points, "TRIP_ID_HISTORY", 2)
+    for trip_id in ("t1", "t2", "t3"):
+        award_points(users, "ann", {"walking": 1}, trip_id=trip_id)
+    assert users.find_one({"username": "ann"})["trip_ids"] == ["t2", "t3"]
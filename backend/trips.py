@@ -0,0 +1,227 @@
+"""Append-only trip history with incrementally maintained rollups.
+
+Every scored trip is stored once in the `Trips` time-series collection as a
+compact document (no raw directions payloads):
+
+    {"_id": <ObjectId>, "ts": <datetime>, "meta": {"user": <username>}, "trip_id": ...,
+     "origin": ..., "destination": ..., "eco_mode": ..., "points": <int>,
+     "factors": <factor set version>, "region": <factor region or None>,
+     "legs": [{"mode", "km", "min", "co2_g", "co2_saved_g", "points",
+               "segments": {<vehicle type>: <km>}}]}
+
+`co2_saved_g` is the CO₂ avoided compared with driving the same distance.
+`factors`, `region` and the scored route's `segments` are what
+recompute.py needs to score the trip again with other factors.
+The `_id` is assigned when the document is built, so a retried write can
+tell which trips it already stored. The same write path `$inc`s one daily
+and one weekly bucket per user in `TripRollups`, so per-week totals never
+need the raw trips. Each bucket lists the `_id`s it counts in `trip_ids`,
+so a retried rollup write adds every trip at most once.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY = 11000
+
+TRIPS_COLLECTION = "Trips"
+ROLLUPS_COLLECTION = "TripRollups"
+TRIPS_TIMESERIES = {"timeField": "ts", "metaField": "meta", "granularity": "hours"}
+EXPORT_BATCH_SIZE = 500
+# Bucket fields /trip_stats leaves out (recompute_run is recompute.py's marker)
+ROLLUP_STATS_PROJECTION = {"_id": 0, "user": 0, "recompute_run": 0, "trip_ids": 0}
+
+
+def trip_document(username, origin, destination, route_details, eco_mode,
+                  driving_factor, trip_id=None, ts=None, factors=None, region=None):
+    """Compact trip document from calculate_route_points' route_details.
+
+    `factors` is the version of the factor set the trip was scored with.
+    """
+    legs = []
+    for detail in route_details:
+        co2_g = detail["carbon_footprint"] * 1000
+        alternatives = detail.get("alternatives")
+        legs.append({
+            "mode": detail["mode"],
+            # Enough digits that scoring the stored km again gives the same points
+            "km": round(detail["distance"], 6),
+            "min": round(detail["duration"], 1),
+            "co2_g": round(co2_g, 1),
+            "co2_saved_g": round(max(detail["distance"] * driving_factor - co2_g, 0), 1),
+            "points": detail["points_earned"],
+            "segments": alternatives[0]["segments"] if alternatives else None
+        })
+    return {
+        "_id": ObjectId(),
+        "ts": ts or datetime.now(timezone.utc),
+        "meta": {"user": username},
+        "trip_id": trip_id,
+        "origin": origin,
+        "destination": destination,
+        "eco_mode": eco_mode,
+        "points": sum(leg["points"] for leg in legs),
+        "factors": factors,
+        "region": region,
+        "legs": legs
+    }
+
+
+def bucket_start(ts, period):
+    """Start of the UTC day or ISO week (Monday) containing `ts`."""
+    day = datetime(ts.year, ts.month, ts.day, tzinfo=timezone.utc)
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def rollup_increments(trip, sign=1):
+    """`$inc` fields adding (or, with sign=-1, removing) a trip in a bucket."""
+    increments = {
+        "trips": sign,
+        "points": sign * trip["points"],
+        "co2_g": 0,
+        "co2_saved_g": 0
+    }
+    for leg in trip["legs"]:
+        prefix = f"modes.{leg['mode']}"
+        increments["co2_g"] += sign * leg["co2_g"]
+        increments["co2_saved_g"] += sign * leg["co2_saved_g"]
+        for field in ("km", "co2_g", "co2_saved_g", "points"):
+            increments[f"{prefix}.{field}"] = increments.get(f"{prefix}.{field}", 0) + sign * leg[field]
+        increments[f"{prefix}.trips"] = increments.get(f"{prefix}.trips", 0) + sign
+    return increments
+
+
+def rollup_buckets(trip):
+    """`(bucket _id, period, start)` of the day and week buckets holding a trip."""
+    username = trip["meta"]["user"]
+    buckets = []
+    for period in ("day", "week"):
+        start = bucket_start(trip["ts"], period)
+        buckets.append((f"{username}|{period}|{start.date().isoformat()}", period, start))
+    return buckets
+
+
+def rollup_updates(trip):
+    """Upserts adding a trip to its day and week buckets unless they already count it.
+
+    A bucket that already lists the trip doesn't match, so the upsert fails
+    with a duplicate key error instead of counting it again.
+    """
+    increments = rollup_increments(trip)
+    username = trip["meta"]["user"]
+    return [
+        UpdateOne(
+            {"_id": bucket_id, "trip_ids": {"$ne": trip["_id"]}},
+            {
+                "$inc": increments,
+                "$push": {"trip_ids": trip["_id"]},
+                "$setOnInsert": {"user": username, "period": period, "start": start}
+            },
+            upsert=True
+        )
+        for bucket_id, period, start in rollup_buckets(trip)
+    ]
+
+
+def export_query(username, since=None, until=None):
+    """Filter for a user's trips in [since, until)."""
+    query = {"meta.user": username}
+    if since or until:
+        query["ts"] = {}
+        if since:
+            query["ts"]["$gte"] = since
+        if until:
+            query["ts"]["$lt"] = until
+    return query
+
+
+def to_payload(trip):
+    """A trip document as JSON-safe data (for a background job)."""
+    return dict(trip, _id=str(trip["_id"]), ts=trip["ts"].isoformat())
+
+
+def from_payload(payload):
+    return dict(payload, _id=ObjectId(payload["_id"]), ts=datetime.fromisoformat(payload["ts"]))
+
+
+def to_json_line(doc):
+    """One NDJSON line for an exported trip."""
+    doc.pop("_id", None)
+    doc["username"] = doc.pop("meta")["user"]
+    doc["ts"] = doc["ts"].replace(tzinfo=timezone.utc).isoformat()
+    return json.dumps(doc, separators=(",", ":")) + "\n"
+
+
+class TripStore:
+    def __init__(self, db):
+        self.trips = db[TRIPS_COLLECTION]
+        self.rollups = db[ROLLUPS_COLLECTION]
+
+    def record(self, trips, resume=False):
+        """Append trips and fold the ones stored into the rollups (two round trips).
+
+        With `resume` (a retry of an earlier attempt), trips already stored
+        under the same `_id` aren't inserted again, but still go through the
+        rollup write: if the earlier attempt died before it, this one
+        applies it, and buckets that already count a trip skip it.
+        """
+        if not trips:
+            return
+        pending = trips
+        if resume:
+            stored = {
+                doc["_id"] for doc in self.trips.find(
+                    {"_id": {"$in": [trip["_id"] for trip in trips]}}, {"_id": 1}
+                )
+            }
+            pending = [trip for trip in trips if trip["_id"] not in stored]
+        failed = None
+        if pending:
+            try:
+                self.trips.insert_many(pending, ordered=False)
+            except BulkWriteError as e:
+                # Unordered: the others were inserted, so count them before failing
+                failed = e
+                errors = {pending[error["index"]]["_id"] for error in e.details.get("writeErrors", [])}
+                trips = [trip for trip in trips if trip["_id"] not in errors]
+        if trips:
+            self._roll_up(trips)
+        if failed is not None:
+            raise failed
+
+    def _roll_up(self, trips):
+        updates = [update for trip in trips for update in rollup_updates(trip)]
+        try:
+            self.rollups.bulk_write(updates, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            # Either the bucket already counts the trip, or a concurrent upsert
+            # created it first; by now it exists, so a retry tells them apart
+            retry = [updates[error["index"]] for error in errors]
+            try:
+                self.rollups.bulk_write(retry, ordered=False)
+            except BulkWriteError as e:
+                if any(error["code"] != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                    raise
+
+    def export(self, username, since=None, until=None, batch_size=EXPORT_BATCH_SIZE):
+        """Cursor over a user's trips, oldest first, fetched `batch_size` at a time."""
+        return self.trips.find(export_query(username, since, until)).sort("ts", 1).batch_size(batch_size)
+
+    def stats(self, username, period="week", since=None, limit=52):
+        """Most recent rollup buckets for a user, newest first."""
+        query = {"user": username, "period": period}
+        if since:
+            query["start"] = {"$gte": since}
+        buckets = self.rollups.find(query, ROLLUP_STATS_PROJECTION).sort("start", -1).limit(limit)
+        return [
+            dict(bucket, start=bucket["start"].date().isoformat())
+            for bucket in buckets
+        ]
@@ -0,0 +1,60 @@
+"""Atomic, idempotent point awards on the Users collection.
+
+A trip's points and per-mode trip counters are applied with one
+`find_one_and_update`, which also returns the new totals. When the client
+sends a `trip_id`, it is remembered in the user's `trip_ids` (the last
+`TRIP_ID_HISTORY` ids), and the filter skips users who already have it, so a
+retried request can't award the same trip twice.
+"""
+import os
+
+from pymongo import ReturnDocument
+
+TRIP_ID_HISTORY = int(os.getenv("TRIP_ID_HISTORY", 200))
+
+# Fields returned after an award; trip_ids stays on the server
+USER_TOTALS_PROJECTION = {
+    "_id": 0,
+    "username": 1,
+    "sustainability_points": 1,
+    "walking_trips": 1,
+    "driving_trips": 1,
+    "transit_trips": 1,
+    "bicycling_trips": 1
+}
+
+
+def award_filter(username, trip_id=None):
+    if trip_id is None:
+        return {"username": username}
+    return {"username": username, "trip_ids": {"$ne": trip_id}}
+
+
+def award_update(mode_points, trip_id=None):
+    """Update document for `{mode: points}` earned on one trip."""
+    increments = {"sustainability_points": sum(mode_points.values())}
+    for mode in mode_points:
+        increments[f"{mode}_trips"] = increments.get(f"{mode}_trips", 0) + 1
+    update = {"$inc": increments}
+    if trip_id is not None:
+        update["$push"] = {"trip_ids": {"$each": [trip_id], "$slice": -TRIP_ID_HISTORY}}
+    return update
+
+
+def award_points(collection, username, mode_points, trip_id=None):
+    """Apply one trip's award; returns `(user, duplicate)`.
+
+    `user` holds the totals after the update (or the current totals for a
+    duplicate trip), and is None if the user doesn't exist.
+    """
+    user = collection.find_one_and_update(
+        award_filter(username, trip_id),
+        award_update(mode_points, trip_id),
+        projection=USER_TOTALS_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    if user is not None or trip_id is None:
+        return user, False
+    # Either the user is missing or this trip was already awarded
+    user = collection.find_one({"username": username}, USER_TOTALS_PROJECTION)
+    return user, user is not None
@@ -67,7 +67,7 @@ class _RoutePointsPageState extends State<RoutePointsPage> {
           _totalPointsEarned = responseData['total_points_earned'];
           _routeDetails = responseData['route_details'];
           _ecoFriendlyRoute = responseData['eco_friendly_route'];
-          _mapImageUrl = responseData['map_image']; 
+          _mapImageUrl = responseData['map_image_url'];
         });
 
         _showResultDialog();
@@ -100,8 +100,8 @@ class _RoutePointsPageState extends State<RoutePointsPage> {
           body: Center(
             child: InteractiveViewer(
               maxScale: 5.0,
-              child: Image.memory(
-                base64Decode(_mapImageUrl!.split(',')[1]),
+              child: Image.network(
+                _mapImageUrl!,
                 fit: BoxFit.contain,
                 width: double.infinity,
                 height: double.infinity,
@@ -41,6 +41,7 @@ class _SettingsPageState extends State<SettingsPage> {
 
     // Prepare the request body
     final Map<String, String> passwordData = {
+      'username': widget.currentUsername,
       'old_password': _currentPasswordController.text,
       'new_password': _newPasswordController.text,
     };